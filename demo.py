@@ -9,7 +9,7 @@ import cv2
 import numpy as np
 
 from lib.opts import opts
-from lib.detectors.ctdet_detector import CtdetDetector as Detector
+from lib.detectors.detector_factory import detector_factory
 from lib.datasets.dataset_factory import get_dataset
 from lib.datasets.dataset.visdrone2019DET import VISDRONE_class_name as visdrone_class_name
 from lib.datasets.dataset.uavdt import UAVDT_class_name as uavdt_class_name
@@ -53,36 +53,12 @@ def add_coco_bbox(show_image, bbox, cat, conf=1, show_txt=True, img_id='default'
 
 
 
-def restore_image(padded_image, original_shape):
-
-    original_height, original_width = original_shape[:2]
-    aspect_ratio = original_width / original_height
-    
-    if original_width > original_height:
-        new_width = 1024
-        new_height = int(new_width / aspect_ratio)
-    else:
-        new_height = 1024
-        new_width = int(new_height * aspect_ratio)
-    
-    if new_width < 1024:
-        padding_width = (1024 - new_width) // 2
-        cropped_image = padded_image[:, padding_width:padding_width + new_width]
-    else:
-        padding_height = (1024 - new_height) // 2
-        cropped_image = padded_image[padding_height:padding_height + new_height, :]
-
-    restored_image = cv2.resize(cropped_image, (original_width, original_height), interpolation=cv2.INTER_CUBIC)
-    
-    return restored_image
-
-
 def demo(opt):
     Dataset = get_dataset(opt.dataset, opt.task)
     opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
     os.environ['CUDA_VISIBLE_DEVICES'] = opt.gpus_str
     opt.debug = max(opt.debug, 1)
-    detector = Detector(opt)
+    detector = detector_factory[opt.detector](opt)
 
     if opt.demo == 'webcam':
         cam = cv2.VideoCapture(0 if opt.demo == 'webcam' else opt.demo)
@@ -108,7 +84,14 @@ def demo(opt):
         for image_name in image_names:
             print(image_name)
             image = cv2.imread(image_name)
-            image_shape = image.shape
+            save_name = os.path.join(opt.demo_save_path, image_name.split('/')[-1])
+            os.makedirs(os.path.dirname(save_name), exist_ok=True)
+
+            if opt.demo_deblur_only:
+                cv2.imwrite(save_name, detector.restore(image))
+                print('save_name:', save_name)
+                continue
+
             show_image = image.copy()
 
             ret = detector.run(image, demo_with_deblur=opt.demo_with_deblur)
@@ -120,24 +103,15 @@ def demo(opt):
             results = ret['results']
 
             if opt.demo_with_deblur:
-                show_image = ret['deblur_out']
-                show_image = show_image.cpu()
-                show_image = show_image.squeeze(0).numpy()
-                show_image = show_image.transpose(1, 2, 0)
-                show_image = ((show_image * opt.std + opt.mean) * 255.).astype(np.uint8)
-                print(np.min(show_image), np.max(show_image))
-                show_image = np.clip(show_image, 0, 255).astype(np.uint8)
-                show_image = restore_image(show_image, image_shape)
+                show_image = detector.post_process_deblur(ret['deblur_out'][0], ret['meta'], image.shape)
 
             for j in range(1, opt.num_classes + 1):
                 for bbox in results[j]:
                     if bbox[4] > opt.vis_thresh:
-                        result_image = add_coco_bbox(show_image, bbox[:4], j - 1, bbox[4])
+                        show_image = add_coco_bbox(show_image, bbox[:4], j - 1, bbox[4])
 
-            save_name = os.path.join(opt.demo_save_path, image_name.split('/')[-1])
             print('save_name:', save_name)
-            os.makedirs(os.path.dirname(save_name), exist_ok=True)
-            cv2.imwrite(save_name, result_image)
+            cv2.imwrite(save_name, show_image)
 
 
 if __name__ == '__main__':
@@ -9,6 +9,8 @@ import json
 import os
 import torch.utils.data as data
 
+from lib.utils.coco_stream import evaluate_stream
+
 
 UAVDT_num_classes = 3
 UAVDT_class_name = ['car', 'truck', 'bus']
@@ -102,6 +104,14 @@ class UAVDT(data.Dataset):
         coco_eval = COCOeval(self.coco, coco_dets, "bbox")
         coco_eval.evaluate()
         coco_eval.accumulate()
+        return self._summarize(coco_eval, save_dir)
+
+    def run_eval_stream(self, results_path, save_dir):
+        # results written by ResultsWriter, evaluated chunk by chunk
+        coco_eval = evaluate_stream(self.coco, results_path, self._valid_ids)
+        return self._summarize(coco_eval, save_dir)
+
+    def _summarize(self, coco_eval, save_dir):
         # coco_eval.summarize()	#原始是这一行，为了保存结果到文本使用下面的代码
 
         ################### 保存结果到本地
@@ -121,3 +131,4 @@ class UAVDT(data.Dataset):
         with open(os.path.join(save_dir, 'result.txt'), 'a') as f:
             f.write(results)
             f.write('\n')
+        return coco_eval.stats
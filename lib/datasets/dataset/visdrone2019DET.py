@@ -9,6 +9,8 @@ import json
 import os
 import torch.utils.data as data
 
+from lib.utils.coco_stream import evaluate_stream
+
 VISDRONE_num_classes = 4
 VISDRONE_class_name = ['people', 'car', 'truck', 'bus']
 VISDRONE_valid_ids = [0, 1, 2, 3]
@@ -109,6 +111,14 @@ class VisDrone2019DET(data.Dataset):
         coco_eval = COCOeval(self.coco, coco_dets, "bbox")
         coco_eval.evaluate()
         coco_eval.accumulate()
+        return self._summarize(coco_eval, save_dir)
+
+    def run_eval_stream(self, results_path, save_dir):
+        # results written by ResultsWriter, evaluated chunk by chunk
+        coco_eval = evaluate_stream(self.coco, results_path, self._valid_ids)
+        return self._summarize(coco_eval, save_dir)
+
+    def _summarize(self, coco_eval, save_dir):
         # coco_eval.summarize()	#原始是这一行，为了保存结果到文本使用下面的代码
 
         ################### 保存结果到本地
@@ -128,3 +138,4 @@ class VisDrone2019DET(data.Dataset):
         with open(os.path.join(save_dir, 'result.txt'), 'a') as f:
             f.write(results)
             f.write('\n')
+        return coco_eval.stats
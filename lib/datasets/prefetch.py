@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle
+
+import cv2
+import numpy as np
+import torch
+
+from lib.utils.result_cache import hash_array
+from lib.utils.shm_ring import ShmRingLoader
+
+
+class PrefetchDataset(torch.utils.data.Dataset):
+    def __init__(self, opt, dataset, pre_process_func):
+        self.images = dataset.images
+        self.load_image_func = dataset.coco.loadImgs
+        self.sharp_img_dir = dataset.sharp_img_dir
+        self.blur_img_dir = dataset.blur_img_dir
+        if opt.inp_sharp_or_blur == 'sharp':
+            self.img_dir = self.sharp_img_dir
+        elif opt.inp_sharp_or_blur == 'blur' or opt.inp_sharp_or_blur == 'SB_deblur':
+            self.img_dir = self.blur_img_dir
+
+        self.pre_process_func = pre_process_func
+        self.opt = opt
+    
+    def __getitem__(self, index):
+        img_id = self.images[index]
+        img_info = self.load_image_func(ids=[img_id])[0]
+        img_path = os.path.join(self.img_dir, img_info['file_name'])
+        image = cv2.imread(img_path)
+        images, meta = {}, {}
+        for scale in self.opt.test_scales:
+            images[scale], meta[scale] = self.pre_process_func(image, scale)
+        return img_id, {'images': images, 'image': image, 'meta': meta}
+
+    def __len__(self):
+        return len(self.images)
+
+
+def use_shm_prefetch(opt):
+    # the ring carries fixed size warped inputs only: no tiling, original image or per-frame resolution
+    return opt.prefetch_transport == 'shm' and opt.fix_res and opt.tile_size == 0 and \
+        opt.detector in ('ctdet', 'cascade') and opt.debug < 2
+
+
+class ShmPrefetcher(object):
+    '''Loads and warps the split in worker processes into shared memory ring slots.
+
+    Each slot holds the uint8 network input of every test scale; normalization
+    and the flip copy happen in detector.run. Only the meta, and the image hash
+    when the result cache is on, are pickled.
+    '''
+    def __init__(self, opt, dataset, detector):
+        img_dir = dataset.sharp_img_dir if opt.inp_sharp_or_blur == 'sharp' else dataset.blur_img_dir
+        items = [(img_id, os.path.join(img_dir, dataset.coco.loadImgs(ids=[img_id])[0]['file_name']))
+                 for img_id in dataset.images]
+        self.opt = opt
+        self.detector = detector
+        self.loader = ShmRingLoader(items, self.load, (len(opt.test_scales), opt.input_h, opt.input_w, 3),
+                                    num_workers=opt.prefetch_workers, depth=opt.prefetch_depth)
+        self.num_images = 0
+        self.ipc_bytes = 0
+        self.pickle_bytes = 0
+
+    def load(self, img_path, out):
+        image = cv2.imread(img_path)
+        meta = {}
+        for i, scale in enumerate(self.opt.test_scales):
+            out[i], meta[scale] = self.detector.warp_input(image, scale)
+        image_hash = hash_array(image) if self.opt.result_cache != '' else None
+        return {'meta': meta, 'image_hash': image_hash, 'image_shape': image.shape}
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for img_id, slot, inputs, info in self.loader:
+            yield img_id, {'inputs': {scale: inputs[i] for i, scale in enumerate(self.opt.test_scales)},
+                           'meta': info['meta'], 'image_hash': info['image_hash']}
+            self.loader.release(slot)
+            self.num_images += 1
+            self.ipc_bytes += self.loader.slot_bytes + len(pickle.dumps(info))
+            # what PrefetchDataset moves: the original image and float32 inputs (x2 with flip) of every scale
+            copies = 2 if self.opt.flip_test else 1
+            self.pickle_bytes += int(np.prod(info['image_shape'])) + len(self.opt.test_scales) * copies * \
+                self.opt.input_h * self.opt.input_w * 3 * 4
+
+    def summary(self):
+        n = max(self.num_images, 1)
+        return 'shm prefetch: {:.2f}MB per image moved between processes instead of {:.2f}MB ({:.2f}MB saved)'.format(
+            self.ipc_bytes / n / 2 ** 20, self.pickle_bytes / n / 2 ** 20, (self.pickle_bytes - self.ipc_bytes) / n / 2 ** 20)
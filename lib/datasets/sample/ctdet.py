@@ -10,6 +10,7 @@ from utils.image import flip, color_aug
 from utils.image import get_affine_transform, affine_transform
 from utils.image import gaussian_radius, draw_umich_gaussian, draw_msra_gaussian
 from utils.image import draw_dense_reg
+from utils.image_cache import ImageCache
 import math
 
 class CTDetDataset(data.Dataset):
@@ -24,17 +25,39 @@ class CTDetDataset(data.Dataset):
                 i *= 2
         return border // i
 
-    def __getitem__(self, index):
+    def _load_image(self, img_id, stream, path):
+        # decoded image from --image_cache (a read-only view), or the JPEG when it is not cached
+        if self.opt.image_cache != '':
+            if getattr(self, 'image_cache', None) is None:
+                self.image_cache = ImageCache(self.opt.image_cache, self.split)
+                sources = {'sharp': self.sharp_img_dir, 'blur': self.blur_img_dir}
+                if self.image_cache.sources != sources:
+                    raise ValueError('--image_cache {} was built from {}, not {}'.format(
+                        self.opt.image_cache, self.image_cache.sources, sources))
+            img = self.image_cache.get(img_id, stream)
+            if img is not None:
+                return img
+        return cv2.imread(path)
+
+    def load_sample(self, index):
+        # image id, decoded sharp / blur images and COCO annotations of a sample
         img_id = self.images[index]
         file_name = self.coco.loadImgs(ids=[img_id])[0]['file_name']
         sharp_img_path = os.path.join(self.sharp_img_dir, file_name)
         blur_img_path = os.path.join(self.blur_img_dir, file_name)
         ann_ids = self.coco.getAnnIds(imgIds=[img_id])
         anns = self.coco.loadAnns(ids=ann_ids)
+
+        sharp_img = self._load_image(img_id, 'sharp', sharp_img_path)
+        blur_img = self._load_image(img_id, 'blur', blur_img_path)
+        return img_id, sharp_img, blur_img, anns
+
+    def __getitem__(self, index):
+        return self.build_sample(*self.load_sample(index))
+
+    def build_sample(self, img_id, sharp_img, blur_img, anns):
+        # augmentation and CenterNet targets, anns need 'bbox' (x, y, w, h) and 'category_id'
         num_objs = min(len(anns), self.max_objs)
-        
-        sharp_img = cv2.imread(sharp_img_path)
-        blur_img = cv2.imread(blur_img_path)
 
         height, width = sharp_img.shape[0], sharp_img.shape[1]
         c = np.array([sharp_img.shape[1] / 2., sharp_img.shape[0] / 2.], dtype=np.float32)
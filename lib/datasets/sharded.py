@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import random
+
+import cv2
+import numpy as np
+import torch
+
+from lib.utils.shards import read_shard_index, read_shard, unpack_anns
+
+
+class ShardedDataset(torch.utils.data.IterableDataset):
+    '''Samples of `dataset` (a CTDetDataset split) read from the shards of tools/pack_shards.py.
+
+    The shard order is shuffled per epoch (`set_epoch`), the same way in every
+    loader worker, which then takes every num_workers-th shard. Records go
+    through a buffer of `shuffle_buffer` still-encoded samples, from which a
+    random one is decoded and handed to `dataset.build_sample`, so
+    augmentation, targets and metadata are those of the dataset. Use with a
+    DataLoader without shuffle.
+    '''
+    def __init__(self, dataset, shard_dir, shuffle=True, shuffle_buffer=256, read_size=64 * 2 ** 20, seed=317):
+        self.dataset = dataset
+        self.shard_dir = shard_dir
+        self.index = read_shard_index(shard_dir, dataset.split)
+        sources = {'sharp': dataset.sharp_img_dir, 'blur': dataset.blur_img_dir}
+        if self.index['sources'] != sources:
+            raise ValueError('--shards {} were packed from {}, not {}'.format(shard_dir, self.index['sources'], sources))
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer if shuffle else 0
+        self.read_size = read_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.index['num_records']
+
+    def _records(self, shards):
+        for shard in shards:
+            for record in read_shard(os.path.join(self.shard_dir, shard['file']), self.read_size):
+                yield record
+
+    def _build(self, record):
+        img_id, sharp_bytes, blur_bytes, rows = record
+        sharp_img = cv2.imdecode(np.frombuffer(sharp_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        blur_img = cv2.imdecode(np.frombuffer(blur_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self.dataset.build_sample(img_id, sharp_img, blur_img, unpack_anns(rows))
+
+    def __iter__(self):
+        shards = list(self.index['shards'])
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        worker = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        shards = shards[worker_id::num_workers]
+        rng = random.Random((self.seed + self.epoch) * 1000 + worker_id)
+
+        buffer = []
+        for record in self._records(shards):
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(record)
+                continue
+            if self.shuffle_buffer > 0:
+                i = rng.randrange(len(buffer))
+                record, buffer[i] = buffer[i], record
+            yield self._build(record)
+        rng.shuffle(buffer)
+        for record in buffer:
+            yield self._build(record)
@@ -0,0 +1,42 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from lib.detectors.ctdet_detector import CtdetDetector
+from lib.detectors.latency_controller import LatencyController, parse_ladder, default_ladder
+
+
+class AdaptiveDetector(CtdetDetector):
+    '''CtdetDetector whose input size, test scales and flip-test follow a LatencyController.
+
+    Needs frames pre-processed by the detector itself, the prefetch workers would
+    keep the configuration they were started with: test.py runs it without them.
+    '''
+    def __init__(self, opt):
+        super(AdaptiveDetector, self).__init__(opt)
+        ladder = parse_ladder(opt.latency_ladder) if opt.latency_ladder != '' else default_ladder(opt)
+        self.controller = LatencyController(ladder, opt.latency_slo / 1000., percentile=opt.latency_percentile,
+                                            window=opt.latency_window)
+
+
+    def set_config(self, config):
+        self.opt.input_h = self.opt.input_w = self.opt.input_res = config['input_res']
+        self.opt.output_h = self.opt.output_w = self.opt.output_res = config['input_res'] // self.opt.down_ratio
+        self.opt.flip_test = config['flip_test']
+        self.scales = config['test_scales']
+
+
+    def run(self, image_or_path_or_tensor, meta=None, demo_with_deblur=False):
+        config = self.controller.config
+        self.set_config(config)
+        ret = super(AdaptiveDetector, self).run(image_or_path_or_tensor, meta, demo_with_deblur)
+        ret['config'] = dict(config, level=self.controller.level)
+        if not ret.get('cached', False):
+            # a cache hit says nothing about the cost of the current rung
+            self.controller.update(ret['tot'])
+        return ret
+
+
+    def summary(self):
+        return 'latency controller: level {} {} | {} switches'.format(
+            self.controller.level, self.controller.config, self.controller.num_switches)
@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as np
+import torch
+
+from lib.detectors.ctdet_detector import CtdetDetector
+from lib.utils.blur import blur_measures
+
+
+class BlurRouteDetector(CtdetDetector):
+    '''Routes each frame by its estimated blur.
+
+    pre_process scores the original frame with --blur_measure. Frames sharper than
+    --route_sharpness go to the cheaper sharp-trained --route_sharp_arch, the
+    motion-blurred ones to the SB_deblur model given by --arch / --load_model.
+    Both models are loaded once and a batch is split between them. Frames are
+    scored whole, so tiled inference (--tile_size) is not supported.
+    '''
+    cache_opts = CtdetDetector.cache_opts + ('route_sharp_arch', 'blur_measure', 'route_sharpness')
+    cache_checkpoints = CtdetDetector.cache_checkpoints + ('route_sharp_model',)
+
+    def __init__(self, opt):
+        if opt.tile_size > 0:
+            raise ValueError('--detector blur_route scores whole frames, it does not support --tile_size')
+        super(BlurRouteDetector, self).__init__(opt)
+        self.sharp_model = self.build_model(opt.route_sharp_arch, opt.route_sharp_model)
+        self.measure = blur_measures[opt.blur_measure]
+        self.scores = []
+        self.route_time = 0
+        self.num_sharp = 0
+        self.num_blurred = 0
+
+
+    def pre_process(self, image, scale, meta=None):
+        start_time = time.time()
+        sharpness = self.measure(image)
+        route_time = time.time() - start_time
+        images, meta = super(BlurRouteDetector, self).pre_process(image, scale, meta)
+        meta['sharpness'] = sharpness
+        meta['route_time'] = route_time
+        return images, meta
+
+
+    def process(self, images, return_time=False, demo_with_deblur=False, model=None, metas=None):
+        if model is not None or demo_with_deblur or metas is None:
+            return super(BlurRouteDetector, self).process(images, return_time, demo_with_deblur, model, metas)
+
+        sharpness = np.array([float(meta['sharpness']) for meta in metas])
+        sharp = sharpness >= self.opt.route_sharpness
+        self.scores.extend(sharpness.tolist())
+        self.route_time += sum(float(meta['route_time']) for meta in metas)
+        self.num_sharp += int(sharp.sum())
+        self.num_blurred += int((~sharp).sum())
+
+        dets = None
+        for route_model, mask in ((self.sharp_model, sharp), (self.model, ~sharp)):
+            inds = torch.from_numpy(np.nonzero(mask)[0]).to(images.device)
+            if len(inds) == 0:
+                continue
+            output, route_dets, forward_time = super(BlurRouteDetector, self).process(
+                images[self.flip_inds(inds)], return_time=True, model=route_model)
+            if dets is None:
+                dets = route_dets.new_zeros((len(mask),) + tuple(route_dets.shape[1:]))
+            dets[inds] = route_dets
+
+        if return_time:
+            return output, dets, forward_time
+        else:
+            return output, dets
+
+
+    def summary(self):
+        num_frames = max(self.num_sharp + self.num_blurred, 1)
+        scores = np.array(self.scores) if len(self.scores) > 0 else np.zeros(1)
+        return 'blur route: {} sharp -> {}, {} blurred -> {} | router {:.2f}ms/frame | ' \
+               '{} p10 {:.3f} p50 {:.3f} p90 {:.3f}'.format(
+                   self.num_sharp, self.opt.route_sharp_arch, self.num_blurred, self.opt.arch,
+                   1000 * self.route_time / num_frames, self.opt.blur_measure,
+                   *np.percentile(scores, [10, 50, 90]))
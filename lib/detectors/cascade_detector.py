@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+
+from lib.detectors.ctdet_detector import CtdetDetector
+from lib.utils.blur import batch_laplacian_variance
+
+
+class CascadeDetector(CtdetDetector):
+    '''Runs --cascade_arch (DREB_Net_tiny) on every frame and escalates to --arch only when needed.
+
+    Both models stay resident and share pre_process. A frame is escalated when the
+    tiny model's heatmap has many mid-confidence peaks (--escalate_low/high/peaks)
+    or when the input looks motion blurred (--escalate_sharpness).
+    '''
+    cache_opts = CtdetDetector.cache_opts + ('cascade_arch', 'escalate_policy', 'escalate_low',
+                                             'escalate_high', 'escalate_peaks', 'escalate_sharpness')
+    cache_checkpoints = CtdetDetector.cache_checkpoints + ('cascade_model',)
+
+    def __init__(self, opt):
+        super(CascadeDetector, self).__init__(opt)
+        self.tiny_model = self.build_model(opt.cascade_arch, opt.cascade_model)
+        self.policy = opt.escalate_policy.split(',')
+        self.num_frames = 0
+        self.num_escalated = 0
+
+
+    def escalate(self, images, dets):
+        if 'all' in self.policy:
+            return torch.ones(dets.size(0), dtype=torch.bool, device=dets.device)
+        mask = torch.zeros(dets.size(0), dtype=torch.bool, device=dets.device)
+        if 'peaks' in self.policy:
+            scores = dets[:, :, 4]
+            mid = ((scores >= self.opt.escalate_low) & (scores < self.opt.escalate_high)).sum(dim=1)
+            mask |= mid >= self.opt.escalate_peaks
+        if 'blur' in self.policy:
+            inputs = images[0::2] if self.opt.flip_test else images
+            sharpness = batch_laplacian_variance(inputs, self.mean.reshape(-1), self.std.reshape(-1))
+            mask |= sharpness < self.opt.escalate_sharpness
+        return mask
+
+
+    def process(self, images, return_time=False, demo_with_deblur=False, model=None, metas=None):
+        if model is not None or demo_with_deblur:
+            return super(CascadeDetector, self).process(images, return_time, demo_with_deblur, model, metas)
+
+        output, dets, forward_time = super(CascadeDetector, self).process(
+            images, return_time=True, model=self.tiny_model)
+        with torch.no_grad():
+            escalate = self.escalate(images, dets)
+        inds = escalate.nonzero()[:, 0]
+        self.num_frames += dets.size(0)
+        self.num_escalated += len(inds)
+        if len(inds) > 0:
+            full_output, full_dets, forward_time = super(CascadeDetector, self).process(
+                images[self.flip_inds(inds)], return_time=True, model=self.model)
+            dets[inds] = full_dets
+            if len(inds) == dets.size(0):
+                output = full_output
+        self.escalated = escalate.cpu().numpy()
+
+        if return_time:
+            return output, dets, forward_time
+        else:
+            return output, dets
+
+
+    def run(self, image_or_path_or_tensor, meta=None, demo_with_deblur=False):
+        ret = super(CascadeDetector, self).run(image_or_path_or_tensor, meta, demo_with_deblur)
+        if ret.get('cached', False):
+            return ret
+        ret['escalated'] = bool(self.escalated.any())
+        ret['escalation_rate'] = self.escalation_rate()
+        return ret
+
+
+    def escalation_rate(self):
+        return self.num_escalated / max(self.num_frames, 1)
+
+
+    def summary(self):
+        return 'cascade: {} / {} frames escalated to {} ({:.1f}%)'.format(
+            self.num_escalated, self.num_frames, self.opt.arch, 100 * self.escalation_rate())
@@ -0,0 +1,93 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as np
+
+from lib.detectors.ctdet_detector import CtdetDetector
+from lib.utils.image import get_affine_transform, affine_transform, get_tile_centers
+
+
+class CoarseToFineDetector(CtdetDetector):
+    '''Two-pass detector for large aerial frames.
+
+    The whole frame is first run once at the network resolution, also under
+    --keep_res, either through --coarse_arch (e.g. DREB_Net_tiny) or through
+    the main model. Only the full-resolution tiles whose coarse heatmap peak reaches --coarse_thresh are
+    re-run, the remaining tiles (sky, fields, water) are skipped.
+    '''
+    cache_opts = CtdetDetector.cache_opts + ('coarse_arch', 'coarse_thresh')
+    cache_checkpoints = CtdetDetector.cache_checkpoints + ('coarse_model',)
+
+    def __init__(self, opt):
+        super(CoarseToFineDetector, self).__init__(opt)
+        if opt.coarse_arch != '':
+            self.coarse_model = self.build_model(opt.coarse_arch, opt.coarse_model)
+        else:
+            self.coarse_model = self.model
+        self.tile_size = opt.tile_size if opt.tile_size > 0 else max(opt.input_h, opt.input_w)
+
+
+    def region_peak(self, peak, trans, c, s):
+        out_height, out_width = peak.shape
+        x0, y0 = affine_transform(c - s / 2., trans)
+        x1, y1 = affine_transform(c + s / 2., trans)
+        x0, y0 = max(int(np.floor(x0)), 0), max(int(np.floor(y0)), 0)
+        x1, y1 = min(int(np.ceil(x1)), out_width - 1), min(int(np.ceil(y1)), out_height - 1)
+        if x1 < x0 or y1 < y0:
+            return 0.
+        return float(peak[y0:y1 + 1, x0:x1 + 1].max())
+
+
+    def run(self, image_or_path_or_tensor, meta=None, demo_with_deblur=False):
+        if demo_with_deblur:
+            raise ValueError('demo_with_deblur restores whole frames, --detector coarse_to_fine does not support it')
+        start_time = time.time()
+        image = self.load_image(image_or_path_or_tensor)
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key, ret = self.cache_lookup(image, start_time)
+            if ret is not None:
+                return ret
+        loaded_time = time.time()
+        height, width = image.shape[0:2]
+
+        # coarse pass over the whole frame downscaled to the network input, --keep_res or not
+        images, meta = self.pre_process_region(
+            image, np.array([width / 2., height / 2.], dtype=np.float32), float(max(height, width)))
+        images = images.to(self.opt.device)
+        output, dets = self.process(images, model=self.coarse_model)
+        coarse_dets = self.post_process(dets, meta)
+        peak = output['hm'][0].max(dim=0)[0].cpu().numpy()
+        self.synchronize()
+        coarse_time = time.time()
+
+        # fine pass on the tiles the coarse heatmap fires on
+        s = float(self.tile_size)
+        centers = get_tile_centers(height, width, self.tile_size, self.opt.tile_overlap)
+        trans = get_affine_transform(meta['c'], meta['s'], 0, [meta['out_width'], meta['out_height']])
+        active = [c for c in centers if self.region_peak(peak, trans, c, s) >= self.opt.coarse_thresh]
+        detections, times = self.detect_regions(image, active, s)
+
+        merge_start_time = time.time()
+        results = self.merge_tile_outputs([coarse_dets] + detections)
+        end_time = time.time()
+
+        # fraction of full resolution pixels that were never re-run, on a 1/8 grid
+        mask = np.zeros(((height + 7) // 8, (width + 7) // 8), dtype=bool)
+        for c in active:
+            x0, y0 = np.maximum((c - s / 2.) // 8, 0).astype(np.int32)
+            x1, y1 = np.ceil((c + s / 2.) / 8).astype(np.int32)
+            mask[y0:y1, x0:x1] = True
+
+        ret = {'results': results, 'tot': end_time - start_time, 'load': loaded_time - start_time,
+               'coarse': coarse_time - loaded_time, 'merge': end_time - merge_start_time,
+               'num_tiles': len(centers), 'num_active_tiles': len(active),
+               'skipped_fraction': 1. - float(mask.mean()), 'meta': meta, 'deblur_out': None}
+        ret.update(times)
+        ret['net'] += ret['coarse']
+        if cache_key is not None:
+            self.result_cache.put(cache_key, results)
+        return ret
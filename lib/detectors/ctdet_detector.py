@@ -10,10 +10,13 @@ import torch
 
 from lib.models.decode import ctdet_decode
 from lib.models.utils import flip_tensor
-from lib.models.model import create_model, load_model
-from lib.utils.image import get_affine_transform
-from lib.utils.post_process import ctdet_post_process
+from lib.models.deploy import build_model
+from lib.models.model import stripped_modules
+from lib.utils.image import get_affine_transform, crop, get_tile_centers
+from lib.utils.post_process import ctdet_post_process, nms
 from lib.utils.debugger import Debugger
+from lib.utils.result_cache import ResultCache, hash_array, hash_file
+from lib.utils.utils import configure_cpu
 
 
 try:
@@ -25,28 +28,99 @@ except:
 
 
 class CtdetDetector(object):
+    # opts the detections depend on, part of the result cache key
+    cache_opts = ('arch', 'heads', 'head_conv', 'input_h', 'input_w', 'fix_res', 'pad', 'mean', 'std',
+                  'flip_test', 'nms', 'K', 'inp_sharp_or_blur', 'tile_size', 'tile_overlap', 'tile_nms_thresh')
+    # opts naming checkpoints, hashed by content
+    cache_checkpoints = ('load_model',)
+
     def __init__(self, opt):
         if opt.gpus[0] >= 0:
             opt.device = torch.device('cuda')
         else:
             opt.device = torch.device('cpu')
+        configure_cpu(opt.intra_threads, opt.inter_threads, opt.cv_threads, opt.cpu_affinity)
         
         print('Creating model...')
-        self.model = create_model(opt.arch, opt.heads, opt.head_conv)
-        self.model = load_model(self.model, opt.load_model)
-        self.model = self.model.to(opt.device)
-        self.model.eval()
+        self.opt = opt
+        self.model = self.build_model(opt.arch, opt.load_model)
+        # a slim export drops the deblur decoder unless kept, restore / demo_with_deblur need it
+        self.stripped = stripped_modules(opt.load_model)
 
         self.mean = np.array(opt.mean, dtype=np.float32).reshape(1, 1, 3)
         self.std = np.array(opt.std, dtype=np.float32).reshape(1, 1, 3)
         self.max_per_image = 100
         self.num_classes = opt.num_classes
         self.scales = opt.test_scales
-        self.opt = opt
         self.pause = True
 
+        self.result_cache = None
+        if opt.result_cache != '':
+            self.result_cache = ResultCache(opt.result_cache, max_size=int(opt.result_cache_size * 2 ** 20))
+            self.checkpoint_hashes = [hash_file(getattr(opt, k)) if getattr(opt, k) != '' else ''
+                                      for k in self.cache_checkpoints]
 
-    def pre_process(self, image, scale, meta=None):
+
+    def build_model(self, arch, model_path):
+        # --deploy_transforms are applied once, --prepared_cache keeps the result across starts
+        transforms = [t for t in self.opt.deploy_transforms.split(',') if t != '']
+        model = build_model(arch, self.opt.heads, self.opt.head_conv, model_path, transforms,
+                            cache_dir=self.opt.prepared_cache, input_shape=(self.opt.input_h, self.opt.input_w))
+        model = model.to(self.opt.device)
+        model.eval()
+        if self.opt.memory_plan and self.opt.device.type == 'cpu':
+            # imported on use, it relies on torch >= 2.0 and a private dispatch API
+            from lib.models.memory_plan import PlannedModel
+            model = PlannedModel(model)
+        return model
+
+
+    def check_deblur(self):
+        if len(self.stripped) > 0:
+            raise ValueError('{} was exported without the deblur decoder ({}), re-export it with '
+                             'tools/export_inference_model.py --slim_keep_deblur to restore frames'.format(
+                                 self.opt.load_model, ', '.join(self.stripped)))
+
+
+    def synchronize(self):
+        if self.opt.device.type == 'cuda':
+            torch.cuda.synchronize()
+
+
+    def load_image(self, image_or_path_or_tensor):
+        if isinstance(image_or_path_or_tensor, np.ndarray):
+            return image_or_path_or_tensor
+        elif type(image_or_path_or_tensor) == type (''):
+            return cv2.imread(image_or_path_or_tensor)
+        else:
+            return image_or_path_or_tensor['image'][0].numpy()
+
+
+    def cache_lookup(self, image, start_time, image_hash=None):
+        '''Returns (key, ret), ret is None unless the detections of `image` are cached.'''
+        state = [(k, getattr(self.opt, k)) for k in self.cache_opts] + [('scales', self.scales)]
+        image_hash = hash_array(image) if image_hash is None else image_hash
+        key = self.result_cache.key(image_hash, self.opt.detector, state, *self.checkpoint_hashes)
+        if self.opt.result_cache_bypass:
+            return key, None
+        results = self.result_cache.get(key)
+        if results is None:
+            return key, None
+        tot_time = time.time() - start_time
+        return key, {'results': results, 'tot': tot_time, 'load': tot_time,
+                     'pre': 0., 'net': 0., 'dec': 0., 'post': 0., 'merge': 0.,
+                     'meta': None, 'deblur_out': None, 'cached': True}
+
+
+    def flip_inds(self, inds):
+        # batch rows of the frames `inds`; with --flip_test the flipped copy sits right after its original
+        if not self.opt.flip_test:
+            return inds
+        return torch.stack([2 * inds, 2 * inds + 1], dim=1).view(-1)
+
+
+    def warp_input(self, image, scale):
+        # uint8 network input (inp_height, inp_width, 3) and its meta, before normalization
         height, width = image.shape[0:2]
         new_height = int(height * scale)
         new_width  = int(width * scale)
@@ -65,35 +139,72 @@ class CtdetDetector(object):
         inp_image = cv2.warpAffine(
             resized_image, trans_input, (inp_width, inp_height),
             flags=cv2.INTER_LINEAR)
+        meta = {'c': c, 's': s, 	# center, size
+                'out_height': inp_height // self.opt.down_ratio, 
+                'out_width': inp_width // self.opt.down_ratio}
+        return inp_image, meta
+
+
+    def pre_process(self, image, scale, meta=None):
+        inp_image, meta = self.warp_input(image, scale)
+        return self._to_input(inp_image), meta
+
+
+    def pre_process_region(self, image, c, s):
+        # square region of side s centred at c (full resolution coordinates) warped to the network input
+        inp_height, inp_width = self.opt.input_h, self.opt.input_w
+        inp_image = crop(image, c, s, [inp_width, inp_height])
+        images = self._to_input(inp_image)
+        meta = {'c': c, 's': s,
+                'out_height': inp_height // self.opt.down_ratio,
+                'out_width': inp_width // self.opt.down_ratio}
+        return images, meta
+
+
+    def _to_input(self, inp_image):
+        inp_height, inp_width = inp_image.shape[0:2]
         inp_image = ((inp_image / 255. - self.mean) / self.std).astype(np.float32)
 
         images = inp_image.transpose(2, 0, 1).reshape(1, 3, inp_height, inp_width)
         if self.opt.flip_test:
             images = np.concatenate((images, images[:, :, :, ::-1]), axis=0)
-        images = torch.from_numpy(images)
-        meta = {'c': c, 's': s, 	# center, size
-                'out_height': inp_height // self.opt.down_ratio, 
-                'out_width': inp_width // self.opt.down_ratio}
-        return images, meta
+        return torch.from_numpy(images)
 
 
-    def process(self, images, return_time=False, demo_with_deblur=False):
+    def input_from_uint8(self, inp_image):
+        # _to_input on the device: only the uint8 image is copied there
+        inp = torch.from_numpy(inp_image).to(self.opt.device, non_blocking=True)
+        inp = inp.permute(2, 0, 1).unsqueeze(0).float().div_(255.)
+        mean = torch.from_numpy(self.mean.reshape(3, 1, 1)).to(inp.device)
+        std = torch.from_numpy(self.std.reshape(3, 1, 1)).to(inp.device)
+        inp = (inp - mean) / std
+        if self.opt.flip_test:
+            inp = torch.cat((inp, inp.flip(3)), dim=0)
+        return inp
+
+
+    def process(self, images, return_time=False, demo_with_deblur=False, model=None, metas=None):
+        # metas: per-frame pre_process meta of the batch, for detectors that route frames
+        model = self.model if model is None else model
+        if demo_with_deblur:
+            self.check_deblur()
         with torch.no_grad():
             if demo_with_deblur == True:
-                output, deblur_out = self.model(images, 'train')
+                output, deblur_out = model(images, 'train')
                 output = output[-1]
             elif self.opt.inp_sharp_or_blur in ('sharp', 'blur'):
-                output = self.model(images)[-1]
+                output = model(images)[-1]
             elif self.opt.inp_sharp_or_blur == 'SB_deblur':
-                output = self.model(images, 'val')[-1]
+                output = model(images, 'val')[-1]
             hm = output['hm'].sigmoid_()
             wh = output['wh']
             reg = output['reg'] if self.opt.reg_offset else None
             if self.opt.flip_test:
-                hm = (hm[0:1] + flip_tensor(hm[1:2])) / 2
-                wh = (wh[0:1] + flip_tensor(wh[1:2])) / 2
-                reg = reg[0:1] if reg is not None else None
-            torch.cuda.synchronize()
+                # flipped copies are interleaved with the originals: [img0, img0_flip, img1, ...]
+                hm = (hm[0::2] + flip_tensor(hm[1::2])) / 2
+                wh = (wh[0::2] + flip_tensor(wh[1::2])) / 2
+                reg = reg[0::2] if reg is not None else None
+            self.synchronize()
             forward_time = time.time()
             dets = ctdet_decode(hm, wh, reg=reg, cat_spec_wh=self.opt.cat_spec_wh, K=self.opt.K)
             
@@ -117,47 +228,78 @@ class CtdetDetector(object):
         return dets[0]
 
 
+    def post_process_batch(self, dets, metas, scale=1):
+        return [self.post_process(dets[i:i + 1], meta, scale) for i, meta in enumerate(metas)]
+
+
     def run(self, image_or_path_or_tensor, meta=None, demo_with_deblur=False):
+        if demo_with_deblur and self.opt.tile_size > 0:
+            raise ValueError('demo_with_deblur restores whole frames, it does not support --tile_size')
         load_time, pre_time, net_time, dec_time, post_time = 0, 0, 0, 0, 0
         merge_time, tot_time = 0, 0
         debugger = Debugger(dataset=self.opt.dataset, ipynb=(self.opt.debug==3),
                             theme=self.opt.debugger_theme)
         start_time = time.time()
         pre_processed = False
+        image_hash = None
         if isinstance(image_or_path_or_tensor, np.ndarray):
             image = image_or_path_or_tensor
         elif type(image_or_path_or_tensor) == type (''): 
             image = cv2.imread(image_or_path_or_tensor)
+        elif 'inputs' in image_or_path_or_tensor:
+            # warped uint8 inputs from the shared memory prefetcher, no original image
+            image = None
+            image_hash = image_or_path_or_tensor.get('image_hash')
+            pre_processed_images = image_or_path_or_tensor
+            pre_processed = True
         else:
             image = image_or_path_or_tensor['image'][0].numpy()
             pre_processed_images = image_or_path_or_tensor
             pre_processed = True
         
+        cache_key = None
+        if self.result_cache is not None and not demo_with_deblur and (image is not None or image_hash is not None):
+            cache_key, ret = self.cache_lookup(image, start_time, image_hash)
+            if ret is not None:
+                return ret
+
         loaded_time = time.time()
         load_time += (loaded_time - start_time)
+
+        if self.opt.tile_size > 0:
+            ret = self.run_tiled(image)
+            ret['load'] = load_time
+            ret['tot'] += load_time
+            ret.update({'meta': None, 'deblur_out': None})
+            if cache_key is not None:
+                self.result_cache.put(cache_key, ret['results'])
+            return ret
         
         detections = []
         for scale in self.scales:
             scale_start_time = time.time()
             if not pre_processed:
                 images, meta = self.pre_process(image, scale, meta)
+            elif 'inputs' in pre_processed_images:
+                images = self.input_from_uint8(pre_processed_images['inputs'][scale])
+                meta = pre_processed_images['meta'][scale]
             else:
                 # import pdb; pdb.set_trace()
                 images = pre_processed_images['images'][scale][0]
                 meta = pre_processed_images['meta'][scale]
                 meta = {k: v.numpy()[0] for k, v in meta.items()}
             images = images.to(self.opt.device)
-            torch.cuda.synchronize()
+            self.synchronize()
             pre_process_time = time.time()
             pre_time += pre_process_time - scale_start_time
             
             if demo_with_deblur:
                 output, dets, forward_time, deblur_out = self.process(images, return_time=True, demo_with_deblur=demo_with_deblur)
             else:
-                output, dets, forward_time = self.process(images, return_time=True, demo_with_deblur=demo_with_deblur)
+                output, dets, forward_time = self.process(images, return_time=True, demo_with_deblur=demo_with_deblur, metas=[meta])
                 deblur_out = None
 
-            torch.cuda.synchronize()
+            self.synchronize()
             net_time += forward_time - pre_process_time
             decode_time = time.time()
             dec_time += decode_time - forward_time
@@ -166,26 +308,144 @@ class CtdetDetector(object):
                 self.debug(debugger, images, dets, output, scale)
             
             dets = self.post_process(dets, meta, scale)
-            torch.cuda.synchronize()
+            self.synchronize()
             post_process_time = time.time()
             post_time += post_process_time - decode_time
 
             detections.append(dets)
         
         results = self.merge_outputs(detections)
-        torch.cuda.synchronize()
+        self.synchronize()
         end_time = time.time()
         merge_time += end_time - post_process_time
         tot_time += end_time - start_time
 
         # if self.opt.debug >= 1:
         # 	self.show_results(debugger, image, results)
+
+        if cache_key is not None:
+            self.result_cache.put(cache_key, results)
         
         return {'results': results, 'tot': tot_time, 'load': load_time,
                 'pre': pre_time, 'net': net_time, 'dec': dec_time,
                 'post': post_time, 'merge': merge_time,
                 'meta': meta, 'deblur_out': deblur_out}
-    
+
+
+    def run_batch(self, images):
+        # one forward pass per scale over a list of frames (e.g. coming from different streams).
+        # frames are grouped by pre-processed shape, which is a single group with --fix_res.
+        pre_time, net_time, dec_time, post_time = 0, 0, 0, 0
+        start_time = time.time()
+        detections = [[] for _ in images]
+        for scale in self.scales:
+            scale_start_time = time.time()
+            groups = {}
+            for i, image in enumerate(images):
+                inp, meta = self.pre_process(image, scale)
+                groups.setdefault(tuple(inp.shape), []).append((i, inp, meta))
+            pre_time += time.time() - scale_start_time
+
+            for group in groups.values():
+                group_start_time = time.time()
+                inds = [i for i, _, _ in group]
+                metas = [meta for _, _, meta in group]
+                batch = torch.cat([inp for _, inp, _ in group], dim=0).to(self.opt.device)
+                self.synchronize()
+                pre_process_time = time.time()
+                pre_time += pre_process_time - group_start_time
+
+                output, dets, forward_time = self.process(batch, return_time=True, metas=metas)
+                self.synchronize()
+                net_time += forward_time - pre_process_time
+                decode_time = time.time()
+                dec_time += decode_time - forward_time
+
+                for i, dets_i in zip(inds, self.post_process_batch(dets, metas, scale)):
+                    detections[i].append(dets_i)
+                post_time += time.time() - decode_time
+
+        merge_start_time = time.time()
+        results = [self.merge_outputs(dets) for dets in detections]
+        end_time = time.time()
+        return {'results': results, 'tot': end_time - start_time, 'load': 0,
+                'pre': pre_time, 'net': net_time, 'dec': dec_time,
+                'post': post_time, 'merge': end_time - merge_start_time}
+
+
+    def restore(self, image):
+        return self.restore_batch([image])[0]
+
+
+    def restore_batch(self, images):
+        # deblurred frames only: the model runs in 'deblur' mode (stage0 + deblur U-Net), each output is
+        # warped back to its frame with the inverse of the pre_process transform
+        self.check_deblur()
+        restored = [None] * len(images)
+        groups = {}
+        for i, image in enumerate(images):
+            inp, meta = self.pre_process(image, 1)
+            if self.opt.flip_test:
+                inp = inp[0:1]
+            groups.setdefault(tuple(inp.shape), []).append((i, inp, meta))
+
+        for group in groups.values():
+            batch = torch.cat([inp for _, inp, _ in group], dim=0).to(self.opt.device)
+            with torch.no_grad():
+                deblur_out = self.model(batch, 'deblur')
+            for (i, _, meta), out in zip(group, deblur_out):
+                restored[i] = self.post_process_deblur(out, meta, images[i].shape)
+        return restored
+
+
+    def post_process_deblur(self, deblur_out, meta, image_shape):
+        # (3, inp_height, inp_width) normalized network output -> uint8 BGR image of the original frame size
+        out = deblur_out.permute(1, 2, 0).cpu().numpy()
+        out = np.clip((out * self.std + self.mean) * 255., 0, 255).astype(np.uint8)
+        inp_height, inp_width = out.shape[0:2]
+        trans = get_affine_transform(meta['c'], meta['s'], 0, [inp_width, inp_height], inv=1)
+        return cv2.warpAffine(out, trans, (image_shape[1], image_shape[0]), flags=cv2.INTER_CUBIC)
+
+
+    def run_tiled(self, image):
+        # full resolution tiles of --tile_size, --tile_batch tiles per forward pass.
+        # each tile keeps its own c/s so post_process maps detections straight back to the frame.
+        start_time = time.time()
+        height, width = image.shape[0:2]
+        centers = get_tile_centers(height, width, self.opt.tile_size, self.opt.tile_overlap)
+        detections, times = self.detect_regions(image, centers, float(self.opt.tile_size))
+
+        merge_start_time = time.time()
+        results = self.merge_tile_outputs(detections)
+        end_time = time.time()
+        ret = {'results': results, 'tot': end_time - start_time, 'load': 0,
+               'merge': end_time - merge_start_time, 'num_tiles': len(centers)}
+        ret.update(times)
+        return ret
+
+
+    def detect_regions(self, image, centers, s):
+        pre_time, net_time, dec_time, post_time = 0, 0, 0, 0
+        detections = []
+        for i in range(0, len(centers), self.opt.tile_batch):
+            group_start_time = time.time()
+            group = [self.pre_process_region(image, c, s) for c in centers[i:i + self.opt.tile_batch]]
+            images = torch.cat([inp for inp, _ in group], dim=0).to(self.opt.device)
+            metas = [meta for _, meta in group]
+            self.synchronize()
+            pre_process_time = time.time()
+            pre_time += pre_process_time - group_start_time
+
+            output, dets, forward_time = self.process(images, return_time=True, metas=metas)
+            self.synchronize()
+            net_time += forward_time - pre_process_time
+            decode_time = time.time()
+            dec_time += decode_time - forward_time
+
+            detections.extend(self.post_process_batch(dets, metas))
+            post_time += time.time() - decode_time
+        return detections, {'pre': pre_time, 'net': net_time, 'dec': dec_time, 'post': post_time}
+
 
     def merge_outputs(self, detections):
         results = {}
@@ -194,10 +454,25 @@ class CtdetDetector(object):
                 [detection[j] for detection in detections], axis=0).astype(np.float32)
             if len(self.scales) > 1 or self.opt.nms:
                 soft_nms(results[j], Nt=0.5, method=2)
+        return self._keep_top(results, self.max_per_image)
+
+
+    def merge_tile_outputs(self, detections):
+        # duplicates of objects cut by tile seams are removed with nms, the frame keeps the top K
+        results = {}
+        for j in range(1, self.num_classes + 1):
+            results[j] = np.concatenate(
+                [detection[j] for detection in detections], axis=0).astype(np.float32)
+            if len(results[j]) > 0:
+                results[j] = results[j][nms(results[j], self.opt.tile_nms_thresh)]
+        return self._keep_top(results, self.opt.K)
+
+
+    def _keep_top(self, results, max_per_image):
         scores = np.hstack(
             [results[j][:, 4] for j in range(1, self.num_classes + 1)])
-        if len(scores) > self.max_per_image:
-            kth = len(scores) - self.max_per_image
+        if len(scores) > max_per_image:
+            kth = len(scores) - max_per_image
             thresh = np.partition(scores, kth)[kth]
             for j in range(1, self.num_classes + 1):
                 keep_inds = (results[j][:, 4] >= thresh)
@@ -0,0 +1,17 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from lib.detectors.ctdet_detector import CtdetDetector
+from lib.detectors.coarse_to_fine_detector import CoarseToFineDetector
+from lib.detectors.cascade_detector import CascadeDetector
+from lib.detectors.blur_route_detector import BlurRouteDetector
+from lib.detectors.adaptive_detector import AdaptiveDetector
+
+detector_factory = {
+    'ctdet': CtdetDetector,
+    'coarse_to_fine': CoarseToFineDetector,
+    'cascade': CascadeDetector,
+    'blur_route': BlurRouteDetector,
+    'adaptive': AdaptiveDetector,
+}
@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+from collections import deque
+
+from lib.utils.utils import LatencyMeter
+
+
+class _Request(object):
+    def __init__(self, image):
+        self.image = image
+        self.arrival = time.time()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class DynamicBatcher(object):
+    '''Coalesces concurrent CtdetDetector requests into batches.
+
+    Callers block in `submit` while a single worker thread owns the detector and
+    runs `run_batch` on whatever is queued once `max_batch` requests are waiting
+    or the oldest one has waited `max_wait` seconds.
+    '''
+    def __init__(self, detector, max_batch=8, max_wait=0.03):
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.batch_sizes = [0] * (max_batch + 1)
+        self.latency = LatencyMeter()
+        self.queue_latency = LatencyMeter()
+        self.num_requests = 0
+        self.num_errors = 0
+        self.start_time = time.time()
+
+    def submit(self, image, timeout=None):
+        request = _Request(image)
+        with self.cond:
+            self.queue.append(request)
+            self.cond.notify()
+        if not request.done.wait(timeout):
+            raise RuntimeError('request timed out after {}s'.format(timeout))
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _next_batch(self):
+        with self.cond:
+            while self.running:
+                if len(self.queue) >= self.max_batch:
+                    break
+                if len(self.queue) > 0:
+                    wait = self.max_wait - (time.time() - self.queue[0].arrival)
+                    if wait <= 0:
+                        break
+                else:
+                    wait = None
+                self.cond.wait(wait)
+            batch = [self.queue.popleft() for _ in range(min(len(self.queue), self.max_batch))]
+        return batch
+
+    def _loop(self):
+        while self.running or len(self.queue) > 0:
+            batch = self._next_batch()
+            if len(batch) == 0:
+                continue
+            start_time = time.time()
+            try:
+                ret = self.detector.run_batch([request.image for request in batch])
+                for request, results in zip(batch, ret['results']):
+                    request.results = results
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            end_time = time.time()
+            with self.cond:
+                self.batch_sizes[len(batch)] += 1
+                for request in batch:
+                    self.queue_latency.update(start_time - request.arrival)
+                    self.latency.update(end_time - request.arrival)
+                self.num_requests += len(batch)
+                self.num_errors += len(batch) if batch[0].error is not None else 0
+            for request in batch:
+                request.done.set()
+
+    def start(self):
+        self.running = True
+        self.start_time = time.time()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def metrics(self):
+        with self.cond:
+            elapsed = time.time() - self.start_time
+            return {'queue_depth': len(self.queue),
+                    'requests': self.num_requests,
+                    'errors': self.num_errors,
+                    'throughput': self.num_requests / elapsed if elapsed > 0 else 0.,
+                    'batch_size_hist': {str(size): count for size, count in enumerate(self.batch_sizes) if count > 0},
+                    'latency': self.latency.summary(),
+                    'queue_latency': self.queue_latency.summary(),
+                    'max_batch': self.max_batch,
+                    'max_wait': self.max_wait}
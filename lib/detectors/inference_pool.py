@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing as mp
+import os
+import traceback
+
+import torch
+
+# the timings of CtdetDetector.run sent back with each result
+time_stats = ['tot', 'load', 'pre', 'net', 'dec', 'post', 'merge']
+
+
+def _private_memory():
+    # MB of memory only this process maps (not shared with the parent or the other workers)
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        return 0.
+    with open('/proc/self/smaps_rollup') as f:
+        return sum(int(l.split()[1]) for l in f if l.startswith(('Private_Clean', 'Private_Dirty'))) / 1024
+
+
+def _worker(detector, items, threads, queue):
+    torch.set_num_threads(threads)
+    try:
+        for key, item in items:
+            ret = detector.run(item)
+            queue.put((key, ret['results'], {t: float(ret.get(t, 0.)) for t in time_stats}))
+        queue.put((None, 'done', _private_memory()))
+    except Exception:
+        queue.put((None, 'error', traceback.format_exc()))
+
+
+class InferencePool(object):
+    '''Runs one CPU detector in several forked worker processes.
+
+    The model is loaded once in the parent and its tensors are moved to shared
+    memory before forking, so weight memory does not grow with the number of
+    workers. Each worker runs `detector.run` on an interleaved shard of the
+    items and streams the results back.
+    '''
+    def __init__(self, detector, num_workers, threads=0):
+        if detector.opt.device.type != 'cpu':
+            raise ValueError('InferencePool forks the detector and only supports CPU inference (--gpus -1).')
+        self.detector = detector
+        self.num_workers = num_workers
+        self.threads = threads if threads > 0 else max(len(os.sched_getaffinity(0)) // num_workers, 1)
+        for model in [m for m in vars(detector).values() if isinstance(m, torch.nn.Module)]:
+            model.share_memory()
+        # one writer per cache directory
+        detector.result_cache = None
+        self.worker_private_mb = []
+
+    def run(self, items):
+        '''items: list of (key, image or path); yields (key, results, times) in completion order'''
+        ctx = mp.get_context('fork')
+        queue = ctx.Queue()
+        procs = [ctx.Process(target=_worker, args=(self.detector, items[i::self.num_workers], self.threads, queue),
+                             daemon=True) for i in range(self.num_workers)]
+        for p in procs:
+            p.start()
+        running = len(procs)
+        self.worker_private_mb = []
+        try:
+            while running > 0:
+                key, results, times = queue.get()
+                if key is not None:
+                    yield key, results, times
+                elif results == 'done':
+                    running -= 1
+                    self.worker_private_mb.append(times)
+                else:
+                    raise RuntimeError('inference worker failed:\n' + times)
+        finally:
+            for p in procs:
+                if p.is_alive() and running > 0:
+                    p.terminate()
+                p.join()
+
+    def summary(self):
+        return 'inference pool: {} workers x {} threads | private memory per worker {:.1f}MB'.format(
+            self.num_workers, self.threads, sum(self.worker_private_mb) / max(len(self.worker_private_mb), 1))
@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from lib.utils.utils import LatencyMeter
+
+
+def parse_ladder(ladder):
+    # 'res/scales[/flip];...' best quality first, e.g. '1024/1,0.75/flip;1024/1/flip;1024/1;768/1;512/1'
+    rungs = []
+    for rung in ladder.split(';'):
+        parts = rung.strip().split('/')
+        rungs.append({'input_res': int(parts[0]),
+                      'test_scales': [float(s) for s in parts[1].split(',')],
+                      'flip_test': len(parts) > 2 and parts[2] == 'flip'})
+    return rungs
+
+
+def default_ladder(opt):
+    # from the configured setting, cheapest steps first: flip-test off, single scale, smaller inputs
+    rungs = [{'input_res': opt.input_res, 'test_scales': list(opt.test_scales), 'flip_test': opt.flip_test}]
+    if opt.flip_test:
+        rungs.append(dict(rungs[-1], flip_test=False))
+    if len(opt.test_scales) > 1:
+        rungs.append(dict(rungs[-1], test_scales=[1.]))
+    for factor in (0.75, 0.5):
+        res = int(opt.input_res * factor) // 32 * 32
+        rungs.append(dict(rungs[-1], input_res=res))
+    return rungs
+
+
+class LatencyController(object):
+    '''Steps through a ladder of inference configurations to keep latency under an SLO.
+
+    Every `window` frames the windowed percentile latency is compared to `slo`:
+    above it the controller moves one rung down (cheaper), below
+    `upgrade_margin * slo` it moves one rung up. A rung that had to be left for
+    being too slow is only retried after an exponentially growing number of
+    windows, so a borderline rung does not make the controller oscillate.
+    '''
+    def __init__(self, ladder, slo, percentile=95, window=30, upgrade_margin=0.7, max_backoff=64):
+        self.ladder = ladder
+        self.slo = slo
+        self.percentile = percentile
+        self.window = window
+        self.upgrade_margin = upgrade_margin
+        self.max_backoff = max_backoff
+        self.level = 0
+        self.backoff = [0] * len(ladder)
+        self.wait = [0] * len(ladder)
+        self.meter = LatencyMeter(window)
+        self.num_switches = 0
+
+    @property
+    def config(self):
+        return self.ladder[self.level]
+
+    def _switch(self, level):
+        self.level = level
+        self.meter.reset()
+        self.num_switches += 1
+
+    def update(self, latency):
+        self.meter.update(latency)
+        if self.meter.count < self.window:
+            return False
+        p = self.meter.percentile(self.percentile)
+        if p > self.slo:
+            if self.level == len(self.ladder) - 1:
+                self.meter.reset()
+                return False
+            self.backoff[self.level] = min(max(2 * self.backoff[self.level], 1), self.max_backoff)
+            self.wait[self.level] = self.backoff[self.level]
+            self._switch(self.level + 1)
+            return True
+        # a healthy window on this rung
+        self.backoff[self.level] //= 2
+        if p < self.upgrade_margin * self.slo and self.level > 0:
+            if self.wait[self.level - 1] > 0:
+                self.wait[self.level - 1] -= 1
+            else:
+                self._switch(self.level - 1)
+                return True
+        self.meter.reset()
+        return False
@@ -0,0 +1,181 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from lib.utils.utils import LatencyMeter
+
+
+class _Stream(object):
+    def __init__(self, stream_id, callback=None, max_queue=2):
+        self.stream_id = stream_id
+        self.callback = callback
+        self.queue = deque()
+        self.max_queue = max_queue
+        self.results = deque(maxlen=max(max_queue, 1) * 4)
+        self.latency = LatencyMeter()
+        self.next_frame_id = 0
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        # finished results pushed out of `results` before get_results polled them
+        self.results_dropped = 0
+
+
+class StreamScheduler(object):
+    '''Forms cross-stream batches for a CtdetDetector.
+
+    Frames are submitted per stream and queued with their arrival time. A batch
+    is emitted as soon as `max_batch` frames are pending or the oldest pending
+    frame has waited `max_wait` seconds. Streams are visited round-robin, one
+    frame per stream per round, so a fast feed cannot starve the others. When a
+    stream queue is full its oldest frame is dropped: for live video a stale
+    frame is worth less than the newest one.
+
+    Streams added without a callback keep their finished results for
+    get_results, at most 4 x `max_queue` of them: a consumer polling less often
+    loses the oldest ones, counted as 'results_dropped' in `stats`.
+    '''
+    def __init__(self, detector, max_batch=8, max_wait=0.03, max_queue=2):
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.streams = OrderedDict()
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self._rr = 0
+        self.num_frames = 0
+        self.num_batches = 0
+        self.start_time = None
+
+    def add_stream(self, stream_id, callback=None):
+        with self.cond:
+            self.streams[stream_id] = _Stream(stream_id, callback, self.max_queue)
+
+    def remove_stream(self, stream_id):
+        with self.cond:
+            self.streams.pop(stream_id, None)
+
+    def submit(self, stream_id, image, timestamp=None):
+        with self.cond:
+            stream = self.streams[stream_id]
+            if len(stream.queue) >= stream.max_queue:
+                stream.queue.popleft()
+                stream.dropped += 1
+            frame_id = stream.next_frame_id
+            stream.next_frame_id += 1
+            stream.submitted += 1
+            stream.queue.append((frame_id, image, time.time() if timestamp is None else timestamp))
+            self.cond.notify()
+        return frame_id
+
+    def get_results(self, stream_id):
+        with self.cond:
+            stream = self.streams[stream_id]
+            results = list(stream.results)
+            stream.results.clear()
+        return results
+
+    def _num_pending(self):
+        return sum(len(stream.queue) for stream in self.streams.values())
+
+    def _oldest_arrival(self):
+        arrivals = [stream.queue[0][2] for stream in self.streams.values() if stream.queue]
+        return min(arrivals) if arrivals else None
+
+    def _collect(self):
+        batch = []
+        streams = list(self.streams.values())
+        self._rr = (self._rr + 1) % max(len(streams), 1)
+        streams = streams[self._rr:] + streams[:self._rr]
+        while len(batch) < self.max_batch:
+            took = False
+            for stream in streams:
+                if stream.queue and len(batch) < self.max_batch:
+                    frame_id, image, arrival = stream.queue.popleft()
+                    batch.append((stream, frame_id, image, arrival))
+                    took = True
+            if not took:
+                break
+        return batch
+
+    def next_batch(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while True:
+                now = time.time()
+                oldest = self._oldest_arrival()
+                if self._num_pending() >= self.max_batch or \
+                   (oldest is not None and now - oldest >= self.max_wait) or \
+                   (oldest is not None and not self.running):
+                    return self._collect()
+                if deadline is not None and now >= deadline:
+                    return []
+                wait = self.max_wait if oldest is None else self.max_wait - (now - oldest)
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                if oldest is None and not self.running and self.thread is not None:
+                    return []
+                self.cond.wait(max(wait, 1e-4))
+
+    def step(self, timeout=None):
+        batch = self.next_batch(timeout)
+        if len(batch) == 0:
+            return 0
+        if self.start_time is None:
+            self.start_time = min(arrival for _, _, _, arrival in batch)
+        ret = self.detector.run_batch([image for _, _, image, _ in batch])
+        done_time = time.time()
+        with self.cond:
+            for (stream, frame_id, _, arrival), results in zip(batch, ret['results']):
+                stream.processed += 1
+                stream.latency.update(done_time - arrival)
+                if stream.callback is None:
+                    if len(stream.results) == stream.results.maxlen:
+                        stream.results_dropped += 1
+                    stream.results.append((frame_id, results))
+            self.num_frames += len(batch)
+            self.num_batches += 1
+        for (stream, frame_id, _, _), results in zip(batch, ret['results']):
+            if stream.callback is not None:
+                stream.callback(stream.stream_id, frame_id, results)
+        return len(batch)
+
+    def _loop(self):
+        while self.running:
+            self.step(timeout=0.1)
+        # drain what is still queued
+        while self.step(timeout=0) > 0:
+            pass
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def stats(self):
+        with self.cond:
+            elapsed = time.time() - self.start_time if self.start_time is not None else 0.
+            ret = {'frames': self.num_frames, 'batches': self.num_batches,
+                   'avg_batch': self.num_frames / max(self.num_batches, 1),
+                   'throughput': self.num_frames / elapsed if elapsed > 0 else 0.,
+                   'streams': {}}
+            for stream_id, stream in self.streams.items():
+                stream_stats = {'submitted': stream.submitted, 'processed': stream.processed,
+                                'dropped': stream.dropped, 'results_dropped': stream.results_dropped}
+                stream_stats.update(stream.latency.summary())
+                ret['streams'][stream_id] = stream_stats
+        return ret
@@ -0,0 +1,328 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .model import create_model, load_model
+from .networks.DREB_Net_model import MAGFF
+from .networks.DREB_Net_tiny_model import MAGFF as MAGFF_tiny
+from ..utils.result_cache import hash_file
+
+
+def fuse_repvgg(model):
+    # 3x3, 1x1 and identity branches of every RepVGG block -> one 3x3 conv
+    for m in model.modules():
+        if hasattr(m, 'switch_to_deploy'):
+            m.switch_to_deploy()
+    return model
+
+
+def _fold_bn(weight, bias, bn):
+    # weight / bias of a conv (output channels first) followed by the eval BatchNorm2d bn
+    t = bn.weight / (bn.running_var + bn.eps).sqrt()
+    bias = bias if bias is not None else torch.zeros_like(bn.running_mean)
+    return weight * t.reshape((-1,) + (1,) * (weight.dim() - 1)), bn.bias + (bias - bn.running_mean) * t
+
+
+def _conv(conv, bn):
+    # copy of the Conv2d conv with the BatchNorm2d bn folded in (already folded by conv_bn when bn is an Identity)
+    if isinstance(bn, nn.BatchNorm2d):
+        weight, bias = _fold_bn(conv.weight, conv.bias, bn)
+    else:
+        weight, bias = conv.weight, conv.bias if conv.bias is not None else torch.zeros(conv.out_channels)
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride,
+                      conv.padding, conv.dilation, conv.groups, bias=True)
+    fused.weight.data = weight.detach()
+    fused.bias.data = bias.detach()
+    return fused
+
+
+def fuse_conv_bn(model):
+    # Conv2d directly followed by BatchNorm2d inside an nn.Sequential -> Conv2d with bias. The conv / bn branches of
+    # RepVGG blocks not yet fused are left to fuse_repvgg, which reads their BatchNorm2d
+    repvgg_branches = {id(c) for m in model.modules() if hasattr(m, 'switch_to_deploy') for c in m.children()}
+    for m in model.modules():
+        if not isinstance(m, nn.Sequential) or id(m) in repvgg_branches:
+            continue
+        names = list(m._modules)
+        for name, next_name in zip(names[:-1], names[1:]):
+            conv, bn = m._modules[name], m._modules[next_name]
+            if not (type(conv) == nn.Conv2d and isinstance(bn, nn.BatchNorm2d)):
+                continue
+            m._modules[name] = _conv(conv, bn)
+            m._modules[next_name] = nn.Identity()
+    return model
+
+
+class PixelShuffleConv(nn.Module):
+    '''Stride-2 ConvTranspose2d as pad -> Conv2d -> pixel_shuffle -> crop, with the same output.
+
+    Output pixel 2i+r (per axis) of the transposed conv only sees the kernel taps
+    of parity r, so each of the 4 output phases is a small regular conv over the
+    input: they are stacked as 4x output channels of one conv and interleaved
+    back by pixel_shuffle. Needs no more multiply-adds than the transposed conv.
+    '''
+    def __init__(self, conv, pad, crop):
+        super().__init__()
+        self.conv = conv
+        self.pad = pad
+        self.crop = crop
+
+    def forward(self, x):
+        h, w = x.shape[2] * 2, x.shape[3] * 2
+        if any(self.pad):
+            x = F.pad(x, self.pad)
+        x = F.pixel_shuffle(self.conv(x), 2)
+        if self.crop > 0 or x.shape[2] != h or x.shape[3] != w:
+            x = x[:, :, self.crop:self.crop + h, self.crop:self.crop + w]
+        return x
+
+
+def _deconv_phases(k, p):
+    # per output parity r: input offsets d (x[i - d] feeds y[2i + r]) and the kernel tap of each
+    return [{d: 2 * d + r + p for d in range(-k, k + 1) if 0 <= 2 * d + r + p < k} for r in range(2)]
+
+
+def deconv_to_pixel_shuffle(deconv, bn=None):
+    '''PixelShuffleConv equivalent to `deconv` (and the eval BatchNorm2d `bn` after it), None if unsupported'''
+    k, p = deconv.kernel_size[0], deconv.padding[0]
+    if not (deconv.stride == (2, 2) and deconv.kernel_size == (k, k) and deconv.padding == (p, p)
+            and deconv.dilation == (1, 1) and deconv.groups == 1 and deconv.output_padding[0] == deconv.output_padding[1]
+            and k - 2 * p + deconv.output_padding[0] == 2):  # output is exactly 2x the input
+        return None
+    phases = _deconv_phases(k, p)
+    if any(len(taps) == 0 for taps in phases):
+        return None
+    d_max = [max(taps) for taps in phases]
+    # pixel_shuffle sub-position q of phase r, so that all phases land at the same offset after the shuffle
+    for q in ([0, 1], [1, 0]):
+        if q[0] - 2 * d_max[0] == q[1] - 1 - 2 * d_max[1]:
+            break
+    else:
+        return None
+    size = max(max(taps) - min(taps) + 1 for taps in phases)
+    left = max(d_max)
+    crop = 2 * left + q[0] - 2 * d_max[0]
+    if crop < 0:
+        return None
+
+    in_channels, out_channels = deconv.in_channels, deconv.out_channels
+    weight = deconv.weight.new_zeros(out_channels, 2, 2, in_channels, size, size)
+    w = deconv.weight.permute(1, 0, 2, 3)  # out, in, k, k
+    for ry in range(2):
+        for rx in range(2):
+            for dy, ky in phases[ry].items():
+                for dx, kx in phases[rx].items():
+                    # conv tap t reads x[m - left + t] and phase r of output i sits at m = i + left - d_max[r]
+                    weight[:, q[ry], q[rx], :, d_max[ry] - dy, d_max[rx] - dx] = w[:, :, ky, kx]
+    bias = deconv.bias if deconv.bias is not None else weight.new_zeros(out_channels)
+    if bn is not None:
+        weight, bias = _fold_bn(weight, bias, bn)
+    conv = nn.Conv2d(in_channels, out_channels * 4, size, bias=True)
+    conv.weight.data = weight.reshape(out_channels * 4, in_channels, size, size).detach()
+    conv.bias.data = bias.repeat_interleave(4).detach()
+    return PixelShuffleConv(conv, (left, size - 1, left, size - 1), crop)
+
+
+def deconv_pixel_shuffle(model):
+    # every stride-2 ConvTranspose2d -> PixelShuffleConv, folding a BatchNorm2d that follows it in an nn.Sequential
+    for m in list(model.modules()):
+        names = list(m._modules)
+        for i, name in enumerate(names):
+            deconv = m._modules[name]
+            if type(deconv) != nn.ConvTranspose2d:
+                continue
+            bn = m._modules[names[i + 1]] if isinstance(m, nn.Sequential) and i + 1 < len(names) else None
+            bn = bn if isinstance(bn, nn.BatchNorm2d) else None
+            fused = deconv_to_pixel_shuffle(deconv, bn)
+            if fused is None:
+                continue
+            m._modules[name] = fused
+            if bn is not None:
+                m._modules[names[i + 1]] = nn.Identity()
+    return model
+
+
+class FusedMAGFF(nn.Module):
+    '''Inference MAGFF with the BatchNorms folded and in-place blends.
+
+    The global branch only yields a per-image, per-channel vector, so it is
+    computed on the pooled input and added as the bias of the local branch's
+    last conv: no x_g / x_lg maps. Blends are x2 + w * (x1 - x2) in place, with
+    x1 - x2 computed once into the x1 + x2 buffer. A forward allocates three
+    full-size maps (x1 + x2, the two weights) instead of about ten.
+    '''
+    def __init__(self, magff):
+        super().__init__()
+        self.local_1, self.global_1 = self._branches(magff.local_attention, magff.global_attention)
+        self.local_2, self.global_2 = self._branches(magff.local_attention_2, magff.global_attention_2)
+
+    @staticmethod
+    def _branches(local, global_):
+        # the bias of the last local conv moves to the last global conv, they are always summed
+        local_last, global_last = _conv(local[3], local[4]), _conv(global_[4], global_[5])
+        global_last.bias.data += local_last.bias.data
+        local_last.bias = None
+        return (nn.Sequential(_conv(local[0], local[1]), nn.ReLU(inplace=True), local_last),
+                nn.Sequential(_conv(global_[1], global_[2]), nn.ReLU(inplace=True), global_last))
+
+    def _weight(self, x, local, global_):
+        # sigmoid(local(x) + global(x)), one full-size allocation
+        weight = local(x)
+        weight += global_(x.mean((2, 3), keepdim=True))
+        return weight.sigmoid_()
+
+    def forward(self, x1, x2):
+        diff = x1 + x2
+        weight = self._weight(diff, self.local_1, self.global_1)
+        torch.sub(x1, x2, out=diff)
+        x_i = weight.mul_(diff).add_(x2)
+        weight = self._weight(x_i, self.local_2, self.global_2)
+        return weight.mul_(diff).add_(x2)
+
+
+def fuse_magff(model):
+    # MAGFF -> FusedMAGFF, after loading (the BatchNorm statistics are folded)
+    for m in list(model.modules()):
+        for name, child in m._modules.items():
+            if type(child) in (MAGFF, MAGFF_tiny):
+                m._modules[name] = FusedMAGFF(child)
+    return model
+
+
+# deploy-time transforms, applied in the order given by --deploy_transforms
+_transform_factory = {
+    'repvgg': fuse_repvgg,
+    'conv_bn': fuse_conv_bn,
+    'deconv': deconv_pixel_shuffle,
+    'magff': fuse_magff,
+}
+
+
+def register_transform(name, transform):
+    _transform_factory[name] = transform
+
+
+def prepare_model(model, transforms):
+    model.eval()
+    with torch.no_grad():
+        for name in transforms:
+            model = _transform_factory[name](model)
+    return model
+
+
+def _code_hash():
+    # prepared modules are pickled, a change to the network or transform code invalidates them
+    h = hashlib.blake2b(digest_size=16)
+    current_path = os.path.dirname(os.path.realpath(__file__))
+    for path in sorted([os.path.join(current_path, 'networks', f) for f in os.listdir(os.path.join(current_path, 'networks'))
+                        if f.endswith('.py')] + [os.path.realpath(__file__), os.path.join(current_path, 'model.py'),
+                                              os.path.join(current_path, 'low_rank.py')]):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class PreparedModelCache(object):
+    '''On-disk cache of fully prepared (loaded and transformed) inference modules.
+
+    An entry is keyed by the checkpoint content hash, arch, heads, input shape,
+    transforms, torch version and the hash of the model code, so any change to
+    them misses and rebuilds. Each entry has a json record with the hash of the
+    pickled module, checked before loading; corrupt entries are rebuilt.
+    '''
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def checkpoint_hash(self, model_path):
+        # content hash of a checkpoint, memoized by (size, mtime) since hashing it costs about as much as loading it
+        index_path = os.path.join(self.cache_dir, 'checkpoints.json')
+        index = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path) as f:
+                    index = json.load(f)
+            except ValueError:
+                index = {}
+        path = os.path.realpath(model_path)
+        st = os.stat(path)
+        entry = index.get(path)
+        if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry['hash']
+        index[path] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': hash_file(path)}
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(index_path + '.tmp', index_path)
+        return index[path]['hash']
+
+    def key(self, arch, heads, head_conv, model_path, input_shape, transforms):
+        record = {'arch': arch, 'heads': heads, 'head_conv': head_conv,
+                  'checkpoint': self.checkpoint_hash(model_path) if model_path != '' else '',
+                  'input_shape': list(input_shape), 'transforms': list(transforms),
+                  'torch': torch.__version__, 'code': _code_hash()}
+        key = hashlib.blake2b(json.dumps(record, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+        return key, record
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + '.pt'), os.path.join(self.cache_dir, key + '.json')
+
+    def load(self, key):
+        model_path, record_path = self._paths(key)
+        if not (os.path.exists(model_path) and os.path.exists(record_path)):
+            return None
+        try:
+            with open(record_path) as f:
+                record = json.load(f)
+            if record['file_hash'] != hash_file(model_path):
+                raise ValueError('hash mismatch')
+            try:
+                model = torch.load(model_path, map_location='cpu', weights_only=False, mmap=True)
+            except TypeError:
+                model = torch.load(model_path, map_location='cpu')
+        except Exception as e:
+            print('Invalid prepared model {} ({}), rebuilding.'.format(model_path, e))
+            self.remove(key)
+            return None
+        return model
+
+    def save(self, key, record, model):
+        model_path, record_path = self._paths(key)
+        torch.save(model, model_path + '.tmp')
+        os.replace(model_path + '.tmp', model_path)
+        record = dict(record, file_hash=hash_file(model_path))
+        with open(record_path + '.tmp', 'w') as f:
+            json.dump(record, f, indent=2)
+        os.replace(record_path + '.tmp', record_path)
+
+    def remove(self, key):
+        for path in self._paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def build_model(arch, heads, head_conv, model_path='', transforms=(), cache_dir='', input_shape=()):
+    '''create_model + load_model + deploy transforms, through the prepared model cache if cache_dir is set'''
+    if cache_dir != '':
+        cache = PreparedModelCache(cache_dir)
+        key, record = cache.key(arch, heads, head_conv, model_path, input_shape, transforms)
+        model = cache.load(key)
+        if model is not None:
+            print('loaded prepared {} from {}'.format(arch, cache_dir))
+            return model.eval()
+
+    model = create_model(arch, heads, head_conv)
+    if model_path != '':
+        model = load_model(model, model_path)
+    model = prepare_model(model, transforms) if len(transforms) > 0 else model
+
+    if cache_dir != '':
+        cache.save(key, record, model)
+    return model
@@ -95,6 +95,26 @@ class RegL1Loss(nn.Module):
         return loss
 
 
+class DistillHmLoss(nn.Module):
+    '''Squared error to the teacher heatmap, normalized by the teacher heat mass (like the focal loss by num_pos)'''
+    def __init__(self):
+        super(DistillHmLoss, self).__init__()
+
+    def forward(self, output, target):
+        return F.mse_loss(output, target, reduction='sum') / (target.sum() + 1e-4)
+
+
+class DistillRegL1Loss(nn.Module):
+    '''Dense L1 to the teacher wh / reg maps, weighted by the teacher's max class heat at every location'''
+    def __init__(self):
+        super(DistillRegL1Loss, self).__init__()
+
+    def forward(self, output, target, target_hm):
+        weight = target_hm.max(dim=1, keepdim=True)[0]
+        loss = (torch.abs(output - target) * weight).sum()
+        return loss / (weight.sum() * output.size(1) + 1e-4)
+
+
 class NormRegL1Loss(nn.Module):
     def __init__(self):
         super(NormRegL1Loss, self).__init__()
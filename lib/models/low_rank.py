@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.nn as nn
+
+
+def rank_for_energy(singular_values, energy):
+    # smallest rank keeping `energy` of the squared singular value mass
+    power = singular_values.double() ** 2
+    cumulative = torch.cumsum(power, 0) / power.sum()
+    rank = int(torch.searchsorted(cumulative, torch.tensor([energy], dtype=cumulative.dtype))[0]) + 1
+    return min(rank, len(singular_values))
+
+
+def _svd(matrix):
+    u, s, vh = torch.linalg.svd(matrix.detach().double(), full_matrices=False)
+    return u, s, vh
+
+
+def _conv(in_channels, out_channels, kernel_size=1, stride=1, padding=0, bias=False):
+    return nn.Conv2d(in_channels, out_channels, kernel_size, stride, padding, bias=bias)
+
+
+def low_rank_layers(module, method, ranks):
+    '''nn.Sequential replacing `module` with the given factorization ranks, uninitialized
+
+    svd    Conv2d:          kxk conv to rank channels -> 1x1 conv
+    tucker Conv2d:          1x1 conv to ranks[0] -> kxk conv to ranks[1] -> 1x1 conv
+    svd    ConvTranspose2d: 1x1 conv to rank channels -> transposed conv
+    '''
+    bias = module.bias is not None
+    if isinstance(module, nn.ConvTranspose2d):
+        assert method == 'svd'
+        up = nn.ConvTranspose2d(ranks[0], module.out_channels, module.kernel_size, module.stride, module.padding,
+                                module.output_padding, bias=bias)
+        return nn.Sequential(_conv(module.in_channels, ranks[0]), up)
+    if method == 'svd':
+        return nn.Sequential(_conv(module.in_channels, ranks[0], module.kernel_size, module.stride, module.padding),
+                             _conv(ranks[0], module.out_channels, bias=bias))
+    return nn.Sequential(_conv(module.in_channels, ranks[0]),
+                         _conv(ranks[0], ranks[1], module.kernel_size, module.stride, module.padding),
+                         _conv(ranks[1], module.out_channels, bias=bias))
+
+
+def factorize(module, method='svd', energy=0.9, ranks=None):
+    '''Low-rank factorization of a Conv2d / ConvTranspose2d (groups 1, dilation 1).
+
+    Ranks are the smallest keeping `energy` of the squared singular values of
+    the weight unfoldings, unless given. Returns (nn.Sequential, ranks).
+    '''
+    if module.groups != 1 or module.dilation != (1, 1):
+        raise ValueError('low-rank factorization needs groups 1 and dilation 1')
+    w = module.weight.detach()
+    bias = module.bias.detach() if module.bias is not None else None
+    if isinstance(module, nn.ConvTranspose2d):
+        # weight in, out, k, k: x -> (in -> r) 1x1 -> (r -> out) transposed conv
+        u, s, vh = _svd(w.reshape(w.shape[0], -1))
+        ranks = ranks or [rank_for_energy(s, energy)]
+        r = ranks[0]
+        layers = low_rank_layers(module, 'svd', ranks)
+        layers[0].weight.data = (u[:, :r] * s[:r]).t().reshape(r, -1, 1, 1).to(w.dtype)
+        layers[1].weight.data = vh[:r].reshape(r, *w.shape[1:]).to(w.dtype)
+    elif method == 'svd':
+        # weight out, in, k, k = (out x r) (r x in*k*k)
+        u, s, vh = _svd(w.reshape(w.shape[0], -1))
+        ranks = ranks or [rank_for_energy(s, energy)]
+        r = ranks[0]
+        layers = low_rank_layers(module, 'svd', ranks)
+        layers[0].weight.data = vh[:r].reshape(r, *w.shape[1:]).to(w.dtype)
+        layers[1].weight.data = (u[:, :r] * s[:r]).reshape(-1, r, 1, 1).to(w.dtype)
+    elif method == 'tucker':
+        # Tucker-2 (HOSVD) over the output and input channel modes
+        u_out, s_out, _ = _svd(w.reshape(w.shape[0], -1))
+        u_in, s_in, _ = _svd(w.transpose(0, 1).reshape(w.shape[1], -1))
+        ranks = ranks or [rank_for_energy(s_in, energy), rank_for_energy(s_out, energy)]
+        u_in, u_out = u_in[:, :ranks[0]], u_out[:, :ranks[1]]
+        core = torch.einsum('oikl,or,is->rskl', w.double(), u_out, u_in)
+        layers = low_rank_layers(module, 'tucker', ranks)
+        layers[0].weight.data = u_in.t().reshape(ranks[0], -1, 1, 1).to(w.dtype)
+        layers[1].weight.data = core.to(w.dtype)
+        layers[2].weight.data = u_out.reshape(-1, ranks[1], 1, 1).to(w.dtype)
+    else:
+        raise ValueError('unknown low-rank method {}'.format(method))
+    if bias is not None:
+        layers[-1].bias.data = bias.clone()
+    return layers.to(w.device), ranks
+
+
+def macs_ratio(module, ranks, method):
+    # multiply-adds of the factorization relative to the layer, per output pixel of the original layer
+    k = module.kernel_size[0] * module.kernel_size[1]
+    cin, cout = module.in_channels, module.out_channels
+    if isinstance(module, nn.ConvTranspose2d):
+        # both convs run at the input resolution
+        return (cin * ranks[0] + ranks[0] * cout * k) / (cin * cout * k)
+    if method == 'svd':
+        return (cin * k * ranks[0] + ranks[0] * cout) / (cin * cout * k)
+    # the input 1x1 conv runs before the stride
+    s = module.stride[0] * module.stride[1]
+    return (cin * ranks[0] * s + ranks[0] * ranks[1] * k + ranks[1] * cout) / (cin * cout * k)
+
+
+def apply_low_rank(model, spec):
+    '''Gives `model` the factorized structure described by `spec`, as stored in checkpoints.
+
+    spec: {'repvgg': fuse the RepVGG blocks first, 'layers': {module name: {'method', 'ranks'}}}.
+    Weights are left uninitialized, load_model fills them from the checkpoint.
+    '''
+    if spec.get('repvgg', False):
+        with torch.no_grad():
+            for m in model.modules():
+                if hasattr(m, 'switch_to_deploy'):
+                    m.switch_to_deploy()
+    for name, layer in spec['layers'].items():
+        parent_name, _, child = name.rpartition('.')
+        parent = model.get_submodule(parent_name) if parent_name != '' else model
+        parent._modules[child] = low_rank_layers(parent._modules[child], layer['method'], layer['ranks'])
+    model.low_rank = spec
+    return model
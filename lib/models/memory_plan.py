@@ -0,0 +1,171 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.nn as nn
+
+if int(torch.__version__.split('.')[0]) < 2:
+    raise ImportError('--memory_plan needs torch >= 2.0 (untyped storages, TorchDispatchMode), found torch {}'.format(
+        torch.__version__))
+
+from torch.multiprocessing.reductions import StorageWeakRef
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+_ALIGN = 64
+_out_variants = {}
+
+
+def _out_variant(func):
+    # (overload, name of its out argument) of the out= form of an aten op with one tensor output, or None
+    if func not in _out_variants:
+        _out_variants[func] = None
+        args = [(a.name, str(a.type)) for a in func._schema.arguments]
+        for name in func.overloadpacket.overloads():
+            overload = getattr(func.overloadpacket, name)
+            outs = [a for a in overload._schema.arguments if a.is_out]
+            if len(outs) == 1 and [(a.name, str(a.type)) for a in overload._schema.arguments if not a.is_out] == args:
+                _out_variants[func] = (overload, outs[0].name)
+                break
+    return _out_variants[func]
+
+
+def _storages(args, kwargs):
+    return {a.untyped_storage().data_ptr() for a in tree_flatten((args, kwargs))[0] if isinstance(a, torch.Tensor)}
+
+
+class _Recorder(TorchDispatchMode):
+    # runs the ops unchanged, records every op and the lifetime (producing op, last op reading it) of the
+    # storages allocated by ops that have an out= form
+    def __init__(self):
+        super().__init__()
+        self.ops = []
+        self.tensors = []
+        self.owner = {}
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        index = len(self.ops)
+        self.ops.append(func)
+        inputs = _storages(args, kwargs)
+        for ptr in inputs:
+            if self.owner.get(ptr) is not None:
+                self.tensors[self.owner[ptr]]['last'] = index
+        out = func(*args, **kwargs)
+        for t in tree_flatten(out)[0]:
+            if not isinstance(t, torch.Tensor) or t.untyped_storage().data_ptr() in inputs:
+                continue
+            # a new storage, possibly at the address of a freed one
+            ptr = t.untyped_storage().data_ptr()
+            self.owner[ptr] = None
+            if isinstance(out, torch.Tensor) and _out_variant(func) is not None and t.device.type == 'cpu':
+                self.owner[ptr] = len(self.tensors)
+                self.tensors.append({'op': index, 'last': index, 'nbytes': t.untyped_storage().nbytes(),
+                                     'size': tuple(t.shape), 'stride': t.stride(), 'offset': t.storage_offset(),
+                                     'dtype': t.dtype, 'ref': StorageWeakRef(t.untyped_storage())})
+        return out
+
+
+class _Replayer(TorchDispatchMode):
+    # runs the recorded op sequence, ops producing a planned tensor write into its arena buffer
+    def __init__(self, plan):
+        super().__init__()
+        self.plan = plan
+        self.index = 0
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        index = self.index
+        self.index += 1
+        if index >= len(self.plan.ops) or self.plan.ops[index] != func:
+            raise RuntimeError('op {} ({}) differs from the recorded forward'.format(index, func))
+        buffer = self.plan.buffers.get(index)
+        if buffer is None:
+            return func(*args, **kwargs)
+        overload, name = _out_variant(func)
+        kwargs = dict(kwargs)
+        kwargs[name] = buffer
+        return overload(*args, **kwargs)
+
+
+class MemoryPlan(object):
+    '''Static activation memory plan of a fixed-shape forward.
+
+    `record` runs one forward under a dispatch mode and keeps the op sequence
+    and, for every op output with an out= form, the span from its op to the
+    last op reading it. Outputs still alive after the forward (model outputs,
+    anything a module keeps) are left to the allocator. The others get offsets
+    in one arena, greedily by size, so tensors with disjoint spans share bytes.
+    `run` replays a forward with those ops writing into the arena.
+
+    The out= forms of convolution, pixel_shuffle and a few others have no CPU
+    kernel: they compute into a temporary copied to the arena and freed right
+    away, so the allocator only sees one short-lived buffer at a time.
+    One plan runs one forward at a time.
+    '''
+    def __init__(self):
+        self.ops = []
+        self.buffers = {}
+        self.arena = None
+        self.tensors = []
+
+    def record(self, fn, *args):
+        recorder = _Recorder()
+        with recorder:
+            out = fn(*args)
+        self.ops = recorder.ops
+        self.tensors = [t for t in recorder.tensors if t.pop('ref').expired()]
+        self._place()
+        return out
+
+    def _place(self):
+        placed = []
+        for t in sorted(self.tensors, key=lambda t: -t['nbytes']):
+            offset = 0
+            for other in sorted([p for p in placed if p['op'] <= t['last'] and t['op'] <= p['last']],
+                                key=lambda p: p['start']):
+                if offset + t['nbytes'] <= other['start']:
+                    break
+                offset = max(offset, (other['start'] + other['nbytes'] + _ALIGN - 1) // _ALIGN * _ALIGN)
+            t['start'] = offset
+            placed.append(t)
+        size = max([t['start'] + t['nbytes'] for t in self.tensors] + [0])
+        self.arena = torch.empty((size + _ALIGN - 1) // _ALIGN * _ALIGN, dtype=torch.uint8)
+        self.buffers = {}
+        for t in self.tensors:
+            # as_strided offsets count from the start of the arena
+            itemsize = torch.empty(0, dtype=t['dtype']).element_size()
+            self.buffers[t['op']] = self.arena.view(t['dtype']).as_strided(
+                t['size'], t['stride'], t['start'] // itemsize + t['offset'])
+
+    def run(self, fn, *args):
+        with _Replayer(self):
+            return fn(*args)
+
+    def stats(self):
+        # arena bytes, and the bytes the planned tensors would take without sharing
+        return {'tensors': len(self.tensors), 'arena': self.arena.numel() if self.arena is not None else 0,
+                'unshared': sum(t['nbytes'] for t in self.tensors)}
+
+
+class PlannedModel(nn.Module):
+    '''Runs `model` with a MemoryPlan of its 'val' forward at the first input shape seen (--fix_res).
+
+    Other shapes and modes run the model as is.
+    '''
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.plan = None
+        self.shape = None
+
+    def forward(self, x, mode='val'):
+        if mode != 'val' or x.device.type != 'cpu' or torch.is_grad_enabled():
+            return self.model(x, mode)
+        if self.plan is None:
+            self.plan, self.shape = MemoryPlan(), tuple(x.shape)
+            return self.plan.record(self.model, x, mode)
+        if tuple(x.shape) != self.shape:
+            return self.model(x, mode)
+        return self.plan.run(self.model, x, mode)
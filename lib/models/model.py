@@ -2,10 +2,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
+import re
+
+import numpy as np
 import torch
 
 from .networks.DREB_Net_model import create_DREB_Net_detect
 from .networks.DREB_Net_tiny_model import create_DREB_Net_tiny_detect
+from .low_rank import apply_low_rank
 
 _model_factory = {
     'DREB_Net': create_DREB_Net_detect,
@@ -13,18 +18,92 @@ _model_factory = {
 }
 
 
+# only needed by mode='train' / 'deblur', dropped from slim inference checkpoints unless kept on export
+_train_only_modules = ('deblur_down3', 'deblur_down4', 'deblur_up1', 'deblur_up2', 'deblur_up3',
+                       'deblur_up4', 'deblur_up5')
+
+# slim inference checkpoint: magic, uint64 header length, json header, then the raw tensors
+_SLIM_MAGIC = b'DREBSLIM'
+_SLIM_ALIGN = 64
+
+
+def parse_arch(arch):
+    '''DREB_Net_w0.5_d2-4-8-1_g4 -> ('DREB_Net', constructor kwargs)
+
+    w: width multiplier, one for all stages or one per stage (w1-1-0.75-0.5)
+    d: blocks of each of the 4 stages
+    g: groups of the 3x3 convs of every second block (the RepVGG g2 / g4 maps)
+    light: depthwise separable deblur decoder (--deblur_decoder light)
+    '''
+    match = re.match(r'^(.+?)((?:_[wdg][0-9.\-]+|_light)*)$', arch)
+    base, options = match.group(1), match.group(2)
+    if base not in _model_factory:
+        raise ValueError('unknown arch {} (base {}), expected one of {}'.format(arch, base, sorted(_model_factory)))
+    kwargs = {}
+    for option in options.split('_')[1:]:
+        key, values = option[0], option[1:].split('-')
+        if option == 'light':
+            kwargs['deblur_decoder'] = 'light'
+        elif key == 'w':
+            width = [float(v) for v in values]
+            kwargs['width_multiplier'] = width * 4 if len(width) == 1 else width
+        elif key == 'd':
+            kwargs['num_blocks'] = [int(v) for v in values]
+        elif key == 'g':
+            kwargs['groups'] = int(values[0])
+    if len(kwargs.get('width_multiplier', [1] * 4)) != 4 or len(kwargs.get('num_blocks', [1] * 4)) != 4:
+        raise ValueError('arch {}: w and d need 1 / 4 and 4 values'.format(arch))
+    groups = kwargs.pop('groups', 1)
+    if groups > 1:
+        num_layers = sum(kwargs.get('num_blocks', [4, 6, 16, 1]))
+        kwargs['override_groups_map'] = {l: groups for l in range(2, num_layers + 1, 2)}
+    return base, kwargs
+
+
 def create_model(arch, heads, head_conv):
     print('arch:', arch)
-    get_model = _model_factory[arch]
-    model = get_model(heads=heads, head_conv=head_conv)
+    base, kwargs = parse_arch(arch)
+    get_model = _model_factory[base]
+    model = get_model(heads=heads, head_conv=head_conv, **kwargs)
     return model
 
 
+def is_slim_model(model_path):
+    with open(model_path, 'rb') as f:
+        return f.read(len(_SLIM_MAGIC)) == _SLIM_MAGIC
+
+
+def _read_slim_header(model_path):
+    # json header of a slim checkpoint and the offset of its first tensor
+    with open(model_path, 'rb') as f:
+        f.seek(len(_SLIM_MAGIC))
+        header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    return header, (len(_SLIM_MAGIC) + 8 + header_len + _SLIM_ALIGN - 1) // _SLIM_ALIGN * _SLIM_ALIGN
+
+
+def stripped_modules(model_path):
+    """Modules a slim checkpoint was exported without, none for a regular checkpoint"""
+    if model_path == '' or not is_slim_model(model_path):
+        return []
+    return _read_slim_header(model_path)[0]['stripped']
+
+
 def load_model(model, model_path, optimizer=None, resume=False, 
                lr=None, lr_step=None):
+    if is_slim_model(model_path):
+        if optimizer is not None:
+            raise ValueError('{} is a slim inference checkpoint, it cannot be used for training / resume: '
+                             'load the full checkpoint it was exported from'.format(model_path))
+        return load_slim_model(model, model_path)
     start_epoch = 0
     checkpoint = torch.load(model_path, map_location=lambda storage, loc: storage)
     print('loaded {}, epoch {}'.format(model_path, checkpoint['epoch']))
+    if 'low_rank' in checkpoint and getattr(model, 'low_rank', None) is None:
+        # factorized checkpoint: rebuild the structure before loading the weights
+        model = apply_low_rank(model, checkpoint['low_rank'])
+        if optimizer is not None and len(optimizer.param_groups) == 1:
+            optimizer.param_groups[0]['params'] = list(model.parameters())
     state_dict_ = checkpoint['state_dict']
     state_dict = {}
     
@@ -83,7 +162,86 @@ def save_model(path, epoch, model, optimizer=None):
         state_dict = model.state_dict()
     data = {'epoch': epoch,
             'state_dict': state_dict}
+    low_rank = getattr(model.module if isinstance(model, torch.nn.DataParallel) else model, 'low_rank', None)
+    if low_rank is not None:
+        data['low_rank'] = low_rank
     if not (optimizer is None):
         data['optimizer'] = optimizer.state_dict()
     torch.save(data, path)
 
+
+
+def save_slim_model(path, model, epoch=0, half=False, keep_deblur=False):
+    """Weights only, flat and memory-mappable, see load_slim_model"""
+    if isinstance(model, torch.nn.DataParallel):
+        model = model.module
+    stripped = [] if keep_deblur else [m for m in _train_only_modules if hasattr(model, m)]
+    tensors, offset = {}, 0
+    state_dict = model.state_dict()
+    for k in list(state_dict):
+        if k.split('.')[0] in stripped:
+            del state_dict[k]
+            continue
+        v = state_dict[k].detach().cpu()
+        if half and v.is_floating_point():
+            v = v.half()
+        state_dict[k] = v.contiguous().numpy()
+        tensors[k] = {'dtype': state_dict[k].dtype.str, 'shape': list(v.shape), 'offset': offset}
+        offset += (state_dict[k].nbytes + _SLIM_ALIGN - 1) // _SLIM_ALIGN * _SLIM_ALIGN
+    header = {'epoch': epoch, 'stripped': stripped, 'tensors': tensors}
+    if getattr(model, 'low_rank', None) is not None:
+        header['low_rank'] = model.low_rank
+    header = json.dumps(header).encode('utf-8')
+    data_start = (len(_SLIM_MAGIC) + 8 + len(header) + _SLIM_ALIGN - 1) // _SLIM_ALIGN * _SLIM_ALIGN
+    with open(path, 'wb') as f:
+        f.write(_SLIM_MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for k, t in tensors.items():
+            f.seek(data_start + t['offset'])
+            f.write(state_dict[k].tobytes())
+        f.truncate(data_start + offset)
+
+
+def load_slim_model(model, model_path):
+    """Maps the tensors of a slim checkpoint into `model` without copying.
+
+    The file is mapped copy-on-write, so replicas on one host share its page
+    cache pages. Tensors whose stored dtype differs from the model's (fp16
+    exports) are converted and therefore copied. Modules stripped on export
+    are removed from the model.
+    """
+    header, data_start = _read_slim_header(model_path)
+    data = np.memmap(model_path, dtype=np.uint8, mode='c', offset=data_start)
+    print('loaded {}, epoch {}'.format(model_path, header['epoch']))
+    if 'low_rank' in header and getattr(model, 'low_rank', None) is None:
+        model = apply_low_rank(model, header['low_rank'])
+
+    for m in header['stripped']:
+        if hasattr(model, m):
+            delattr(model, m)
+    model_state_dict = model.state_dict()
+    for k in model_state_dict:
+        if k not in header['tensors']:
+            print('No param {}.'.format(k))
+    for k, t in header['tensors'].items():
+        if k not in model_state_dict:
+            print('Drop parameter {}.'.format(k))
+            continue
+        dtype = np.dtype(t['dtype'])
+        size = int(np.prod(t['shape'])) * dtype.itemsize
+        tensor = torch.from_numpy(data[t['offset']:t['offset'] + size].view(dtype).reshape(t['shape']))
+        target = model_state_dict[k]
+        if tuple(tensor.shape) != tuple(target.shape):
+            print('Skip loading parameter {}, required shape{}, loaded shape{}.'.format(
+                k, target.shape, tensor.shape))
+            continue
+        if tensor.dtype != target.dtype:
+            tensor = tensor.to(target.dtype)
+        module_name, _, name = k.rpartition('.')
+        module = model.get_submodule(module_name)
+        if name in module._parameters:
+            module._parameters[name] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            module._buffers[name] = tensor
+    return model
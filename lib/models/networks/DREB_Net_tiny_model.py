@@ -35,12 +35,73 @@ class RepVGGBlock(nn.Module):
         self.rbr_1x1 = conv_bn(in_channels=in_channels, out_channels=out_channels, kernel_size=1, stride=stride, padding=padding_11, groups=groups)
 
     def forward(self, inputs):
+        if hasattr(self, 'rbr_reparam'):
+            return self.nonlinearity(self.se(self.rbr_reparam(inputs)))
+
         if self.rbr_identity is None:
             id_out = 0
         else:
             id_out = self.rbr_identity(inputs)
         return self.nonlinearity(self.se(self.rbr_dense(inputs) + self.rbr_1x1(inputs) + id_out))
 
+    def get_equivalent_kernel_bias(self):
+        kernel3x3, bias3x3 = self._fuse_bn_tensor(self.rbr_dense)
+        kernel1x1, bias1x1 = self._fuse_bn_tensor(self.rbr_1x1)
+        kernelid, biasid = self._fuse_bn_tensor(self.rbr_identity)
+        return kernel3x3 + self._pad_1x1_to_3x3_tensor(kernel1x1) + kernelid, bias3x3 + bias1x1 + biasid
+
+    def _pad_1x1_to_3x3_tensor(self, kernel1x1):
+        if kernel1x1 is None:
+            return 0
+        else:
+            return F.pad(kernel1x1, [1, 1, 1, 1])
+
+    def _fuse_bn_tensor(self, branch):
+        if branch is None:
+            return 0, 0
+        if isinstance(branch, nn.Sequential):
+            kernel = branch.conv.weight
+            running_mean = branch.bn.running_mean
+            running_var = branch.bn.running_var
+            gamma = branch.bn.weight
+            beta = branch.bn.bias
+            eps = branch.bn.eps
+        else:
+            assert isinstance(branch, nn.BatchNorm2d)
+            if not hasattr(self, 'id_tensor'):
+                input_dim = self.in_channels // self.groups
+                kernel_value = np.zeros((self.in_channels, input_dim, 3, 3), dtype=np.float32)
+                for i in range(self.in_channels):
+                    kernel_value[i, i % input_dim, 1, 1] = 1
+                self.id_tensor = torch.from_numpy(kernel_value).to(branch.weight.device)
+            kernel = self.id_tensor
+            running_mean = branch.running_mean
+            running_var = branch.running_var
+            gamma = branch.weight
+            beta = branch.bias
+            eps = branch.eps
+        std = (running_var + eps).sqrt()
+        t = (gamma / std).reshape(-1, 1, 1, 1)
+        return kernel * t, beta - running_mean * gamma / std
+
+    def switch_to_deploy(self):
+        if hasattr(self, 'rbr_reparam'):
+            return
+        kernel, bias = self.get_equivalent_kernel_bias()
+        conv = self.rbr_dense.conv
+        self.rbr_reparam = nn.Conv2d(in_channels=conv.in_channels, out_channels=conv.out_channels,
+                                     kernel_size=conv.kernel_size, stride=conv.stride,
+                                     padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=True)
+        self.rbr_reparam.weight.data = kernel.detach()
+        self.rbr_reparam.bias.data = bias.detach()
+        self.__delattr__('rbr_dense')
+        self.__delattr__('rbr_1x1')
+        if hasattr(self, 'rbr_identity'):
+            self.__delattr__('rbr_identity')
+        if hasattr(self, 'id_tensor'):
+            self.__delattr__('id_tensor')
+        self.deploy = True
+
 
 
 class Deblur_Down(nn.Module):
@@ -92,6 +153,27 @@ class Deblur_Up(nn.Module):
         return self.conv(x)
 
 
+class Deblur_Up_light(nn.Module):
+    # Deblur_Up with depthwise separable convs (depthwise 3x3 -> pointwise 1x1, each with BN + ReLU),
+    # num_layers of them in place of the three full 3x3 convs
+    def __init__(self, in_channels, mid_channels, out_channels, num_layers=2):
+        super().__init__()
+
+        self.up = nn.ConvTranspose2d(in_channels, in_channels // 2, kernel_size=2, stride=2)
+        layers, channels = [], mid_channels
+        for _ in range(num_layers):
+            layers += [nn.Conv2d(channels, channels, kernel_size=3, padding=1, groups=channels, bias=False),
+                       nn.BatchNorm2d(channels),
+                       nn.ReLU(inplace=True),
+                       nn.Conv2d(channels, out_channels, kernel_size=1, bias=False),
+                       nn.BatchNorm2d(out_channels),
+                       nn.ReLU(inplace=True)]
+            channels = out_channels
+        self.conv = nn.Sequential(*layers)
+
+    forward = Deblur_Up.forward
+
+
 class MAGFF(nn.Module):
     def __init__(self, channels=128, r=4):
         super(MAGFF, self).__init__()
@@ -164,17 +246,26 @@ class LFAMM(nn.Module):
         x_fft = x_fft + 1e-8
         x_amp = torch.abs(x_fft)
         x_pha = torch.angle(x_fft)
-        x_amp_invariant = torch.mul(x_amp, self.convolution)
+        x_amp_invariant = torch.mul(x_amp, self._amplitude_filter(x_fft.shape[-2:]))
         x_fft_invariant = x_amp_invariant * torch.exp(torch.tensor(1j) * x_pha)
-        x_invariant = torch.fft.irfftn(x_fft_invariant, dim=(-2, -1) )
+        x_invariant = torch.fft.irfftn(x_fft_invariant, s=x.shape[-2:], dim=(-2, -1) )
         return x_invariant
 
+    def _amplitude_filter(self, size):
+        # the filter is learned at the training resolution (1024 input). other input sizes get
+        # it resampled in the (fftshifted) frequency domain.
+        if tuple(size) == tuple(self.convolution.shape[-2:]):
+            return self.convolution
+        conv = torch.fft.fftshift(self.convolution, dim=-2).unsqueeze(0)
+        conv = F.interpolate(conv, size=tuple(size), mode='bilinear', align_corners=True)
+        return torch.fft.ifftshift(conv.squeeze(0), dim=-2)
+
 
 
 class DREB_Net_tiny(nn.Module):
 
     def __init__(self, num_blocks=[4, 6, 16, 1], width_multiplier=[1, 1, 1, 1], override_groups_map=None, deploy=False, use_checkpoint=False,
-                 heads=None, head_conv=None):
+                 heads=None, head_conv=None, deblur_decoder='standard'):
         super(DREB_Net_tiny, self).__init__()
         self.deconv_with_bias = False
         self.heads = heads
@@ -185,9 +276,12 @@ class DREB_Net_tiny(nn.Module):
         assert 0 not in self.override_groups_map
         self.use_checkpoint = use_checkpoint
 
-        self.LFAMM = LFAMM(channels=128, height=128, weight=128)
+        # s0 / s2 (stage0 / stage2 outputs) are shared with the deblur branch and MAGFF
+        stem_planes = min(64, int(64 * width_multiplier[0]))
+        fusion_planes = int(128 * width_multiplier[1])
+        self.LFAMM = LFAMM(channels=fusion_planes, height=128, weight=128)
 
-        self.in_planes = min(64, int(64 * width_multiplier[0]))
+        self.in_planes = stem_planes
         self.stage0 = RepVGGBlock(in_channels=3, out_channels=self.in_planes, kernel_size=3, stride=2, padding=1, deploy=self.deploy)
         self.cur_layer_idx = 1
         self.stage1 = self._make_stage(int(64 * width_multiplier[0]), num_blocks[0], stride=2)
@@ -200,17 +294,27 @@ class DREB_Net_tiny(nn.Module):
         self.deconv_layers2 = self._make_deconv_layer(256, 4)
         self.deconv_layers3 = self._make_deconv_layer(256, 4)
 
-        self.deblur_down1 = Deblur_Down(64, 64)
-        self.deblur_down2 = Deblur_Down(64, 128)
-        self.deblur_down3 = Deblur_Down(128, 256)
+        self.deblur_down1 = Deblur_Down(stem_planes, 64)
+        self.deblur_down2 = Deblur_Down(64, fusion_planes)
+        self.deblur_down3 = Deblur_Down(fusion_planes, 256)
         self.deblur_down4 = Deblur_Down(256, 512)
-        self.deblur_up1 = Deblur_Up(512, 512, 256)
-        self.deblur_up2 = Deblur_Up(256, 256, 128)
-        self.deblur_up3 = Deblur_Up(128, 128, 64)
-        self.deblur_up4 = Deblur_Up(64, 96, 64)
-        self.deblur_up5 = Deblur_Up(64, 32, 3)
+        if deblur_decoder == 'light':
+            # a single separable conv at stride 2 and full resolution, where most of the decoder time goes
+            self.deblur_up1 = Deblur_Up_light(512, 512, 256)
+            self.deblur_up2 = Deblur_Up_light(256, 128 + fusion_planes, 128)
+            self.deblur_up3 = Deblur_Up_light(128, 128, 64)
+            self.deblur_up4 = Deblur_Up_light(64, 32 + stem_planes, 64, num_layers=1)
+            self.deblur_up5 = Deblur_Up_light(64, 32, 3, num_layers=1)
+        elif deblur_decoder == 'standard':
+            self.deblur_up1 = Deblur_Up(512, 512, 256)
+            self.deblur_up2 = Deblur_Up(256, 128 + fusion_planes, 128)
+            self.deblur_up3 = Deblur_Up(128, 128, 64)
+            self.deblur_up4 = Deblur_Up(64, 32 + stem_planes, 64)
+            self.deblur_up5 = Deblur_Up(64, 32, 3)
+        else:
+            raise ValueError('unknown deblur decoder {}, expected standard | light'.format(deblur_decoder))
 
-        self.MAGFF_attention = MAGFF(channels=128)
+        self.MAGFF_attention = MAGFF(channels=fusion_planes)
 
         for head in sorted(self.heads):
             num_output = self.heads[head]
@@ -269,12 +373,16 @@ class DREB_Net_tiny(nn.Module):
         return layer
 
 
-    def forward(self, x, mode):
+    def forward(self, x, mode='val'):
         out = self.stage0(x)
         s0 = out
         s1 = self.deblur_down1(s0)
         s2 = self.deblur_down2(s1)
 
+        if mode == 'deblur':
+            # restored image only, the detection path is skipped
+            return self.deblur(s0, s1, s2)
+
         for block in self.stage1:
             if self.use_checkpoint:
                 out = checkpoint.checkpoint(block, out)
@@ -316,24 +424,30 @@ class DREB_Net_tiny(nn.Module):
             return [ret]
         
         elif mode == 'train':
-            deblur_inp = s2
-            down3 = self.deblur_down3(deblur_inp)
-            down4 = self.deblur_down4(down3)
-            up1 = self.deblur_up1(down4, down3)
-            up2 = self.deblur_up2(up1, s2)
-            up3 = self.deblur_up3(up2, s1)
-            up4 = self.deblur_up4(up3, s0)
-            deblur_out = self.deblur_up5(up4, None)
+            deblur_out = self.deblur(s0, s1, s2)
 
             return [ret], deblur_out
         else:
-            raise ValueError("mode not eq train/val!!!")
+            raise ValueError("mode not eq train/val/deblur!!!")
+
+
+    def deblur(self, s0, s1, s2):
+        down3 = self.deblur_down3(s2)
+        down4 = self.deblur_down4(down3)
+        up1 = self.deblur_up1(down4, down3)
+        up2 = self.deblur_up2(up1, s2)
+        up3 = self.deblur_up3(up2, s1)
+        up4 = self.deblur_up4(up3, s0)
+        return self.deblur_up5(up4, None)
 
 
-def create_DREB_Net_tiny_detect(deploy=False, use_checkpoint=False, heads=None, head_conv=None):
+def create_DREB_Net_tiny_detect(deploy=False, use_checkpoint=False, heads=None, head_conv=None,
+                    num_blocks=(4, 6, 16, 1), width_multiplier=(1, 1, 1, 1), override_groups_map=None,
+                    deblur_decoder='standard'):
     print('create_DREB_Net_tiny_detect')
-    return DREB_Net_tiny(override_groups_map=None, deploy=deploy, use_checkpoint=use_checkpoint, 
-                  heads=heads, head_conv=head_conv)
+    return DREB_Net_tiny(num_blocks=list(num_blocks), width_multiplier=list(width_multiplier),
+                  override_groups_map=override_groups_map, deploy=deploy, use_checkpoint=use_checkpoint, 
+                  heads=heads, head_conv=head_conv, deblur_decoder=deblur_decoder)
 
 
 
@@ -0,0 +1,125 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+
+from .model import create_model, parse_arch
+
+# stages whose width is free: stage0 / stage2 outputs are shared with the deblur branch and MAGFF,
+# stage1 shares its width multiplier with stage0
+_prunable_stages = {'stage3': (2, 256), 'stage4': (3, 512)}
+
+
+def bn_importance(model, stage):
+    # sum over the blocks of a stage of |gamma| of the dense, 1x1 and identity BatchNorms, per channel
+    score = 0
+    for block in getattr(model, stage):
+        for bn in [block.rbr_dense.bn, block.rbr_1x1.bn, block.rbr_identity]:
+            if bn is not None:
+                score = score + bn.weight.detach().abs()
+    return score
+
+
+class SEStatistics(object):
+    '''Mean SE gate of every channel of the prunable stages, over their blocks and the calibration images.
+
+    Register on the model, run forwards over a calibration set, then `importance(stage)`.
+    '''
+    def __init__(self, model):
+        self.sums, self.counts, self.hooks = {}, {}, []
+        for stage in _prunable_stages:
+            for block in getattr(model, stage):
+                if not hasattr(block.se, 'up'):
+                    raise ValueError('{} has no SE attention, use the bn criterion'.format(type(block).__name__))
+                self.hooks.append(block.se.up.register_forward_hook(self._hook(stage)))
+
+    def _hook(self, stage):
+        def hook(m, i, o):
+            gate = torch.sigmoid(o.detach()).reshape(o.shape[0], -1).sum(0)
+            self.sums[stage] = self.sums.get(stage, 0) + gate
+            self.counts[stage] = self.counts.get(stage, 0) + o.shape[0]
+        return hook
+
+    def importance(self, stage):
+        return self.sums[stage] / self.counts[stage]
+
+    def remove(self):
+        for h in self.hooks:
+            h.remove()
+
+
+def _kept(importance, ratio):
+    # indices of the channels kept, a multiple of 16 (SE uses channels // 16 neurons), in channel order
+    num = max(int(round(len(importance) * (1 - ratio) / 16)) * 16, 16)
+    return torch.sort(torch.argsort(importance, descending=True)[:num])[0]
+
+
+def _se_kept(block, kept):
+    # SE neurons kept for the pruned channels: the ones with the largest weights on them
+    down, up = block.se.down.weight.detach(), block.se.up.weight.detach()
+    score = down[:, kept].abs().sum((1, 2, 3)) * up[kept].abs().sum((0, 2, 3))
+    return torch.sort(torch.argsort(score, descending=True)[:len(kept) // 16])[0]
+
+
+def pruned_arch(arch, widths):
+    '''arch string of `arch` with the stage widths (channels) in `widths` {stage: channels}'''
+    base, kwargs = parse_arch(arch)
+    width = list(kwargs.get('width_multiplier', [1, 1, 1, 1]))
+    for stage, channels in widths.items():
+        index, planes = _prunable_stages[stage]
+        width[index] = channels / planes  # exact, the planes are powers of 2
+    name = base + '_w' + '-'.join('{:g}'.format(w) for w in width)
+    if 'num_blocks' in kwargs:
+        name += '_d' + '-'.join(str(d) for d in kwargs['num_blocks'])
+    if kwargs.get('deblur_decoder') == 'light':
+        name += '_light'
+    return name
+
+
+def prune_model(model, arch, heads, head_conv, importance, ratio):
+    '''Removes the `ratio` least important channels of every prunable stage.
+
+    `importance` is {stage: per-channel score}. A stage keeps one channel set
+    for all its blocks (the identity branches add block inputs to outputs), so
+    the dense, 1x1 and identity branches and the SE attention of every block,
+    the input of the next stage and of deconv_layers1 are sliced consistently.
+    Returns the pruned model, created from its arch string, and that string.
+    '''
+    if parse_arch(arch)[1].get('override_groups_map'):
+        raise ValueError('pruning grouped convs is not supported ({})'.format(arch))
+    kept = {stage: _kept(importance[stage], ratio) for stage in _prunable_stages}
+    name = pruned_arch(arch, {stage: len(k) for stage, k in kept.items()})
+    state_dict = {k: v.detach().clone() for k, v in model.state_dict().items()}
+
+    def select(key, dim, index):
+        state_dict[key] = state_dict[key].index_select(dim, index)
+
+    in_kept = None  # stage2 is not pruned
+    for stage in _prunable_stages:
+        out_kept = kept[stage]
+        for b, block in enumerate(getattr(model, stage)):
+            prefix = '{}.{}.'.format(stage, b)
+            for branch in ['rbr_dense', 'rbr_1x1']:
+                select(prefix + branch + '.conv.weight', 0, out_kept)
+                if in_kept is not None:
+                    select(prefix + branch + '.conv.weight', 1, in_kept)
+                for p in ['weight', 'bias', 'running_mean', 'running_var']:
+                    select(prefix + branch + '.bn.' + p, 0, out_kept)
+            if block.rbr_identity is not None:
+                for p in ['weight', 'bias', 'running_mean', 'running_var']:
+                    select(prefix + 'rbr_identity.' + p, 0, out_kept)
+            if hasattr(block.se, 'up'):
+                se_kept = _se_kept(block, out_kept)
+                select(prefix + 'se.down.weight', 0, se_kept)
+                select(prefix + 'se.down.weight', 1, out_kept)
+                select(prefix + 'se.down.bias', 0, se_kept)
+                select(prefix + 'se.up.weight', 0, out_kept)
+                select(prefix + 'se.up.weight', 1, se_kept)
+                select(prefix + 'se.up.bias', 0, out_kept)
+            in_kept = out_kept
+    select('deconv_layers1.0.weight', 0, in_kept)
+
+    pruned = create_model(name, heads, head_conv)
+    pruned.load_state_dict(state_dict)
+    return pruned.train(model.training), name
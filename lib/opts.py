@@ -28,13 +28,23 @@ class opts(object):
         self.parser.add_argument('--load_model', default='', help='path to pretrained model')
         self.parser.add_argument('--resume', action='store_true', help='resume an experiment. Reloaded the optimizer parameter and set load_model to model_last.pth in the exp dir if load_model is empty.') 
         self.parser.add_argument('--demo_save_path', default='../exp/test_image_save', help='path to demo images') 
+        self.parser.add_argument('--demo_with_deblur', action='store_true', help='draw the detections on the deblurred image.')
+        self.parser.add_argument('--demo_deblur_only', action='store_true', help='only save the deblurred images, the detection path is not run.')
 
 
         # system
         self.parser.add_argument('--gpus', default='0', help='-1 for CPU, use comma for multiple gpus')
         self.parser.add_argument('--num_workers', type=int, default=20, help='dataloader threads. 0 for single-thread.')
+        self.parser.add_argument('--image_cache', default='', help='directory of decoded sharp / blur images built by tools/build_image_cache.py, read instead of the JPEGs. empty to disable.')
+        self.parser.add_argument('--shards', default='', help='directory of the packed train shards built by tools/pack_shards.py, read sequentially instead of the image files. empty to disable.')
+        self.parser.add_argument('--shard_shuffle_buffer', type=int, default=256, help='samples shuffled in memory by each loader worker reading --shards.')
+        self.parser.add_argument('--shard_read_size', type=float, default=64, help='MB per sequential read of a shard.')
         self.parser.add_argument('--not_cuda_benchmark', action='store_true', help='disable when the input size is not fixed.')
         self.parser.add_argument('--seed', type=int, default=317, help='random seed') # from CornerNet
+        self.parser.add_argument('--intra_threads', type=int, default=0, help='torch intra-op threads of inference. 0 for the torch default.')
+        self.parser.add_argument('--inter_threads', type=int, default=0, help='torch inter-op threads of inference. 0 for the torch default.')
+        self.parser.add_argument('--cv_threads', type=int, default=-1, help='OpenCV threads used by pre_process resize/warp. -1 for the OpenCV default.')
+        self.parser.add_argument('--cpu_affinity', default='', help='pin the inference process to these cpus, e.g. 0-7 or 0,2,4,6.')
 
         # log
         self.parser.add_argument('--print_iter', type=int, default=0, help='disable progress bar and print to screen.')
@@ -45,7 +55,7 @@ class opts(object):
         self.parser.add_argument('--debugger_theme', default='white', choices=['white', 'black'])
         
         # model
-        self.parser.add_argument('--arch', default='DREB_Net', help='model architecture. Currently tested')
+        self.parser.add_argument('--arch', default='DREB_Net', help='model architecture: DREB_Net | DREB_Net_tiny, optionally with _w<width multiplier(s)>_d<blocks per stage>_g<groups>_light, e.g. DREB_Net_w0.5_d2-4-8-1_g4')
         self.parser.add_argument('--head_conv', type=int, default=-1,
                                  help='conv layer channels for output head'
                                       '0 for no conv layer | -1 for default setting: 64 for resnets and 256 for dla.')
@@ -69,15 +79,57 @@ class opts(object):
         self.parser.add_argument('--trainval', action='store_true', help='include validation in training and test on test set')
         self.parser.add_argument('--deblur_train_end_epoch', type=int, default=100, help='deblur end training epoch.')
         self.parser.add_argument('--train_mode', default='continuous', help='continuous | interval')
+        self.parser.add_argument('--val_map', action='store_true', help='also compute the COCO mAP of the validation set at every validation epoch.')
 
         # test
         self.parser.add_argument('--flip_test', action='store_true', help='flip data augmentation.')
         self.parser.add_argument('--test_scales', type=str, default='1', help='multi scale test augmentation.')
         self.parser.add_argument('--nms', action='store_true', help='run nms in testing.')
         self.parser.add_argument('--K', type=int, default=100, help='max number of output objects.') 
+        self.parser.add_argument('--stream_results', action='store_true', help='write detections to a binary file while testing and evaluate it in chunks, instead of keeping them all in memory.')
         self.parser.add_argument('--not_prefetch_test', action='store_true', help='not use parallal data pre-processing.')
+        self.parser.add_argument('--prefetch_transport', default='shm', help='shm | pickle. how prefetch workers hand inputs to test.py, shm falls back to pickle for tiling / keep_res / other detectors.')
+        self.parser.add_argument('--prefetch_workers', type=int, default=1, help='prefetch worker processes of test.py.')
+        self.parser.add_argument('--prefetch_depth', type=int, default=4, help='shared memory slots (images in flight) of the shm prefetcher.')
+        self.parser.add_argument('--num_procs', type=int, default=1, help='CPU inference processes forked by test.py, sharing one copy of the model weights.')
         self.parser.add_argument('--fix_res', action='store_true', help='fix testing resolution or keep the original resolution')
         self.parser.add_argument('--keep_res', action='store_true', help='keep the original resolution during validation.')
+        self.parser.add_argument('--tile_size', type=int, default=0, help='tiled inference on the full resolution frame with tiles of this size. 0 to disable.')
+        self.parser.add_argument('--tile_overlap', type=float, default=0.2, help='overlap between neighbouring tiles, fraction of tile_size.')
+        self.parser.add_argument('--tile_batch', type=int, default=4, help='tiles per forward pass, bounds memory of tiled inference.')
+        self.parser.add_argument('--tile_nms_thresh', type=float, default=0.5, help='iou threshold merging duplicates across tile seams.')
+        self.parser.add_argument('--detector', default='ctdet', help='ctdet | coarse_to_fine | cascade | blur_route | adaptive')
+        self.parser.add_argument('--coarse_arch', default='', help='model of the coarse pass, e.g. DREB_Net_tiny. empty to reuse --arch on the downscaled frame.')
+        self.parser.add_argument('--coarse_model', default='', help='checkpoint of --coarse_arch.')
+        self.parser.add_argument('--coarse_thresh', type=float, default=0.1, help='tiles whose coarse heatmap peak is below this are skipped.')
+        self.parser.add_argument('--cascade_arch', default='DREB_Net_tiny', help='cheap model run on every frame by the cascade detector.')
+        self.parser.add_argument('--cascade_model', default='', help='checkpoint of --cascade_arch.')
+        self.parser.add_argument('--escalate_policy', default='peaks,blur', help='when to escalate to --arch: any of peaks,blur | all | none')
+        self.parser.add_argument('--escalate_low', type=float, default=0.1, help='lower score of a mid-confidence peak.')
+        self.parser.add_argument('--escalate_high', type=float, default=0.3, help='upper score of a mid-confidence peak.')
+        self.parser.add_argument('--escalate_peaks', type=int, default=20, help='escalate when at least this many mid-confidence peaks.')
+        self.parser.add_argument('--escalate_sharpness', type=float, default=50, help='escalate when the laplacian variance of the input is below this, same scale as --route_sharpness with --blur_measure laplacian.')
+        self.parser.add_argument('--route_sharp_arch', default='DREB_Net_tiny', help='cheaper sharp-trained model used for sharp frames by the blur router.')
+        self.parser.add_argument('--route_sharp_model', default='', help='checkpoint of --route_sharp_arch.')
+        self.parser.add_argument('--blur_measure', default='laplacian', help='laplacian | spectral')
+        self.parser.add_argument('--route_sharpness', type=float, default=100, help='frames sharper than this go to --route_sharp_arch, the others to the SB_deblur model.')
+        self.parser.add_argument('--latency_slo', type=float, default=80, help='per-frame latency target in ms of the adaptive detector.')
+        self.parser.add_argument('--latency_percentile', type=float, default=95, help='percentile of the frame latency held under --latency_slo.')
+        self.parser.add_argument('--latency_window', type=int, default=30, help='frames per controller decision.')
+        self.parser.add_argument('--latency_ladder', default='', help='res/scales[/flip] rungs separated by ;, best first. empty derives it from --input_res/--test_scales/--flip_test.')
+        self.parser.add_argument('--deploy_transforms', default='', help='inference-only model transforms applied after loading, comma separated: repvgg | conv_bn | deconv | magff')
+        self.parser.add_argument('--prepared_cache', default='', help='directory caching the loaded and transformed model across starts. empty to disable.')
+        self.parser.add_argument('--memory_plan', action='store_true', help='cpu: record the activation lifetimes of the first forward and run the next ones of that input shape in one planned, reused buffer (--fix_res).')
+        self.parser.add_argument('--result_cache', default='', help='directory of the on-disk detection result cache. empty to disable.')
+        self.parser.add_argument('--result_cache_size', type=float, default=1024, help='MB of cached results kept, least recently used ones are evicted.')
+        self.parser.add_argument('--result_cache_bypass', action='store_true', help='always run the model, refreshing the cached results.')
+
+        # batching (multi-stream scheduler / server)
+        self.parser.add_argument('--max_batch', type=int, default=8, help='max frames per dynamic batch.')
+        self.parser.add_argument('--max_wait', type=float, default=30, help='max ms the oldest queued frame waits for its batch to fill.')
+        self.parser.add_argument('--stream_queue', type=int, default=2, help='frames buffered per stream, the oldest is dropped on overload.')
+        self.parser.add_argument('--port', type=int, default=8000, help='localhost port of serve.py.')
+        self.parser.add_argument('--unix_socket', default='', help='serve on this unix socket path instead of a localhost port.')
 
         # dataset
         self.parser.add_argument('--not_rand_crop', action='store_true', help='not use the random crop data augmentation from CornerNet.')
@@ -95,6 +147,18 @@ class opts(object):
         self.parser.add_argument('--off_weight', type=float, default=1, help='loss weight for keypoint local offsets.')
         self.parser.add_argument('--wh_weight', type=float, default=0.1, help='loss weight for bounding box size.')
         self.parser.add_argument('--deblur_weight', type=float, default=0.05, help='loss weight for deblur.')
+        self.parser.add_argument('--deblur_decoder', default='standard', choices=['standard', 'light'],
+                                 help='deblur decoder of --arch: standard (three 3x3 convs per up block) | light (depthwise separable, '
+                                      'fewer layers at high resolution). light appends _light to --arch.')
+
+        # distillation
+        self.parser.add_argument('--teacher_model', default='', help='checkpoint of a frozen teacher distilled into --arch during training. empty to disable.')
+        self.parser.add_argument('--teacher_arch', default='DREB_Net', help='architecture of --teacher_model.')
+        self.parser.add_argument('--teacher_half', action='store_true', help='run the teacher in fp16 (bf16 on cpu) autocast.')
+        self.parser.add_argument('--distill_hm_weight', type=float, default=1, help='loss weight for matching the teacher heatmaps.')
+        self.parser.add_argument('--distill_wh_weight', type=float, default=0.1, help='loss weight for matching the teacher box sizes where it sees objects.')
+        self.parser.add_argument('--distill_off_weight', type=float, default=1, help='loss weight for matching the teacher offsets where it sees objects.')
+        self.parser.add_argument('--distill_feat_weight', type=float, default=0, help='loss weight for matching the teacher stage2 features. 0 to disable.')
 
         # task
         self.parser.add_argument('--norm_wh', action='store_true', help='L1(\hat(y) / y, 1) or L1(\hat(y), y)')
@@ -123,6 +187,9 @@ class opts(object):
         print('Fix size testing.' if opt.fix_res else 'Keep resolution testing.')
         opt.reg_offset = not opt.not_reg_offset
 
+        if opt.deblur_decoder == 'light' and not opt.arch.endswith('_light'):
+            opt.arch += '_light'
+
         if opt.head_conv == -1: # init default head_conv
             opt.head_conv = 64
         opt.pad = 31
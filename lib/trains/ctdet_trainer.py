@@ -18,6 +18,7 @@ print(sys.path)
 from models.losses import FocalLoss
 from models.losses import RegL1Loss, RegLoss, NormRegL1Loss, RegWeightedL1Loss
 from models.losses import mse_loss, ssim_loss, PerceptualLoss, Stripformer_Loss
+from models.losses import DistillHmLoss, DistillRegL1Loss
 from models.decode import ctdet_decode
 from models.utils import _sigmoid
 from utils.utils import AverageMeter
@@ -27,20 +28,71 @@ from utils.oracle_utils import gen_oracle_map
 
 
 class ModelWithLoss(torch.nn.Module):
-    def __init__(self, model, loss, opt):
+    def __init__(self, model, loss, opt, teacher=None):
         super(ModelWithLoss, self).__init__()
         self.model = model
         self.loss = loss
         self.opt = opt
-    
+        self.teacher = teacher
+        # stage2 outputs for the feature distillation, by device (DataParallel replicas share the hooks)
+        self.features = {}
+        if teacher is not None:
+            for p in teacher.parameters():
+                p.requires_grad = False
+            teacher.eval()
+            if opt.distill_feat_weight > 0:
+                model.stage2[-1].register_forward_hook(self._save_feature('student'))
+                teacher.stage2[-1].register_forward_hook(self._save_feature('teacher'))
+
+    def _save_feature(self, name):
+        def hook(m, i, o):
+            self.features[(name, o.device)] = o
+        return hook
+
+    def train(self, mode=True):
+        super(ModelWithLoss, self).train(mode)
+        if self.teacher is not None:
+            # frozen, BatchNorm statistics included
+            self.teacher.eval()
+        return self
+
+    def run_teacher(self, inp):
+        dtype = torch.float16 if inp.device.type == 'cuda' else torch.bfloat16
+        with torch.no_grad(), torch.autocast(inp.device.type, dtype=dtype, enabled=self.opt.teacher_half):
+            outputs = self.teacher(inp, 'val')[-1]
+        return {head: outputs[head].float() for head in outputs}
+
     def forward(self, batch, phase, epoch):
-        if self.opt.inp_sharp_or_blur == 'sharp': 
-            outputs = self.model(batch['sharp_input'])
-        elif self.opt.inp_sharp_or_blur == 'blur':
-            outputs = self.model(batch['blur_input'])
-        elif self.opt.inp_sharp_or_blur == 'SB_deblur':
-            outputs = self.model(batch['blur_input'], phase)
-        loss, loss_stats = self.loss(outputs, batch, epoch, phase)
+        if self.opt.inp_sharp_or_blur == 'sharp':
+            inp = batch['sharp_input']
+        else:
+            inp = batch['blur_input']
+
+        teacher_outputs, stream = None, None
+        if self.teacher is not None and phase == 'train':
+            if inp.is_cuda:
+                # queued on a side stream first, so the teacher runs concurrently with the student forward
+                stream = torch.cuda.Stream(device=inp.device)
+                stream.wait_stream(torch.cuda.current_stream(inp.device))
+                with torch.cuda.stream(stream):
+                    teacher_outputs = self.run_teacher(inp)
+            else:
+                teacher_outputs = self.run_teacher(inp)
+
+        if self.opt.inp_sharp_or_blur == 'SB_deblur':
+            outputs = self.model(inp, phase)
+        else:
+            outputs = self.model(inp)
+
+        features = None
+        if teacher_outputs is not None:
+            if self.opt.distill_feat_weight > 0:
+                features = (self.features.pop(('student', inp.device)), self.features.pop(('teacher', inp.device)).float())
+            if stream is not None:
+                torch.cuda.current_stream(inp.device).wait_stream(stream)
+                for t in list(teacher_outputs.values()) + list(features or [])[1:]:
+                    t.record_stream(torch.cuda.current_stream(inp.device))
+        loss, loss_stats = self.loss(outputs, batch, epoch, phase, teacher_outputs, features)
         return outputs[-1], loss, loss_stats
 
 
@@ -57,11 +109,16 @@ class CtdetLoss(torch.nn.Module):
         if opt.inp_sharp_or_blur == 'SB_deblur' and opt.deblur_loss == 'Stripformer':
             self.deblur_loss_Stripformer = Stripformer_Loss()
 
+        self.distill = opt.teacher_model != ''
+        if self.distill:
+            self.crit_distill_hm = DistillHmLoss()
+            self.crit_distill_reg = DistillRegL1Loss()
+
         self.opt = opt
 
-    def forward(self, outputs, batch, epoch, phase):
+    def forward(self, outputs, batch, epoch, phase, teacher_outputs=None, features=None):
         opt = self.opt
-        hm_loss, wh_loss, off_loss, deblur_loss = 0, 0, 0, 0
+        hm_loss, wh_loss, off_loss, deblur_loss, distill_loss = 0, 0, 0, 0, 0
         for s in range(opt.num_stacks):
             if opt.inp_sharp_or_blur == 'SB_deblur' and phase == 'train':
                 output, deblur_out = outputs[0][s], outputs[1]
@@ -104,6 +161,15 @@ class CtdetLoss(torch.nn.Module):
                 off_loss += self.crit_reg(output['reg'], batch['reg_mask'],
                                           batch['ind'], batch['reg']) / opt.num_stacks
 
+            if teacher_outputs is not None:
+                teacher_hm = _sigmoid(teacher_outputs['hm'])
+                distill_loss += opt.distill_hm_weight * self.crit_distill_hm(output['hm'], teacher_hm) / opt.num_stacks
+                distill_loss += opt.distill_wh_weight * self.crit_distill_reg(
+                    output['wh'], teacher_outputs['wh'], teacher_hm) / opt.num_stacks
+                if opt.reg_offset:
+                    distill_loss += opt.distill_off_weight * self.crit_distill_reg(
+                        output['reg'], teacher_outputs['reg'], teacher_hm) / opt.num_stacks
+
             if opt.inp_sharp_or_blur == 'SB_deblur':
                 # if epoch <= opt.deblur_train_end_epoch and phase == 'train':
                 if (phase=='train' and opt.train_mode=='continuous' and epoch<=opt.deblur_train_end_epoch) or \
@@ -126,18 +192,26 @@ class CtdetLoss(torch.nn.Module):
         else:
             loss = opt.hm_weight * hm_loss + opt.wh_weight * wh_loss + opt.off_weight * off_loss
             loss_stats = {'loss': loss, 'hm_loss': hm_loss, 'wh_loss': wh_loss, 'off_loss': off_loss}
-            
+
+        if self.distill:
+            if features is not None:
+                distill_loss += opt.distill_feat_weight * mse_loss(features[0], features[1])
+            # no teacher in the validation phase
+            distill_loss = distill_loss if torch.is_tensor(distill_loss) else torch.zeros_like(loss)
+            loss = loss + distill_loss
+            loss_stats['loss'] = loss
+            loss_stats['distill_loss'] = distill_loss
         return loss, loss_stats
 
 
 
 class CtdetTrainer(object):
-    def __init__(self, opt, model, optimizer=None, scheduler=None):
+    def __init__(self, opt, model, optimizer=None, scheduler=None, teacher=None):
         self.opt = opt
         self.optimizer = optimizer
         self.scheduler = scheduler
         self.loss_stats, self.loss = self._get_losses(opt)
-        self.model_with_loss = ModelWithLoss(model, self.loss, opt)
+        self.model_with_loss = ModelWithLoss(model, self.loss, opt, teacher)
 
 
     def run_epoch(self, phase, epoch, data_loader, logger):
@@ -196,7 +270,7 @@ class CtdetTrainer(object):
             if opt.debug > 0:
                 self.debug(batch, output, iter_id)
             
-            if opt.test:
+            if opt.test or (opt.val_map and phase == 'val'):
                 self.save_result(output, batch, results)
             del output, loss, loss_stats
 
@@ -219,6 +293,8 @@ class CtdetTrainer(object):
         loss_states = ['loss', 'hm_loss', 'wh_loss', 'off_loss']
         if opt.inp_sharp_or_blur == 'SB_deblur':
             loss_states.append('deblur_loss')
+        if opt.teacher_model != '':
+            loss_states.append('distill_loss')
         loss = CtdetLoss(opt)
         return loss_states, loss
 
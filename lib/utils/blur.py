@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from functools import lru_cache
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def laplacian_variance(image, size=512):
+    # sharpness of a BGR uint8 image: variance of its Laplacian on a downscaled gray copy.
+    # motion blur removes high frequencies, so lower values mean a blurrier frame.
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scale = size / max(gray.shape[0:2])
+    if scale < 1:
+        gray = cv2.resize(gray, (int(gray.shape[1] * scale), int(gray.shape[0] * scale)),
+                          interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+
+@lru_cache(maxsize=8)
+def _high_freq_mask(size, radius):
+    fy = np.fft.fftfreq(size)[:, None]
+    fx = np.fft.rfftfreq(size)[None, :]
+    return np.sqrt(fx ** 2 + fy ** 2) > radius * 0.5
+
+
+def spectral_sharpness(image, size=256, radius=0.25):
+    # fraction of the spectral energy above `radius` (relative to nyquist) of a downscaled gray copy.
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    power = np.abs(np.fft.rfft2(gray - gray.mean())) ** 2
+    return float(power[_high_freq_mask(size, radius)].sum() / (power.sum() + 1e-12))
+
+
+blur_measures = {
+    'laplacian': laplacian_variance,
+    'spectral': spectral_sharpness,
+}
+
+
+def batch_laplacian_variance(images, mean, std, size=512):
+    # laplacian_variance of a normalized BGR network input batch (B x 3 x H x W), on its device: same gray
+    # weights and area downscale to `size`, so values compare with --route_sharpness. The input is the warped
+    # frame, the padding of a non-square frame adds its borders to the measure.
+    mean = torch.as_tensor(mean, dtype=images.dtype, device=images.device).view(1, 3, 1, 1)
+    std = torch.as_tensor(std, dtype=images.dtype, device=images.device).view(1, 3, 1, 1)
+    weights = torch.tensor([0.114, 0.587, 0.299], dtype=images.dtype, device=images.device).view(1, 3, 1, 1)
+    gray = ((images * std + mean) * 255. * weights).sum(dim=1, keepdim=True)
+    scale = size / max(gray.shape[2:4])
+    if scale < 1:
+        gray = F.interpolate(gray, size=(int(gray.shape[2] * scale), int(gray.shape[3] * scale)), mode='area')
+    kernel = torch.tensor([[0., 1., 0.], [1., -4., 1.], [0., 1., 0.]],
+                          dtype=images.dtype, device=images.device).view(1, 1, 3, 3)
+    lap = F.conv2d(gray, kernel)
+    return lap.flatten(1).var(dim=1)
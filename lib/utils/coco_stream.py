@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import copy
+import io
+
+import numpy as np
+from pycocotools.coco import COCO
+from pycocotools.cocoeval import COCOeval
+
+# one row per detection, appended image by image
+result_dtype = np.dtype([('image_id', '<i8'), ('cls', '<i4'), ('bbox', '<f4', (4,)), ('score', '<f4')])
+
+
+class ResultsWriter(object):
+    '''Appends the per-class detections of each image to a binary columnar file.
+
+    Drop-in for the `results` dict of test.py: `writer[img_id] = ret['results']`
+    writes the rows (x, y, w, h boxes) and keeps nothing in memory.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'wb')
+        self.num_images = 0
+        self.num_dets = 0
+
+    def __setitem__(self, image_id, results):
+        rows = []
+        for cls_ind in results:
+            dets = np.asarray(results[cls_ind], dtype=np.float32).reshape(-1, 5)
+            r = np.zeros(len(dets), dtype=result_dtype)
+            r['image_id'] = int(image_id)
+            r['cls'] = cls_ind
+            r['bbox'][:, 0:2] = dets[:, 0:2]
+            r['bbox'][:, 2:4] = dets[:, 2:4] - dets[:, 0:2]
+            r['score'] = dets[:, 4]
+            rows.append(r)
+        if len(rows) > 0:
+            rows = np.concatenate(rows)
+            self.f.write(rows.tobytes())
+            self.num_dets += len(rows)
+        self.num_images += 1
+
+    def close(self):
+        self.f.close()
+
+
+def read_results(path):
+    return np.memmap(path, dtype=result_dtype, mode='r')
+
+
+def _load_res(coco, img_ids, rows, valid_ids):
+    # COCO.loadRes for the detections of a few images, also when there are none
+    res = COCO()
+    res.dataset['images'] = coco.loadImgs(img_ids)
+    anns = []
+    for i, r in enumerate(rows):
+        x, y, w, h = [float('{:.2f}'.format(v)) for v in r['bbox']]
+        anns.append({'id': i + 1, 'image_id': int(r['image_id']), 'category_id': int(valid_ids[r['cls'] - 1]),
+                     'bbox': [x, y, w, h], 'area': w * h, 'iscrowd': 0,
+                     # rounded like convert_eval_format
+                     'score': float('{:.2f}'.format(r['score']))})
+    res.dataset['annotations'] = anns
+    res.dataset['categories'] = copy.deepcopy(coco.dataset['categories'])
+    with contextlib.redirect_stdout(io.StringIO()):
+        res.createIndex()
+    return res
+
+
+def evaluate_stream(coco, path, valid_ids, chunk_size=500):
+    '''COCO bbox evaluation of a ResultsWriter file, `chunk_size` images at a time.
+
+    Per-image matching runs on one chunk of detections at a time and only the
+    arrays accumulate() reads (scores, matched / ignore flags) are kept, so
+    memory grows by a few bytes per detection instead of a python dict each.
+    Returns the accumulated COCOeval, ready for summarize().
+    '''
+    rows = read_results(path)
+    order = np.argsort(rows['image_id'], kind='mergesort')
+    sorted_ids = rows['image_id'][order]
+
+    coco_eval = COCOeval(coco, iouType='bbox')
+    p = coco_eval.params
+    p.imgIds = sorted(np.unique(p.imgIds).tolist())
+    p.catIds = sorted(np.unique(p.catIds).tolist())
+    p.maxDets = sorted(p.maxDets)
+    num_images, num_areas = len(p.imgIds), len(p.areaRng)
+    eval_imgs = [None] * (len(p.catIds) * num_areas * num_images)
+
+    for start in range(0, num_images, chunk_size):
+        img_ids = p.imgIds[start:start + chunk_size]
+        lo = np.searchsorted(sorted_ids, img_ids[0], side='left')
+        hi = np.searchsorted(sorted_ids, img_ids[-1], side='right')
+        chunk = rows[np.sort(order[lo:hi])]
+        chunk_eval = COCOeval(coco, _load_res(coco, img_ids, chunk, valid_ids), 'bbox')
+        chunk_eval.params.imgIds = img_ids
+        with contextlib.redirect_stdout(io.StringIO()):
+            chunk_eval.evaluate()
+        # evalImgs is ordered cat, area, image
+        for k in range(len(p.catIds)):
+            for a in range(num_areas):
+                for i in range(len(img_ids)):
+                    e = chunk_eval.evalImgs[(k * num_areas + a) * len(img_ids) + i]
+                    if e is None:
+                        continue
+                    eval_imgs[(k * num_areas + a) * num_images + start + i] = {
+                        'dtScores': np.asarray(e['dtScores'], dtype=np.float32),
+                        'dtMatches': e['dtMatches'] != 0,
+                        'dtIgnore': e['dtIgnore'].astype(bool),
+                        'gtIgnore': np.asarray(e['gtIgnore'], dtype=bool)}
+        del chunk_eval
+
+    coco_eval.evalImgs = eval_imgs
+    coco_eval._paramsEval = copy.deepcopy(p)
+    coco_eval.accumulate()
+    return coco_eval
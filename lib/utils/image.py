@@ -104,6 +104,20 @@ def crop(img, center, scale, output_size, rot=0):
     return dst_img
 
 
+# 将大图切分为相互重叠的正方形瓦片，返回每个瓦片在原图坐标系下的中心点
+def get_tile_centers(height, width, tile_size, overlap):
+    stride = max(int(tile_size * (1 - overlap)), 1)
+
+    def centers_1d(length):
+        if length <= tile_size:
+            return [length / 2.]
+        starts = list(range(0, length - tile_size, stride)) + [length - tile_size]
+        return [start + tile_size / 2. for start in starts]
+
+    return [np.array([cx, cy], dtype=np.float32)
+            for cy in centers_1d(height) for cx in centers_1d(width)]
+
+
 # 计算高斯核的半径，使得生成的高斯分布覆盖的区域能满足特定的重叠率要求
 # 这在目标检测中创建理想的热图时非常有用，以确保目标区域被适当地标记
 def gaussian_radius(det_size, min_overlap=0.7):
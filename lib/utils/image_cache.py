@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import numpy as np
+
+# decoded BGR uint8 images of one split: <split>.bin holds the pixels, each image starting on a page
+# boundary, <split>.json the index {img_id: {stream: [offset, height, width]}}
+_ALIGN = 4096
+
+
+def cache_paths(cache_dir, split):
+    return os.path.join(cache_dir, split + '.bin'), os.path.join(cache_dir, split + '.json')
+
+
+class ImageCacheWriter(object):
+    '''Appends decoded images of a split to its cache files, `close` writes the index.'''
+    def __init__(self, cache_dir, split, sources):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.data_path, self.index_path = cache_paths(cache_dir, split)
+        # the index of a previous cache would describe the truncated data file until `close`
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        self.f = open(self.data_path, 'wb')
+        self.offset = 0
+        # image directories of the streams, recorded to tell stale caches apart
+        self.index = {'sources': sources, 'images': {}}
+
+    def add(self, img_id, stream, img):
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        self.f.write(img.tobytes())
+        self.index['images'].setdefault(str(img_id), {})[stream] = [self.offset, img.shape[0], img.shape[1]]
+        self.offset += img.nbytes
+        padding = -self.offset % _ALIGN
+        self.f.write(b'\0' * padding)
+        self.offset += padding
+
+    def close(self):
+        self.f.close()
+        # the index goes last, a cache interrupted while writing has none and is not used
+        with open(self.index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+
+class ImageCache(object):
+    '''Read-only, memory-mapped decoded images written by ImageCacheWriter.
+
+    `get` returns a (height, width, 3) uint8 view of the mapped file, nothing is
+    copied or decoded; the pages are shared by all loader workers through the
+    page cache. The file is mapped on first use, after the workers fork.
+    '''
+    def __init__(self, cache_dir, split):
+        self.data_path, index_path = cache_paths(cache_dir, split)
+        with open(index_path) as f:
+            index = json.load(f)
+        self.sources = index['sources']
+        self.images = index['images']
+        self.data = None
+
+    def get(self, img_id, stream):
+        entry = self.images.get(str(img_id), {}).get(stream)
+        if entry is None:
+            return None
+        if self.data is None:
+            self.data = np.memmap(self.data_path, dtype=np.uint8, mode='r')
+        offset, height, width = entry
+        return self.data[offset:offset + height * width * 3].reshape(height, width, 3)
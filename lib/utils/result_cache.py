@@ -0,0 +1,177 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import shutil
+import time
+
+import numpy as np
+
+
+def hash_array(array):
+    array = np.ascontiguousarray(array)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((array.shape, array.dtype.str)).encode('utf-8'))
+    h.update(memoryview(array).cast('B'))
+    return h.digest()
+
+
+def hash_file(path, chunk_size=1 << 22):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    '''On-disk cache of per-class detections keyed by content.
+
+    Entries are .npz files under `cache_dir/data`, located through an open
+    addressing hash table kept in a memory-mapped file (`cache_dir/index.bin`),
+    so a lookup touches a few index slots and at most one file. When the
+    entries exceed `max_size` bytes or 3/4 of the index slots, the least
+    recently used ones are evicted. One writer process per cache directory.
+    '''
+    index_dtype = np.dtype([('k0', '<u8'), ('k1', '<u8'), ('atime', '<f8'), ('size', '<i8')])
+
+    def __init__(self, cache_dir, max_size=1 << 30, capacity=1 << 16):
+        self.cache_dir = cache_dir
+        self.data_dir = os.path.join(cache_dir, 'data')
+        self.max_size = max_size
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        index_path = os.path.join(cache_dir, 'index.bin')
+        expected = capacity * self.index_dtype.itemsize
+        if not os.path.exists(index_path) or os.path.getsize(index_path) != expected:
+            # no usable index, whatever is left in data/ is unreachable
+            if os.path.exists(self.data_dir):
+                shutil.rmtree(self.data_dir)
+            os.makedirs(cache_dir, exist_ok=True)
+            np.memmap(index_path, dtype=self.index_dtype, mode='w+', shape=(capacity,)).flush()
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.index = np.memmap(index_path, dtype=self.index_dtype, mode='r+', shape=(capacity,))
+        used = self._used()
+        self.num_entries = int(used.sum())
+        self.total_size = int(self.index['size'][used].sum())
+
+    def key(self, *parts):
+        h = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            h.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        return h.digest()
+
+    def _used(self):
+        return (self.index['k0'] != 0) | (self.index['k1'] != 0)
+
+    def _path(self, k0, k1):
+        name = '{:016x}{:016x}'.format(k0, k1)
+        return os.path.join(self.data_dir, name[:2], name + '.npz')
+
+    def _find(self, key):
+        '''Returns (slot, found): the slot holding `key`, or the free slot it would go to.'''
+        k0 = int.from_bytes(key[:8], 'little')
+        k1 = int.from_bytes(key[8:], 'little')
+        slot = k0 % self.capacity
+        for _ in range(self.capacity):
+            entry = self.index[slot]
+            if entry['k0'] == 0 and entry['k1'] == 0:
+                return slot, False
+            if entry['k0'] == k0 and entry['k1'] == k1:
+                return slot, True
+            slot = (slot + 1) % self.capacity
+        return -1, False
+
+    def get(self, key):
+        slot, found = self._find(key)
+        if not found:
+            self.misses += 1
+            return None
+        entry = self.index[slot]
+        try:
+            with np.load(self._path(entry['k0'], entry['k1'])) as data:
+                results = {int(j): data[j] for j in data.files}
+        except (IOError, ValueError):
+            self._evict(np.array([slot]))
+            self.misses += 1
+            return None
+        self.index['atime'][slot] = time.time()
+        self.hits += 1
+        return results
+
+    def put(self, key, results):
+        slot, found = self._find(key)
+        k0 = int.from_bytes(key[:8], 'little')
+        k1 = int.from_bytes(key[8:], 'little')
+        path = self._path(k0, k1)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, **{str(j): results[j] for j in results})
+        size = os.path.getsize(path)
+        if found:
+            # the file is rewritten in place, the entry keeps its slot with the new size
+            self.total_size += size - int(self.index['size'][slot])
+            self.index[slot] = (k0, k1, time.time(), size)
+            self.index.flush()
+            self.stores += 1
+            if self.total_size > self.max_size:
+                self._evict_lru(self.total_size - self.max_size)
+            return
+        if self.total_size + size > self.max_size or self.num_entries + 1 > self.capacity * 3 // 4:
+            self._evict_lru(self.total_size + size - self.max_size)
+            slot, _ = self._find(key)
+        self.index[slot] = (k0, k1, time.time(), size)
+        self.index.flush()
+        self.num_entries += 1
+        self.total_size += size
+        self.stores += 1
+
+    def _evict_lru(self, excess):
+        '''Drops the least recently used entries down to ~90% of both limits.'''
+        used = np.nonzero(self._used())[0]
+        order = used[np.argsort(self.index['atime'][used])]
+        num = 0
+        if excess > 0:
+            sizes = np.cumsum(self.index['size'][order])
+            num = int(np.searchsorted(sizes, excess + self.max_size // 10)) + 1
+        max_entries = self.capacity * 3 // 4
+        if self.num_entries + 1 > max_entries:
+            num = max(num, self.num_entries + 1 - max_entries * 9 // 10)
+        self._evict(order[:num])
+
+    def _evict(self, slots):
+        for slot in slots:
+            entry = self.index[slot]
+            path = self._path(entry['k0'], entry['k1'])
+            if os.path.exists(path):
+                os.remove(path)
+            self.num_entries -= 1
+            self.total_size -= int(entry['size'])
+            self.evictions += 1
+        self.index[slots] = (0, 0, 0., 0)
+        # linear probing has no tombstones, re-insert the survivors
+        used = np.nonzero(self._used())[0]
+        entries = self.index[used].copy()
+        self.index[used] = (0, 0, 0., 0)
+        for entry in entries:
+            slot = int(entry['k0']) % self.capacity
+            while self.index['k0'][slot] != 0 or self.index['k1'][slot] != 0:
+                slot = (slot + 1) % self.capacity
+            self.index[slot] = entry
+        self.index.flush()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores,
+                'evictions': self.evictions, 'entries': self.num_entries,
+                'size_mb': self.total_size / 2 ** 20,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.}
+
+    def summary(self):
+        return 'result cache: {hits} hits / {misses} misses ({rate:.1f}%) | {entries} entries, ' \
+               '{size_mb:.1f}MB | {evictions} evicted'.format(rate=100 * self.stats()['hit_rate'], **self.stats())
@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import struct
+
+import numpy as np
+
+# record: header (image id, sharp / blur JPEG sizes, number of annotations), the sharp JPEG bytes, the blur
+# JPEG bytes, then one (category_id, x, y, w, h) float32 row per annotation
+_HEADER = struct.Struct('<qIII')
+ann_dtype = np.dtype('<f4')
+
+
+def shard_index_path(shard_dir, split):
+    return os.path.join(shard_dir, split + '.json')
+
+
+def read_shard_index(shard_dir, split):
+    with open(shard_index_path(shard_dir, split)) as f:
+        return json.load(f)
+
+
+def pack_anns(anns):
+    return np.array([[ann['category_id']] + list(ann['bbox']) for ann in anns], dtype=ann_dtype).reshape(-1, 5)
+
+
+def unpack_anns(rows):
+    # the fields of the COCO annotations CTDetDataset.build_sample reads
+    return [{'category_id': int(r[0]), 'bbox': [float(v) for v in r[1:5]]} for r in rows]
+
+
+class ShardWriter(object):
+    '''Writes (sharp JPEG, blur JPEG, annotations) records of a split into shards of about `shard_size` bytes.
+
+    Shards are <split>-<n>.shard in `shard_dir`, `close` writes the index <split>.json
+    listing them with their record counts.
+    '''
+    def __init__(self, shard_dir, split, sources, shard_size):
+        os.makedirs(shard_dir, exist_ok=True)
+        self.shard_dir = shard_dir
+        self.split = split
+        self.shard_size = shard_size
+        self.f = None
+        # image directories the records were read from, to tell stale shards apart
+        self.index = {'sources': sources, 'num_records': 0, 'shards': []}
+
+    def _next_shard(self):
+        if self.f is not None:
+            self.f.close()
+        name = '{}-{:05d}.shard'.format(self.split, len(self.index['shards']))
+        self.f = open(os.path.join(self.shard_dir, name), 'wb')
+        self.index['shards'].append({'file': name, 'records': 0, 'bytes': 0})
+
+    def add(self, img_id, sharp_bytes, blur_bytes, anns):
+        shard = self.index['shards'][-1] if self.f is not None else None
+        if shard is None or shard['bytes'] >= self.shard_size:
+            self._next_shard()
+            shard = self.index['shards'][-1]
+        rows = pack_anns(anns)
+        record = b''.join([_HEADER.pack(int(img_id), len(sharp_bytes), len(blur_bytes), len(rows)),
+                           sharp_bytes, blur_bytes, rows.tobytes()])
+        self.f.write(record)
+        shard['records'] += 1
+        shard['bytes'] += len(record)
+        self.index['num_records'] += 1
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+        # the index goes last, shards of an interrupted run are not used
+        path = shard_index_path(self.shard_dir, self.split)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+
+def read_shard(path, read_size):
+    '''Yields the (img_id, sharp_bytes, blur_bytes, ann_rows) records of a shard.
+
+    The file is read front to back through a `read_size` buffer, so the
+    filesystem sees large sequential reads whatever the record sizes.
+    '''
+    with open(path, 'rb', buffering=read_size) as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) == 0:
+                return
+            img_id, sharp_len, blur_len, num_anns = _HEADER.unpack(header)
+            sharp_bytes = f.read(sharp_len)
+            blur_bytes = f.read(blur_len)
+            rows = np.frombuffer(f.read(num_anns * 5 * ann_dtype.itemsize), dtype=ann_dtype).reshape(-1, 5)
+            yield img_id, sharp_bytes, blur_bytes, rows
@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing as mp
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _worker(load_func, items, shm_name, num_slots, slot_shape, free_slots, ready):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        slots = np.ndarray((num_slots,) + slot_shape, dtype=np.uint8, buffer=shm.buf)
+        for key, item in items:
+            slot = free_slots.get()
+            meta = load_func(item, slots[slot])
+            ready.put((key, slot, meta))
+        ready.put((None, -1, None))
+    except Exception:
+        ready.put((None, -2, traceback.format_exc()))
+    finally:
+        del slots
+        shm.close()
+
+
+class ShmRingLoader(object):
+    '''Prefetches fixed-shape uint8 arrays through a ring of shared memory slots.
+
+    `num_workers` forked processes call `load_func(item, out)`, which fills the
+    slot `out` in place and returns a small picklable meta; only (key, slot,
+    meta) crosses the process boundary. A slot is reused once the consumer
+    calls `release(slot)`, so at most `depth` items are in flight.
+    '''
+    def __init__(self, items, load_func, slot_shape, num_workers=1, depth=4):
+        self.items = items
+        self.load_func = load_func
+        self.slot_shape = tuple(slot_shape)
+        self.num_workers = max(min(num_workers, len(items)), 1)
+        self.depth = max(depth, self.num_workers)
+        self.slot_bytes = int(np.prod(self.slot_shape))
+
+    def __len__(self):
+        return len(self.items)
+
+    def release(self, slot):
+        self.free_slots.put(slot)
+
+    def __iter__(self):
+        ctx = mp.get_context('fork')
+        shm = shared_memory.SharedMemory(create=True, size=self.depth * self.slot_bytes)
+        slots = np.ndarray((self.depth,) + self.slot_shape, dtype=np.uint8, buffer=shm.buf)
+        self.free_slots, ready = ctx.Queue(), ctx.Queue()
+        for slot in range(self.depth):
+            self.free_slots.put(slot)
+        procs = [ctx.Process(target=_worker, daemon=True,
+                             args=(self.load_func, self.items[i::self.num_workers], shm.name,
+                                   self.depth, self.slot_shape, self.free_slots, ready))
+                 for i in range(self.num_workers)]
+        for p in procs:
+            p.start()
+        running = len(procs)
+        try:
+            while running > 0:
+                key, slot, meta = ready.get()
+                if slot == -1:
+                    running -= 1
+                    continue
+                if slot == -2:
+                    raise RuntimeError('prefetch worker failed:\n' + meta)
+                yield key, slot, slots[slot], meta
+        finally:
+            for p in procs:
+                if p.is_alive():
+                    p.terminate()
+                p.join()
+            del slots
+            try:
+                shm.close()
+            except BufferError:
+                # the consumer still holds a view of the last slot, the mapping goes with it
+                pass
+            shm.unlink()
@@ -2,6 +2,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import sys
+from collections import deque
+
+import numpy as np
 import torch
 
 class AverageMeter(object):
@@ -20,4 +25,80 @@ class AverageMeter(object):
         self.sum += val * n
         self.count += n
         if self.count > 0:
-          self.avg = self.sum / self.count
\ No newline at end of file
+          self.avg = self.sum / self.count
+
+
+class LatencyMeter(object):
+    """Keeps a sliding window of latencies and reports percentiles"""
+    def __init__(self, window=10000):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.values = deque(maxlen=self.window)
+        self.count = 0
+
+    def update(self, val):
+        self.values.append(val)
+        self.count += 1
+
+    def percentile(self, q):
+        if len(self.values) == 0:
+            return 0.
+        return float(np.percentile(np.asarray(self.values), q))
+
+    def summary(self, percentiles=(50, 90, 99)):
+        return {'p{}'.format(q): self.percentile(q) for q in percentiles}
+
+
+def reset_peak_memory(device):
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+    elif sys.platform.startswith('linux'):
+        # resets VmHWM of this process
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+
+
+def peak_memory(device):
+    """Peak CUDA memory allocated, or peak RSS of the process on CPU, in MB"""
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated() / (1024 * 1024)
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def parse_cpu_list(cpus):
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    ret = []
+    for part in cpus.split(','):
+        if part == '':
+            continue
+        if '-' in part:
+            lo, hi = part.split('-')
+            ret.extend(range(int(lo), int(hi) + 1))
+        else:
+            ret.append(int(part))
+    return ret
+
+
+def configure_cpu(intra_threads=0, inter_threads=0, cv_threads=-1, cpu_affinity=''):
+    """Thread pools of torch / OpenCV and the CPU affinity of this process. 0 / -1 / '' keep the defaults"""
+    if cpu_affinity != '' and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, parse_cpu_list(cpu_affinity))
+    if intra_threads > 0:
+        torch.set_num_threads(intra_threads)
+    if inter_threads > 0:
+        try:
+            torch.set_num_interop_threads(inter_threads)
+        except RuntimeError:
+            # only possible before the first inter-op parallel work of the process
+            print('inter-op threads already set to {}'.format(torch.get_num_interop_threads()))
+    if cv_threads >= 0:
+        import cv2
+        cv2.setNumThreads(cv_threads)
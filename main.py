@@ -12,6 +12,7 @@ from lib.models.model import create_model, load_model, save_model
 from lib.utils.data_parallel import DataParallel
 from lib.logger import Logger
 from lib.datasets.dataset_factory import get_dataset
+from lib.datasets.sharded import ShardedDataset
 from lib.trains.ctdet_trainer import CtdetTrainer as Trainer
 from lib.utils.general import one_cycle, one_flat_cycle
 
@@ -43,7 +44,12 @@ def main(opt):
     if opt.load_model != '':
         model, optimizer, start_epoch = load_model(model, opt.load_model, optimizer, opt.resume, opt.lr, opt.lr_step)
 
-    trainer = Trainer(opt, model, optimizer, scheduler)
+    teacher = None
+    if opt.teacher_model != '':
+        print('Creating teacher...')
+        teacher = load_model(create_model(opt.teacher_arch, opt.heads, opt.head_conv), opt.teacher_model)
+
+    trainer = Trainer(opt, model, optimizer, scheduler, teacher)
     trainer.set_device(opt.gpus, opt.chunk_sizes, opt.device)
 
     print('Setting up data...')
@@ -60,10 +66,15 @@ def main(opt):
         val_loader.dataset.run_eval(preds, opt.save_dir)
         return
 
+    train_dataset = Dataset(opt, 'train')
+    if opt.shards != '':
+        # shard order and shuffle buffer replace the sampler
+        train_dataset = ShardedDataset(train_dataset, opt.shards, shuffle_buffer=opt.shard_shuffle_buffer,
+                                       read_size=int(opt.shard_read_size * 2 ** 20), seed=opt.seed)
     train_loader = torch.utils.data.DataLoader(
-        Dataset(opt, 'train'), 
+        train_dataset, 
         batch_size=opt.batch_size, 
-        shuffle=True,
+        shuffle=opt.shards == '',
         num_workers=opt.num_workers,
         pin_memory=True,
         drop_last=True
@@ -73,6 +84,8 @@ def main(opt):
     best = 1e10
     for epoch in range(start_epoch + 1, opt.num_epochs + 1):
         mark = epoch if opt.save_all else 'last'
+        if opt.shards != '':
+            train_dataset.set_epoch(epoch)
         log_dict_train, _ = trainer.train(epoch, train_loader, logger)
         logger.write('epoch: {} |'.format(epoch))
 
@@ -88,6 +101,9 @@ def main(opt):
             save_model(os.path.join(opt.save_dir, 'model_{}.pth'.format(mark)), epoch, model, optimizer)
             with torch.no_grad():
                 log_dict_val, preds = trainer.val(epoch, val_loader, logger)
+            if opt.val_map:
+                stats = val_loader.dataset.run_eval(preds, opt.save_dir)
+                log_dict_val['mAP'], log_dict_val['AP50'] = stats[0], stats[1]
             for k, v in log_dict_val.items():
                 logger.scalar_summary('val_{}'.format(k), v, epoch)
                 logger.write('{} {:8f} | '.format(k, v))
@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Local inference server. The model is loaded once and concurrent requests are coalesced into
+# dynamic batches (--max_batch / --max_wait).
+#   POST /detect   body: encoded image bytes (jpg/png) -> per-class detections of CtdetDetector.run
+#   GET  /metrics  queue depth, batch-size histogram, latency percentiles
+import json
+import os
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.detectors.ctdet_detector import CtdetDetector as Detector
+from lib.detectors.dynamic_batcher import DynamicBatcher
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    batcher = None
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # unix socket clients have no (host, port) address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.batcher.metrics())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/detect':
+            self._send_json(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        data = np.frombuffer(self.rfile.read(length), dtype=np.uint8)
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR) if length > 0 else None
+        if image is None:
+            self._send_json(400, {'error': 'could not decode image'})
+            return
+        try:
+            results = self.batcher.submit(image)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'results': {str(j): results[j].tolist() for j in results}})
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    os.environ['CUDA_VISIBLE_DEVICES'] = opt.gpus_str
+    detector = Detector(opt)
+
+    batcher = DynamicBatcher(detector, max_batch=opt.max_batch, max_wait=opt.max_wait / 1000.)
+    InferenceHandler.batcher = batcher
+    batcher.start()
+
+    if opt.unix_socket != '':
+        if os.path.exists(opt.unix_socket):
+            os.remove(opt.unix_socket)
+        server = ThreadingUnixHTTPServer(opt.unix_socket, InferenceHandler)
+        print('Serving on unix socket {}'.format(opt.unix_socket))
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', opt.port), InferenceHandler)
+        print('Serving on http://127.0.0.1:{}'.format(opt.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+        if opt.unix_socket != '' and os.path.exists(opt.unix_socket):
+            os.remove(opt.unix_socket)
+
+
+if __name__ == '__main__':
+    opt = opts().parse()
+    serve(opt)
@@ -5,11 +5,10 @@ from __future__ import print_function
 # import _init_paths
 import os
 import sys
+import time
 current_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(current_path, '..'))
 
-import cv2
-import numpy as np
 from progress.bar import Bar
 import torch
 
@@ -17,34 +16,26 @@ from lib.opts import opts
 from lib.logger import Logger
 from lib.utils.utils import AverageMeter
 from lib.datasets.dataset_factory import dataset_factory
-from lib.detectors.ctdet_detector import CtdetDetector as Detector
-
-class PrefetchDataset(torch.utils.data.Dataset):
-    def __init__(self, opt, dataset, pre_process_func):
-        self.images = dataset.images
-        self.load_image_func = dataset.coco.loadImgs
-        self.sharp_img_dir = dataset.sharp_img_dir
-        self.blur_img_dir = dataset.blur_img_dir
-        if opt.inp_sharp_or_blur == 'sharp':
-            self.img_dir = self.sharp_img_dir
-        elif opt.inp_sharp_or_blur == 'blur' or opt.inp_sharp_or_blur == 'SB_deblur':
-            self.img_dir = self.blur_img_dir
+from lib.detectors.detector_factory import detector_factory
+from lib.detectors.inference_pool import InferencePool, time_stats as pool_time_stats
+from lib.datasets.prefetch import PrefetchDataset, ShmPrefetcher, use_shm_prefetch
+from lib.utils.coco_stream import ResultsWriter
 
-        self.pre_process_func = pre_process_func
-        self.opt = opt
-    
-    def __getitem__(self, index):
-        img_id = self.images[index]
-        img_info = self.load_image_func(ids=[img_id])[0]
-        img_path = os.path.join(self.img_dir, img_info['file_name'])
-        image = cv2.imread(img_path)
-        images, meta = {}, {}
-        for scale in opt.test_scales:
-            images[scale], meta[scale] = self.pre_process_func(image, scale)
-        return img_id, {'images': images, 'image': image, 'meta': meta}
 
-    def __len__(self):
-        return len(self.images)
+def make_results(opt):
+    # detections by image id, streamed to disk with --stream_results
+    if opt.stream_results:
+        return ResultsWriter(os.path.join(opt.save_dir, 'results.bin'))
+    return {}
+
+
+def run_eval(opt, dataset, results):
+    if opt.stream_results:
+        results.close()
+        print('{} detections of {} images streamed to {}'.format(results.num_dets, results.num_images, results.path))
+        dataset.run_eval_stream(results.path, opt.save_dir)
+    else:
+        dataset.run_eval(results, opt.save_dir)
 
 
 def prefetch_test(opt):
@@ -57,20 +48,23 @@ def prefetch_test(opt):
     
     split = 'val' if not opt.trainval else 'test-dev'
     dataset = Dataset(opt, split)
-    detector = Detector(opt)
+    detector = detector_factory[opt.detector](opt)
     
-    data_loader = torch.utils.data.DataLoader(
-        PrefetchDataset(opt, dataset, detector.pre_process), 
-        batch_size=1, shuffle=False, num_workers=1, pin_memory=True)
+    if use_shm_prefetch(opt):
+        data_loader = ShmPrefetcher(opt, dataset, detector)
+    else:
+        data_loader = torch.utils.data.DataLoader(
+            PrefetchDataset(opt, dataset, detector.pre_process), 
+            batch_size=1, shuffle=False, num_workers=opt.prefetch_workers, pin_memory=True)
 
-    results = {}
+    results = make_results(opt)
     num_iters = len(dataset)
     bar = Bar('{}'.format(opt.exp_id), max=num_iters)
     time_stats = ['tot', 'load', 'pre', 'net', 'dec', 'post', 'merge']
     avg_time_stats = {t: AverageMeter() for t in time_stats}
     for ind, (img_id, pre_processed_images) in enumerate(data_loader):
         ret = detector.run(pre_processed_images)
-        results[img_id.numpy().astype(np.int32)[0]] = ret['results']
+        results[int(img_id)] = ret['results']
         Bar.suffix = '[{0}/{1}]|Tot: {total:} |ETA: {eta:} '.format(
                         ind, num_iters, total=bar.elapsed_td, eta=bar.eta_td)
         for t in avg_time_stats:
@@ -79,7 +73,13 @@ def prefetch_test(opt):
                 t, tm = avg_time_stats[t])
         bar.next()
     bar.finish()
-    dataset.run_eval(results, opt.save_dir)
+    if hasattr(detector, 'summary'):
+        print(detector.summary())
+    if detector.result_cache is not None:
+        print(detector.result_cache.summary())
+    if hasattr(data_loader, 'summary'):
+        print(data_loader.summary())
+    run_eval(opt, dataset, results)
 
 
 def test(opt):
@@ -92,9 +92,9 @@ def test(opt):
     
     split = 'val' if not opt.trainval else 'test'
     dataset = Dataset(opt, split)
-    detector = Detector(opt)
+    detector = detector_factory[opt.detector](opt)
 
-    results = {}
+    results = make_results(opt)
     num_iters = len(dataset)
     bar = Bar('{}'.format(opt.exp_id), max=num_iters)
     time_stats = ['tot', 'load', 'pre', 'net', 'dec', 'post', 'merge']
@@ -118,12 +118,56 @@ def test(opt):
             Bar.suffix = Bar.suffix + '|{} {:.3f} '.format(t, avg_time_stats[t].avg)
         bar.next()
     bar.finish()
-    dataset.run_eval(results, opt.save_dir)
+    if hasattr(detector, 'summary'):
+        print(detector.summary())
+    if detector.result_cache is not None:
+        print(detector.result_cache.summary())
+    run_eval(opt, dataset, results)
+
+
+def pool_test(opt):
+    os.environ['CUDA_VISIBLE_DEVICES'] = opt.gpus_str
+
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    print(opt)
+    Logger(opt)
+
+    split = 'val' if not opt.trainval else 'test'
+    dataset = Dataset(opt, split)
+    detector = detector_factory[opt.detector](opt)
+    pool = InferencePool(detector, opt.num_procs, opt.intra_threads)
+
+    img_dir = dataset.sharp_img_dir if opt.inp_sharp_or_blur == 'sharp' else dataset.blur_img_dir
+    items = [(img_id, os.path.join(img_dir, dataset.coco.loadImgs(ids=[img_id])[0]['file_name']))
+             for img_id in dataset.images]
+
+    results = make_results(opt)
+    num_iters = len(items)
+    bar = Bar('{}'.format(opt.exp_id), max=num_iters)
+    avg_time_stats = {t: AverageMeter() for t in pool_time_stats}
+    start_time = time.time()
+    for ind, (img_id, dets, times) in enumerate(pool.run(items)):
+        results[img_id] = dets
+        Bar.suffix = '[{0}/{1}]|Tot: {total:} |ETA: {eta:} '.format(
+                        ind, num_iters, total=bar.elapsed_td, eta=bar.eta_td)
+        for t in avg_time_stats:
+            avg_time_stats[t].update(times[t])
+            Bar.suffix = Bar.suffix + '|{} {:.3f} '.format(t, avg_time_stats[t].avg)
+        bar.next()
+    bar.finish()
+    print('{:.2f} images/s'.format(num_iters / (time.time() - start_time)))
+    print(pool.summary())
+    run_eval(opt, dataset, results)
 
 
 if __name__ == '__main__':
     opt = opts().parse()
-    if opt.not_prefetch_test:
+    if opt.num_procs > 1:
+        pool_test(opt)
+        print('pool_test')
+    elif opt.not_prefetch_test or opt.detector == 'adaptive':
+        # the adaptive detector changes its pre-processing between frames, prefetch workers would not follow
         test(opt)
         print('test')
     else:
@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Sweeps (instances x intra-op threads x batch) of CPU inference on synthetic frames. Every instance is a
+# separate process pinned to its own cpus; prints the throughput-optimal and latency-optimal configurations.
+# python tools/autotune_cpu.py --gpus -1 --arch DREB_Net --inp_sharp_or_blur SB_deblur --input_res 1024 \
+#     --load_model ./exp/detect/train/train_DREB_Net_model/model_last.pth --instances 1,2,4,8 --threads 1,2,4,8,16 --batches 1,4
+import copy
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import numpy as np
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+
+
+def worker(opt, cpus, threads, batch, barrier, queue):
+    from lib.detectors.ctdet_detector import CtdetDetector as Detector
+    opt.intra_threads, opt.inter_threads, opt.cv_threads = threads, 1, 1
+    opt.cpu_affinity = ','.join(str(c) for c in cpus)
+    detector = Detector(opt)
+    rng = np.random.RandomState(cpus[0])
+    images = [rng.randint(0, 256, (opt.frame_h, opt.frame_w, 3), dtype=np.uint8) for _ in range(batch)]
+    detector.run_batch(images)  # warm up
+
+    barrier.wait()
+    latencies = []
+    start_time = time.time()
+    for _ in range(max(opt.frames // batch, 1)):
+        batch_start_time = time.time()
+        detector.run_batch(images)
+        latencies.append(time.time() - batch_start_time)
+    queue.put((len(latencies) * batch, time.time() - start_time, latencies))
+
+
+def run_config(opt, cpus, instances, threads, batch):
+    ctx = mp.get_context('spawn')
+    barrier, queue = ctx.Barrier(instances), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(opt, cpus[i * threads:(i + 1) * threads], threads, batch, barrier, queue))
+             for i in range(instances)]
+    for p in procs:
+        p.start()
+    results = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+    frames = sum(r[0] for r in results)
+    elapsed = max(r[1] for r in results)
+    latencies = np.concatenate([r[2] for r in results])
+    return {'instances': instances, 'threads': threads, 'batch': batch,
+            'throughput': frames / elapsed,
+            'p50': float(np.percentile(latencies, 50)), 'p99': float(np.percentile(latencies, 99))}
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    opt.gpus = [-1]
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    print('{} cpus: {}'.format(len(cpus), cpus))
+
+    results = []
+    print('{:>9} | {:>7} | {:>5} | {:>10} | {:>8} | {:>8}'.format('instances', 'threads', 'batch', 'frames/s', 'p50(s)', 'p99(s)'))
+    for instances in [int(i) for i in opt.instances.split(',')]:
+        for threads in [int(t) for t in opt.threads.split(',')]:
+            if instances * threads > len(cpus):
+                continue
+            for batch in [int(b) for b in opt.batches.split(',')]:
+                r = run_config(copy.deepcopy(opt), cpus, instances, threads, batch)
+                results.append(r)
+                print('{instances:>9d} | {threads:>7d} | {batch:>5d} | {throughput:>10.2f} | '
+                      '{p50:>8.3f} | {p99:>8.3f}'.format(**r))
+    if len(results) == 0:
+        print('no configuration fits in {} cpus'.format(len(cpus)))
+        return
+
+    best_throughput = max(results, key=lambda r: r['throughput'])
+    best_latency = min(results, key=lambda r: (r['p50'], -r['throughput']))
+    for name, r in [('throughput-optimal', best_throughput), ('latency-optimal', best_latency)]:
+        print('{}: {} instance(s) x {} thread(s), batch {} -> {:.2f} frames/s, p50 {:.3f}s'.format(
+            name, r['instances'], r['threads'], r['batch'], r['throughput'], r['p50']))
+        for i in range(r['instances']):
+            # the exact cpus, the allowed set need not be contiguous
+            print('    instance {}: --intra_threads {} --inter_threads 1 --cv_threads 1 --cpu_affinity {} --max_batch {}'.format(
+                i, r['threads'], ','.join(map(str, cpus[i * r['threads']:(i + 1) * r['threads']])), r['batch']))
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--instances', default='1,2,4', help='detector processes to try.')
+    parser.parser.add_argument('--threads', default='1,2,4,8', help='intra-op threads per process to try.')
+    parser.parser.add_argument('--batches', default='1,4', help='frames per run_batch call to try.')
+    parser.parser.add_argument('--frames', type=int, default=32, help='frames timed per process and configuration.')
+    parser.parser.add_argument('--frame_h', type=int, default=1500)
+    parser.parser.add_argument('--frame_w', type=int, default=2000)
+    main(parser.parse())
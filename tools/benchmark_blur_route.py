@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Blur router vs. a single SB_deblur model on a mixed sharp/blurred VisDrone val set.
+# python tools/benchmark_blur_route.py --arch DREB_Net --inp_sharp_or_blur SB_deblur --input_res 1024 \
+#     --sharp_data_dir $SHARP_DATA_DIR --blur_data_dir $BLUR_DATA_DIR --load_model $SB_DEBLUR_MODEL \
+#     --route_sharp_arch DREB_Net_tiny --route_sharp_model $SHARP_TINY_MODEL --blur_ratio 0.3
+import os
+import sys
+import time
+
+import numpy as np
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from progress.bar import Bar
+
+from lib.opts import opts
+from lib.logger import Logger
+from lib.datasets.dataset_factory import dataset_factory
+from lib.detectors.ctdet_detector import CtdetDetector
+from lib.detectors.blur_route_detector import BlurRouteDetector
+
+
+def main(opt):
+    os.environ['CUDA_VISIBLE_DEVICES'] = opt.gpus_str
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    opt.inp_sharp_or_blur = 'SB_deblur'
+    Logger(opt)
+    dataset = Dataset(opt, 'val')
+    detector = BlurRouteDetector(opt)
+    num_iters = len(dataset) if opt.num_images < 0 else min(opt.num_images, len(dataset))
+
+    # the sharp and blurred trees share file names and annotations
+    rng = np.random.RandomState(opt.seed)
+    is_blurred = rng.rand(num_iters) < opt.blur_ratio
+    img_paths = []
+    for ind in range(num_iters):
+        file_name = dataset.coco.loadImgs(ids=[dataset.images[ind]])[0]['file_name']
+        img_dir = dataset.blur_img_dir if is_blurred[ind] else dataset.sharp_img_dir
+        img_paths.append(os.path.join(img_dir, file_name))
+
+    # a plain detector for the baseline: CtdetDetector.run on the router would still route through its
+    # pre_process / process overrides
+    baseline = CtdetDetector(opt)
+    modes = [('SB_deblur only', baseline.run),
+             ('blur route', detector.run)]
+    report = {}
+    for name, run in modes:
+        results = {}
+        bar = Bar(name, max=num_iters)
+        start_time = time.time()
+        for ind in range(num_iters):
+            ret = run(detector.load_image(img_paths[ind]))
+            results[dataset.images[ind]] = ret['results']
+            bar.next()
+        bar.finish()
+        report[name] = num_iters / (time.time() - start_time)
+        save_dir = os.path.join(opt.save_dir, name.replace(' ', '_'))
+        os.makedirs(save_dir, exist_ok=True)
+        dataset.run_eval(results, save_dir)
+    scores = np.array(detector.scores)
+
+    print('{} frames, {:.0f}% blurred'.format(num_iters, 100 * is_blurred.mean()))
+    print(detector.summary())
+    for subset, mask in (('sharp', ~is_blurred), ('blurred', is_blurred)):
+        if mask.any():
+            print('{:>8} frames {} p5 {:.3f} p50 {:.3f} p95 {:.3f}'.format(
+                subset, opt.blur_measure, *np.percentile(scores[mask], [5, 50, 95])))
+    for name, throughput in report.items():
+        print('{:>15} | {:.2f} frames/s'.format(name, throughput))
+    print('mAP of each mode is written to {}/<mode>/result.txt'.format(opt.save_dir))
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--num_images', type=int, default=-1, help='-1 for the whole val split.')
+    parser.parser.add_argument('--blur_ratio', type=float, default=0.3, help='fraction of frames taken from the blurred tree.')
+    main(parser.parse())
@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Whole-frame vs. tiled vs. coarse-to-fine inference on the VisDrone val set: latency, skipped pixels and mAP.
+# python tools/benchmark_coarse_to_fine.py --arch DREB_Net --inp_sharp_or_blur SB_deblur --input_res 1024 \
+#     --sharp_data_dir $SHARP_DATA_DIR --blur_data_dir $BLUR_DATA_DIR --load_model $MODEL \
+#     --tile_size 1024 --coarse_arch DREB_Net_tiny --coarse_model $TINY_MODEL --coarse_thresh 0.1
+import os
+import sys
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from progress.bar import Bar
+
+from lib.opts import opts
+from lib.logger import Logger
+from lib.datasets.dataset_factory import dataset_factory
+from lib.detectors.ctdet_detector import CtdetDetector
+from lib.detectors.coarse_to_fine_detector import CoarseToFineDetector
+from lib.utils.utils import AverageMeter
+
+
+def with_tile_size(detector, tile_size, run):
+    # CtdetDetector.run tiles whenever opt.tile_size > 0 and run_tiled reads it, so each mode sets its own
+    def run_with_tile_size(image):
+        saved = detector.opt.tile_size
+        detector.opt.tile_size = tile_size
+        try:
+            return run(image)
+        finally:
+            detector.opt.tile_size = saved
+    return run_with_tile_size
+
+
+def main(opt):
+    os.environ['CUDA_VISIBLE_DEVICES'] = opt.gpus_str
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    Logger(opt)
+    dataset = Dataset(opt, 'val')
+    detector = CoarseToFineDetector(opt)
+    img_dir = dataset.sharp_img_dir if opt.inp_sharp_or_blur == 'sharp' else dataset.blur_img_dir
+    num_iters = len(dataset) if opt.num_images < 0 else min(opt.num_images, len(dataset))
+
+    modes = [('whole', with_tile_size(detector, 0, lambda image: CtdetDetector.run(detector, image))),
+             ('tiled', with_tile_size(detector, detector.tile_size, detector.run_tiled)),
+             ('coarse_to_fine', detector.run)]
+    report = {}
+    for name, run in modes:
+        results = {}
+        tot, skipped = AverageMeter(), AverageMeter()
+        bar = Bar(name, max=num_iters)
+        for ind in range(num_iters):
+            img_id = dataset.images[ind]
+            img_info = dataset.coco.loadImgs(ids=[img_id])[0]
+            image = detector.load_image(os.path.join(img_dir, img_info['file_name']))
+            ret = run(image)
+            results[img_id] = ret['results']
+            tot.update(ret['tot'])
+            skipped.update(ret.get('skipped_fraction', 0.))
+            bar.next()
+        bar.finish()
+        save_dir = os.path.join(opt.save_dir, name)
+        os.makedirs(save_dir, exist_ok=True)
+        dataset.run_eval(results, save_dir)
+        report[name] = (tot.avg, skipped.avg)
+
+    print('{:>15} | {:>9} | {:>9} | {:>15}'.format('mode', 'tot(s)', 'speedup', 'skipped pixels'))
+    for name, (tot, skipped) in report.items():
+        print('{:>15} | {:>9.3f} | {:>8.2f}x | {:>14.1f}%'.format(
+            name, tot, report['tiled'][0] / tot, 100 * skipped))
+    print('mAP of each mode is written to {}/<mode>/result.txt'.format(opt.save_dir))
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--num_images', type=int, default=-1, help='-1 for the whole val split.')
+    main(parser.parse())
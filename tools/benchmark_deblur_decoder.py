@@ -0,0 +1,138 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Standard vs light (--deblur_decoder) deblur decoder: params and multiply-adds of the decoder, training step time
+# (forward in 'train' mode, --deblur_loss + a detection proxy loss, backward, SGD step) at --input_res / --batch_size,
+# and with trained checkpoints the PSNR / SSIM of the restored blurred frames of the val split against their sharp
+# frames (--deblur_images pairs, 0 for all).
+# python tools/benchmark_deblur_decoder.py --dataset VisDrone2019DET --arch DREB_Net --inp_sharp_or_blur SB_deblur \
+#     --input_res 1024 --batch_size 4 --load_model ./exp/detect/train/train_DREB_Net_model/model_best.pth \
+#     --light_model ./exp/detect/train/train_DREB_Net_light_model/model_best.pth
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from pytorch_msssim import ssim
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.detectors.detector_factory import detector_factory
+from lib.models.model import create_model, load_model
+from lib.models.losses import mse_loss, ssim_loss, Stripformer_Loss
+from lib.models.deploy import prepare_model
+
+_decoder_modules = ('deblur_up1', 'deblur_up2', 'deblur_up3', 'deblur_up4', 'deblur_up5')
+
+
+def decoder_macs(model, x):
+    # multiply-adds of the deblur_up blocks of one forward at the input size of x
+    macs = [0]
+    def hook(m, i, o):
+        if isinstance(m, nn.Conv2d):
+            macs[0] += o.numel() * m.in_channels // m.groups * m.kernel_size[0] * m.kernel_size[1]
+        elif isinstance(m, nn.ConvTranspose2d):
+            macs[0] += i[0].numel() * m.out_channels // m.groups * m.kernel_size[0] * m.kernel_size[1]
+    hooks = [m.register_forward_hook(hook) for name in _decoder_modules for m in getattr(model, name).modules()]
+    with torch.no_grad():
+        model(x, 'deblur')
+    for h in hooks:
+        h.remove()
+    return macs[0]
+
+
+def train_step_time(opt, model):
+    # detection losses need ground truth, the mean of every head output stands in for them: the backward
+    # still runs through the whole network, the deblur loss is the configured one
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-5)
+    deblur_criterion = Stripformer_Loss() if opt.deblur_loss == 'Stripformer' else None
+    blur = torch.rand(opt.batch_size, 3, opt.input_res, opt.input_res).to(opt.device)
+    sharp = torch.rand(opt.batch_size, 3, opt.input_res, opt.input_res).to(opt.device)
+
+    def step():
+        outputs, deblur_out = model(blur, 'train')
+        if deblur_criterion is not None:
+            deblur_loss = deblur_criterion(deblur_out, sharp, blur)
+        else:
+            deblur_loss = mse_loss(deblur_out, sharp) + ssim_loss(deblur_out, sharp)
+        loss = sum(o.mean() for o in outputs[-1].values()) + opt.deblur_weight * deblur_loss
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    step()  # warm up
+    if opt.device.type == 'cuda':
+        torch.cuda.synchronize()
+    start_time = time.time()
+    for _ in range(opt.reps):
+        step()
+    if opt.device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - start_time) / opt.reps
+
+
+def image_pairs(opt, dataset):
+    pairs = []
+    for img_id in dataset.images:
+        file_name = dataset.coco.loadImgs(ids=[img_id])[0]['file_name']
+        pairs.append((os.path.join(dataset.blur_img_dir, file_name), os.path.join(dataset.sharp_img_dir, file_name)))
+    return pairs if opt.deblur_images <= 0 else pairs[:opt.deblur_images]
+
+
+def restoration_quality(opt, detector, model, pairs):
+    detector.model = prepare_model(model.to(opt.device).eval(), [t for t in opt.deploy_transforms.split(',') if t != ''])
+    psnrs, ssims = [], []
+    for blur_path, sharp_path in pairs:
+        restored = detector.restore(cv2.imread(blur_path)).astype(np.float64)
+        sharp = cv2.imread(sharp_path).astype(np.float64)
+        mse = np.mean((restored - sharp) ** 2)
+        psnrs.append(10 * np.log10(255. ** 2 / max(mse, 1e-10)))
+        to_tensor = lambda img: torch.from_numpy(img).permute(2, 0, 1).unsqueeze(0).float()
+        ssims.append(float(ssim(to_tensor(restored), to_tensor(sharp), data_range=255, size_average=True)))
+    return float(np.mean(psnrs)), float(np.mean(ssims))
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    base = opt.arch[:-len('_light')] if opt.arch.endswith('_light') else opt.arch
+    variants = [('standard', base, opt.load_model), ('light', base + '_light', opt.light_model)]
+
+    rows = []
+    for decoder, arch, model_path in variants:
+        model = create_model(arch, opt.heads, opt.head_conv).to(opt.device)
+        row = {'decoder': decoder, 'arch': arch,
+               'params': sum(p.numel() for name in _decoder_modules for p in getattr(model, name).parameters()),
+               'macs': decoder_macs(model, torch.randn(1, 3, opt.input_res, opt.input_res).to(opt.device)),
+               'step': train_step_time(opt, model)}
+        if model_path != '':
+            dataset = Dataset(opt, 'val')
+            detector = detector_factory[opt.detector](opt)
+            model = load_model(create_model(arch, opt.heads, opt.head_conv), model_path)
+            row['psnr'], row['ssim'] = restoration_quality(opt, detector, model, image_pairs(opt, dataset))
+        rows.append(row)
+        print(row)
+
+    print('input {0}x{0}, batch {1}, deblur loss {2}'.format(opt.input_res, opt.batch_size, opt.deblur_loss))
+    print('{:>8} | {:>18} | {:>13} | {:>12} | {:>6} | {:>6}'.format(
+        'decoder', 'decoder params(M)', 'decoder GMACs', 'step(ms)', 'PSNR', 'SSIM'))
+    for r in rows:
+        print('{:>8} | {:>18.2f} | {:>13.1f} | {:>12.1f} | {:>6} | {:>6}'.format(
+            r['decoder'], r['params'] / 1e6, r['macs'] / 1e9, r['step'] * 1000,
+            '{:.2f}'.format(r['psnr']) if 'psnr' in r else '-', '{:.4f}'.format(r['ssim']) if 'ssim' in r else '-'))
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--light_model', default='', help='checkpoint trained with --deblur_decoder light.')
+    parser.parser.add_argument('--deblur_images', type=int, default=200, help='val blurred / sharp pairs scored, 0 for all.')
+    parser.parser.add_argument('--reps', type=int, default=5, help='timed training steps per decoder.')
+    main(parser.parse())
@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Checks the 'deconv' deploy transform (stride-2 ConvTranspose2d -> conv + pixel_shuffle) layer by layer at the
+# real feature sizes of --input_res: max abs difference and CPU time of every transposed conv and its rewrite,
+# then the difference of the detection heads and the restored image of the whole transformed model. Fails (assert)
+# when any difference exceeds 1e-4.
+# python tools/benchmark_deconv.py --gpus -1 --arch DREB_Net --input_res 1024 \
+#     --load_model ./exp/detect/train/train_DREB_Net_model/model_last.pth --reps 10
+import copy
+import os
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.models.model import create_model, load_model
+from lib.models.deploy import deconv_to_pixel_shuffle, prepare_model
+
+
+def timeit(module, x, reps):
+    module(x)  # warm up
+    start_time = time.time()
+    for _ in range(reps):
+        module(x)
+    return (time.time() - start_time) / reps
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    torch.set_num_threads(opt.intra_threads if opt.intra_threads > 0 else torch.get_num_threads())
+    model = create_model(opt.arch, opt.heads, opt.head_conv)
+    if opt.load_model != '':
+        model = load_model(model, opt.load_model)
+    model.eval()
+
+    # inputs of every transposed conv, detection path and deblur decoder
+    inputs = {}
+    def save_input(name):
+        def hook(m, i):
+            inputs[name] = i[0]
+        return hook
+    hooks = [m.register_forward_pre_hook(save_input(name))
+             for name, m in model.named_modules() if type(m) == nn.ConvTranspose2d]
+    x = torch.randn(1, 3, opt.input_res, opt.input_res)
+    with torch.no_grad():
+        ref, ref_deblur = model(x, mode='train')
+    for h in hooks:
+        h.remove()
+
+    print('{:<28} | {:>18} | {:>10} | {:>10} | {:>10} | {:>7}'.format(
+        'layer', 'input', 'max diff', 'deconv(ms)', 'shuffle(ms)', 'speedup'))
+    total = [0., 0.]
+    with torch.no_grad():
+        for name, m in model.named_modules():
+            if name not in inputs:
+                continue
+            rewrite = deconv_to_pixel_shuffle(m)
+            if rewrite is None:
+                print('{:<28} | not rewritten'.format(name))
+                continue
+            inp = inputs[name]
+            diff = (m(inp) - rewrite(inp)).abs().max().item()
+            assert diff < 1e-4, '{}: the pixel shuffle rewrite differs by {:.2e}'.format(name, diff)
+            t_deconv, t_shuffle = timeit(m, inp, opt.reps), timeit(rewrite, inp, opt.reps)
+            total[0] += t_deconv
+            total[1] += t_shuffle
+            print('{:<28} | {:>18} | {:>10.2e} | {:>10.2f} | {:>10.2f} | {:>6.2f}x'.format(
+                name, 'x'.join(str(s) for s in inp.shape[1:]), diff, t_deconv * 1000, t_shuffle * 1000, t_deconv / t_shuffle))
+    print('{:<28} | {:>18} | {:>10} | {:>10.2f} | {:>10.2f} | {:>6.2f}x'.format(
+        'total', '', '', total[0] * 1000, total[1] * 1000, total[0] / max(total[1], 1e-9)))
+
+    deployed = prepare_model(copy.deepcopy(model), ['deconv'])
+    with torch.no_grad():
+        out, out_deblur = deployed(x, mode='train')
+    diffs = [(head, (ref[0][head] - out[0][head]).abs().max().item()) for head in opt.heads]
+    diffs.append(('deblur', (ref_deblur - out_deblur).abs().max().item()))
+    for name, diff in diffs:
+        print('{:<8} max diff {:.2e}'.format(name, diff))
+    for name, diff in diffs:
+        assert diff < 1e-4, '{}: the deconv transformed model differs by {:.2e}'.format(name, diff)
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--reps', type=int, default=10, help='timed runs per layer.')
+    main(parser.parse())
@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Training input pipeline alone (no forward pass): samples/s of the train DataLoader reading the JPEGs vs the
+# decoded image store of --image_cache (tools/build_image_cache.py) and / or the packed shards of --shards
+# (tools/pack_shards.py), --num_batches batches after one warm up batch.
+# python tools/benchmark_loader.py --dataset visdrone --sharp_data_dir ../dataset/VisDrone \
+#     --blur_data_dir ../dataset/VisDrone_blur --image_cache ../dataset/VisDrone_cache \
+#     --shards ../dataset/VisDrone_shards --input_res 1024 --batch_size 8 --num_workers 20 --num_batches 50
+import copy
+import os
+import sys
+import time
+
+import torch
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import get_dataset
+from lib.datasets.sharded import ShardedDataset
+
+
+def samples_per_second(opt, Dataset, shards=False):
+    dataset = Dataset(opt, 'train')
+    if shards:
+        dataset = ShardedDataset(dataset, opt.shards, shuffle_buffer=opt.shard_shuffle_buffer,
+                                 read_size=int(opt.shard_read_size * 2 ** 20), seed=opt.seed)
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=opt.batch_size, shuffle=not shards, num_workers=opt.num_workers,
+        pin_memory=True, drop_last=True)
+    batches = iter(loader)
+    next(batches)  # warm up: worker start, first file opens
+    start_time = time.time()
+    for _ in range(opt.num_batches):
+        next(batches)
+    return opt.num_batches * opt.batch_size / (time.time() - start_time)
+
+
+def main(opt):
+    if opt.image_cache == '' and opt.shards == '':
+        raise ValueError('set --image_cache and / or --shards (tools/build_image_cache.py, tools/pack_shards.py)')
+    Dataset = get_dataset(opt.dataset, opt.task)
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    jpeg_opt = copy.deepcopy(opt)
+    jpeg_opt.image_cache = ''
+    jpeg = samples_per_second(jpeg_opt, Dataset)
+    print('input {0}x{0}, batch {1}, {2} workers'.format(opt.input_res, opt.batch_size, opt.num_workers))
+    print('jpeg   | {:.1f} samples/s'.format(jpeg))
+    if opt.image_cache != '':
+        cache = samples_per_second(opt, Dataset)
+        print('cache  | {:.1f} samples/s ({:.2f}x)'.format(cache, cache / jpeg))
+    if opt.shards != '':
+        shards = samples_per_second(jpeg_opt, Dataset, shards=True)
+        print('shards | {:.1f} samples/s ({:.2f}x)'.format(shards, shards / jpeg))
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--num_batches', type=int, default=50, help='timed batches per loader.')
+    main(parser.parse())
@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Compares the MAGFF block of --arch with its 'magff' deploy transform (FusedMAGFF) at the stride-8 feature size of
+# --input_res: max abs difference, CPU time, full-size map allocations and peak live intermediate memory of one forward.
+# Fails (assert) when the difference exceeds 1e-4.
+# python tools/benchmark_magff.py --gpus -1 --arch DREB_Net --input_res 1024 \
+#     --load_model ./exp/detect/train/train_DREB_Net_model/model_last.pth --reps 20
+import os
+import sys
+import time
+import weakref
+
+import torch
+import torch.nn as nn
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.models.model import create_model, load_model
+from lib.models.deploy import FusedMAGFF
+
+
+class AllocationCounter(TorchDispatchMode):
+    '''Counts the op outputs of at least `size` bytes that own new storage, and the peak of their live total'''
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+        self.count = 0
+        self.live = 0
+        self.peak = 0
+
+    def _free(self, nbytes):
+        self.live -= nbytes
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        inputs = {a.untyped_storage().data_ptr() for a in tree_flatten((args, kwargs))[0] if isinstance(a, torch.Tensor)}
+        for t in tree_flatten(out)[0]:
+            if not isinstance(t, torch.Tensor) or t.untyped_storage().data_ptr() in inputs:
+                continue
+            nbytes = t.untyped_storage().nbytes()
+            if nbytes >= self.size:
+                self.count += 1
+            self.live += nbytes
+            self.peak = max(self.peak, self.live)
+            weakref.finalize(t, self._free, nbytes)
+        return out
+
+
+def allocations(module, x1, x2):
+    counter = AllocationCounter(x1.numel() * x1.element_size())
+    with counter:
+        out = module(x1, x2)
+    del out
+    return counter.count, counter.peak / 2 ** 20
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    model = create_model(opt.arch, opt.heads, opt.head_conv)
+    if opt.load_model != '':
+        model = load_model(model, opt.load_model)
+    magff = model.MAGFF_attention.eval()
+    if opt.load_model == '':
+        # non-trivial BatchNorm statistics, so that the folding is exercised
+        for m in magff.modules():
+            if isinstance(m, nn.BatchNorm2d):
+                m.running_mean.normal_(0, 0.1)
+                m.running_var.uniform_(0.5, 2)
+                m.weight.data.uniform_(0.5, 1.5)
+                m.bias.data.normal_(0, 0.1)
+    fused = FusedMAGFF(magff).eval()
+
+    channels = magff.local_attention[0].in_channels
+    x1 = torch.randn(1, channels, opt.input_res // 8, opt.input_res // 8)
+    x2 = torch.randn(1, channels, opt.input_res // 8, opt.input_res // 8)
+    print('MAGFF input 2 x {} ({:.1f}MB each)'.format('x'.join(str(s) for s in x1.shape[1:]),
+                                                      x1.numel() * x1.element_size() / 2 ** 20))
+    with torch.no_grad():
+        diff = (magff(x1, x2) - fused(x1, x2)).abs().max().item()
+        print('max diff {:.2e}'.format(diff))
+        assert diff < 1e-4, 'FusedMAGFF differs from MAGFF by {:.2e}'.format(diff)
+        print('{:<10} | {:>8} | {:>16} | {:>13}'.format('', 'time(ms)', 'full-size allocs', 'peak live(MB)'))
+        for name, module in [('MAGFF', magff), ('FusedMAGFF', fused)]:
+            module(x1, x2)
+            start_time = time.time()
+            for _ in range(opt.reps):
+                module(x1, x2)
+            elapsed = (time.time() - start_time) / opt.reps
+            print('{:<10} | {:>8.2f} | {:>16d} | {:>13.1f}'.format(name, elapsed * 1000, *allocations(module, x1, x2)))
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--reps', type=int, default=20, help='timed forwards of each block.')
+    main(parser.parse())
@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Eager vs planned (--memory_plan) CPU inference of --arch at --input_res: per steady-state frame, the op output
+# allocations (all, and of at least --alloc_size MB), their peak live total, the latency, and the peak RSS over
+# --frames frames after the warm up, every mode in a fresh process. Also checks that the planned outputs match the eager ones.
+# python tools/benchmark_memory_plan.py --gpus -1 --arch DREB_Net --input_res 1024 \
+#     --deploy_transforms repvgg,conv_bn,deconv,magff --load_model ./exp/detect/train/train_DREB_Net_model/model_last.pth
+import json
+import os
+import subprocess
+import sys
+import time
+
+import torch
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.models.deploy import build_model
+from lib.models.memory_plan import PlannedModel
+from lib.utils.utils import reset_peak_memory, peak_memory
+from benchmark_magff import AllocationCounter
+
+
+def probe(opt):
+    # runs in a fresh process: --probe eager | planned
+    device = torch.device('cpu')
+    if opt.intra_threads > 0:
+        torch.set_num_threads(opt.intra_threads)
+    transforms = [t for t in opt.deploy_transforms.split(',') if t != '']
+    model = build_model(opt.arch, opt.heads, opt.head_conv, opt.load_model, transforms).eval()
+    if opt.probe == 'planned':
+        model = PlannedModel(model)
+    torch.manual_seed(0)
+    frames = [torch.randn(1, 3, opt.input_res, opt.input_res) for _ in range(2)]
+
+    with torch.no_grad():
+        model(frames[0])  # warm up, records the plan
+        # counted first: entering a dispatch mode imports torch._dynamo, the RSS of both modes includes it
+        counts = []
+        for size in [0, opt.alloc_size]:
+            counter = AllocationCounter(int(size * 2 ** 20))
+            with counter:
+                out = model(frames[1])[-1]
+            counts.append((counter.count, counter.peak / 2 ** 20))
+        reset_peak_memory(device)
+        start_time = time.time()
+        for i in range(opt.frames):
+            out = model(frames[i % 2])[-1]
+        latency = (time.time() - start_time) / opt.frames
+        rss = peak_memory(device)
+    ret = {'latency': latency, 'peak_rss': rss, 'allocations': counts[0][0], 'large_allocations': counts[1][0],
+           'peak_live': counts[0][1], 'outputs': {k: v.flatten()[:4096].tolist() for k, v in out.items()}}
+    if opt.probe == 'planned':
+        ret.update(model.plan.stats())
+    print('PROBE ' + json.dumps(ret))
+
+
+def measure(opt, mode):
+    cmd = [sys.executable, os.path.realpath(__file__), '--probe', mode, '--arch', opt.arch, '--dataset', opt.dataset,
+           '--input_res', str(opt.input_res), '--frames', str(opt.frames), '--alloc_size', str(opt.alloc_size),
+           '--intra_threads', str(opt.intra_threads)]
+    if opt.deploy_transforms != '':
+        cmd += ['--deploy_transforms', opt.deploy_transforms]
+    if opt.load_model != '':
+        cmd += ['--load_model', opt.load_model]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    return json.loads([line for line in out.splitlines() if line.startswith('PROBE ')][-1][len('PROBE '):])
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    if opt.probe != '':
+        probe(opt)
+        return
+
+    eager, planned = measure(opt, 'eager'), measure(opt, 'planned')
+    diff = max(max(abs(a - b) for a, b in zip(eager['outputs'][k], planned['outputs'][k])) for k in eager['outputs'])
+    print('input {0}x{0}, {1} frames, deploy transforms: {2}, max abs output difference {3:.3g}'.format(
+        opt.input_res, opt.frames, opt.deploy_transforms or 'none', diff))
+    print('planned: {} tensors in a {:.1f}MB arena ({:.1f}MB without sharing)'.format(
+        planned['tensors'], planned['arena'] / 2 ** 20, planned['unshared'] / 2 ** 20))
+    print('{:>8} | {:>11} | {:>13} | {:>16} | {:>13} | {:>12}'.format(
+        'mode', 'allocations', '>= {:g}MB'.format(opt.alloc_size), 'peak live(MB)', 'peak rss(MB)', 'latency(ms)'))
+    for mode, r in [('eager', eager), ('planned', planned)]:
+        print('{:>8} | {:>11} | {:>13} | {:>16.1f} | {:>13.0f} | {:>12.1f}'.format(
+            mode, r['allocations'], r['large_allocations'], r['peak_live'], r['peak_rss'], r['latency'] * 1000))
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--frames', type=int, default=20, help='timed frames per mode.')
+    parser.parser.add_argument('--alloc_size', type=float, default=1, help='MB from which an allocation counts as large.')
+    parser.parser.add_argument('--probe', default='', help='internal: eager | planned, measure that mode only.')
+    main(parser.parse())
@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Input pipeline of test.py alone (no forward pass): PrefetchDataset through a DataLoader vs the shared
+# memory ring prefetcher, both ending with the network input on --gpus.
+# python tools/benchmark_prefetch.py --arch DREB_Net --inp_sharp_or_blur SB_deblur --input_res 1024 \
+#     --prefetch_workers 2 --prefetch_depth 4 --num_images 200
+import os
+import sys
+import time
+
+import torch
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.detectors.ctdet_detector import CtdetDetector as Detector
+from lib.datasets.prefetch import PrefetchDataset, ShmPrefetcher
+
+
+class Subset(object):
+    # first num_images of the split, enough of the dataset interface for both prefetchers
+    def __init__(self, dataset, num_images):
+        self.images = dataset.images[:num_images]
+        self.coco = dataset.coco
+        self.sharp_img_dir = dataset.sharp_img_dir
+        self.blur_img_dir = dataset.blur_img_dir
+
+
+def run_pickle(opt, dataset, detector):
+    loader = torch.utils.data.DataLoader(
+        PrefetchDataset(opt, dataset, detector.pre_process),
+        batch_size=1, shuffle=False, num_workers=opt.prefetch_workers, pin_memory=True)
+    for _, pre_processed_images in loader:
+        for scale in opt.test_scales:
+            pre_processed_images['images'][scale][0].to(opt.device)
+    detector.synchronize()
+
+
+def run_shm(opt, dataset, detector):
+    loader = ShmPrefetcher(opt, dataset, detector)
+    for _, pre_processed_images in loader:
+        for scale in opt.test_scales:
+            detector.input_from_uint8(pre_processed_images['inputs'][scale])
+    detector.synchronize()
+    return loader.summary()
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    split = 'val' if not opt.trainval else 'test'
+    dataset = Subset(Dataset(opt, split), opt.num_images)
+    detector = Detector(opt)
+    num_images = len(dataset.images)
+
+    start_time = time.time()
+    run_pickle(opt, dataset, detector)
+    pickle_rate = num_images / (time.time() - start_time)
+    start_time = time.time()
+    summary = run_shm(opt, dataset, detector)
+    shm_rate = num_images / (time.time() - start_time)
+
+    print('pickle (DataLoader) | {:.2f} images/s'.format(pickle_rate))
+    print('shm ring            | {:.2f} images/s ({:.2f}x)'.format(shm_rate, shm_rate / pickle_rate))
+    print(summary)
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--num_images', type=int, default=200)
+    main(parser.parse())
@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Multi-stream scheduler benchmark with synthetic local drone feeds.
+# python tools/benchmark_streams.py --arch DREB_Net --inp_sharp_or_blur SB_deblur --input_res 1024 \
+#     --load_model ./exp/detect/train/train_DREB_Net_model/model_last.pth --num_streams 16 --stream_fps 10
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.detectors.ctdet_detector import CtdetDetector as Detector
+from lib.detectors.stream_scheduler import StreamScheduler
+
+
+class SyntheticSource(object):
+    def __init__(self, scheduler, stream_id, fps, height, width, seed=0):
+        self.scheduler = scheduler
+        self.stream_id = stream_id
+        self.period = 1. / fps
+        rng = np.random.RandomState(seed)
+        # a handful of pre-generated frames, cycled, so generation cost does not skew the numbers
+        self.frames = [rng.randint(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(4)]
+        self.running = False
+
+    def _loop(self):
+        ind = 0
+        next_time = time.time()
+        while self.running:
+            self.scheduler.submit(self.stream_id, self.frames[ind % len(self.frames)])
+            ind += 1
+            next_time += self.period
+            time.sleep(max(next_time - time.time(), 0))
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    detector = Detector(opt)
+    scheduler = StreamScheduler(detector, max_batch=opt.max_batch, max_wait=opt.max_wait / 1000.,
+                                max_queue=opt.stream_queue)
+
+    sources = []
+    for i in range(opt.num_streams):
+        scheduler.add_stream(i)
+        sources.append(SyntheticSource(scheduler, i, opt.stream_fps, opt.frame_h, opt.frame_w, seed=i))
+
+    scheduler.start()
+    for source in sources:
+        source.start()
+    time.sleep(opt.duration)
+    for source in sources:
+        source.stop()
+    scheduler.stop()
+
+    stats = scheduler.stats()
+    print('streams {} | frames {} | batches {} | avg batch {:.2f} | throughput {:.2f} frames/s'.format(
+        opt.num_streams, stats['frames'], stats['batches'], stats['avg_batch'], stats['throughput']))
+    for stream_id, s in stats['streams'].items():
+        print('stream {:3d} | submitted {:5d} | processed {:5d} | dropped {:5d} | results dropped {:5d} | '
+              'p50 {:.3f}s | p90 {:.3f}s | p99 {:.3f}s'.format(
+                  stream_id, s['submitted'], s['processed'], s['dropped'], s['results_dropped'],
+                  s['p50'], s['p90'], s['p99']))
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--num_streams', type=int, default=8)
+    parser.parser.add_argument('--stream_fps', type=float, default=10)
+    parser.parser.add_argument('--frame_h', type=int, default=1500)
+    parser.parser.add_argument('--frame_w', type=int, default=2000)
+    parser.parser.add_argument('--duration', type=float, default=30, help='seconds')
+    main(parser.parse())
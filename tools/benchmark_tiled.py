@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Latency / peak memory of tiled full-resolution inference vs. today's whole-frame path.
+# python tools/benchmark_tiled.py --arch DREB_Net --inp_sharp_or_blur SB_deblur --input_res 1024 \
+#     --load_model $MODEL --demo ./exp/test_images --tile_size 1024 --tile_overlap 0.2 --tile_batch 4
+import os
+import sys
+
+import cv2
+import numpy as np
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.detectors.ctdet_detector import CtdetDetector as Detector
+from lib.utils.utils import AverageMeter, reset_peak_memory, peak_memory
+from tools.get_file_list import get_file_list
+
+
+def bench(detector, images, tile_size, num_runs):
+    detector.opt.tile_size = tile_size
+    detector.run(images[0])     # warm up
+    reset_peak_memory(detector.opt.device)
+    tot, net = AverageMeter(), AverageMeter()
+    num_dets = AverageMeter()
+    for _ in range(num_runs):
+        for image in images:
+            ret = detector.run(image)
+            tot.update(ret['tot'])
+            net.update(ret['net'])
+            num_dets.update(sum(len(ret['results'][j]) for j in ret['results']))
+    return tot.avg, net.avg, peak_memory(detector.opt.device), num_dets.avg
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    os.environ['CUDA_VISIBLE_DEVICES'] = opt.gpus_str
+    tile_size = opt.tile_size if opt.tile_size > 0 else max(opt.input_h, opt.input_w)
+    opt.tile_size = 0
+    detector = Detector(opt)
+
+    if opt.demo != '':
+        image_names = get_file_list(opt.demo) if os.path.isdir(opt.demo) else [opt.demo]
+        images = [cv2.imread(name) for name in image_names[:opt.num_images]]
+    else:
+        rng = np.random.RandomState(0)
+        images = [rng.randint(0, 256, (opt.frame_h, opt.frame_w, 3), dtype=np.uint8) for _ in range(opt.num_images)]
+    h, w = images[0].shape[0:2]
+
+    print('frame {}x{} | tile {} | overlap {} | tile batch {}'.format(
+        w, h, tile_size, opt.tile_overlap, opt.tile_batch))
+    print('{:>12} | {:>9} | {:>9} | {:>12} | {:>6}'.format('mode', 'tot(s)', 'net(s)', 'peak mem(MB)', 'dets'))
+    for name, size in [('whole-frame', 0), ('tiled', tile_size)]:
+        tot, net, mem, dets = bench(detector, images, size, opt.num_runs)
+        print('{:>12} | {:>9.3f} | {:>9.3f} | {:>12.1f} | {:>6.1f}'.format(name, tot, net, mem, dets))
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--num_images', type=int, default=4)
+    parser.parser.add_argument('--num_runs', type=int, default=3)
+    parser.parser.add_argument('--frame_h', type=int, default=1500)
+    parser.parser.add_argument('--frame_w', type=int, default=2000)
+    main(parser.parse())
@@ -0,0 +1,128 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Builds a grid of DREB_Net width / depth / groups variants (arch strings, see --arch) and tabulates params,
+# multiply-adds, CPU latency and peak memory of detection at --input_res, every variant in a fresh process.
+# With --ap_file (json {arch: AP}, e.g. collected from the test runs of the trained variants) the AP is added
+# and the fastest variant reaching --min_ap is reported.
+# python tools/benchmark_variants.py --gpus -1 --input_res 1024 --deploy_transforms repvgg,conv_bn,deconv,magff \
+#     --variants DREB_Net,DREB_Net_w0.5,DREB_Net_d2-4-8-1,DREB_Net_w0.5_d2-4-8-1_g4 --table ./exp/variants.md
+import json
+import os
+import subprocess
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.models.model import create_model, _train_only_modules
+from lib.models.deploy import prepare_model
+from lib.utils.utils import reset_peak_memory, peak_memory
+
+
+def count_macs(model, x):
+    # multiply-adds of the convolutions / linear layers of one detection forward
+    macs = [0]
+    def hook(m, i, o):
+        if isinstance(m, nn.Conv2d):
+            macs[0] += o.numel() * m.in_channels // m.groups * m.kernel_size[0] * m.kernel_size[1]
+        elif isinstance(m, nn.ConvTranspose2d):
+            macs[0] += i[0].numel() * m.out_channels // m.groups * m.kernel_size[0] * m.kernel_size[1]
+        elif isinstance(m, nn.Linear):
+            macs[0] += o.numel() * m.in_features
+    hooks = [m.register_forward_hook(hook) for m in model.modules() if isinstance(m, (nn.Conv2d, nn.ConvTranspose2d, nn.Linear))]
+    with torch.no_grad():
+        model(x)
+    for h in hooks:
+        h.remove()
+    return macs[0]
+
+
+def probe(opt):
+    # runs in a fresh process: one variant, random weights
+    device = torch.device('cpu')
+    if opt.intra_threads > 0:
+        torch.set_num_threads(opt.intra_threads)
+    model = create_model(opt.arch, opt.heads, opt.head_conv).eval()
+    params = sum(p.numel() for p in model.parameters())
+    train_only = sum(p.numel() for name, p in model.named_parameters() if name.split('.')[0] in _train_only_modules)
+    x = torch.randn(1, 3, opt.input_res, opt.input_res)
+    macs = count_macs(model, x)
+    transforms = [t for t in opt.deploy_transforms.split(',') if t != '']
+    model = prepare_model(model, transforms)
+
+    reset_peak_memory(device)
+    with torch.no_grad():
+        model(x)  # warm up
+        start_time = time.time()
+        for _ in range(opt.reps):
+            model(x)
+    latency = (time.time() - start_time) / opt.reps
+    ret = {'params': params, 'inference_params': params - train_only, 'macs': macs,
+           'latency': latency, 'peak_rss': peak_memory(device)}
+    print('PROBE ' + json.dumps(ret))
+
+
+def measure(opt, arch):
+    cmd = [sys.executable, os.path.realpath(__file__), '--probe', '--arch', arch, '--dataset', opt.dataset,
+           '--input_res', str(opt.input_res), '--reps', str(opt.reps), '--intra_threads', str(opt.intra_threads)]
+    if opt.deploy_transforms != '':
+        cmd += ['--deploy_transforms', opt.deploy_transforms]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    return json.loads([line for line in out.splitlines() if line.startswith('PROBE ')][-1][len('PROBE '):])
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    if opt.probe:
+        probe(opt)
+        return
+
+    ap = {}
+    if opt.ap_file != '':
+        with open(opt.ap_file) as f:
+            ap = json.load(f)
+    lines = ['| arch | params(M) | inference params(M) | GMACs | latency(ms) | peak rss(MB) | AP |',
+             '|---|---:|---:|---:|---:|---:|---:|']
+    results = []
+    for arch in opt.variants.split(','):
+        r = measure(opt, arch)
+        r['arch'], r['ap'] = arch, ap.get(arch)
+        results.append(r)
+        lines.append('| {} | {:.2f} | {:.2f} | {:.1f} | {:.1f} | {:.0f} | {} |'.format(
+            arch, r['params'] / 1e6, r['inference_params'] / 1e6, r['macs'] / 1e9, r['latency'] * 1000,
+            r['peak_rss'], '{:.3f}'.format(r['ap']) if r['ap'] is not None else '-'))
+        print(lines[-1])
+
+    table = '\n'.join(['input {0}x{0}, {1} cpu threads, deploy transforms: {2}'.format(
+        opt.input_res, opt.intra_threads if opt.intra_threads > 0 else torch.get_num_threads(),
+        opt.deploy_transforms or 'none'), ''] + lines)
+    print(table)
+    qualified = [r for r in results if r['ap'] is not None and r['ap'] >= opt.min_ap]
+    if len(qualified) > 0:
+        best = min(qualified, key=lambda r: r['latency'])
+        print('fastest variant with AP >= {}: {} ({:.1f}ms, AP {:.3f})'.format(opt.min_ap, best['arch'], best['latency'] * 1000, best['ap']))
+    if opt.table != '':
+        with open(opt.table, 'w') as f:
+            f.write(table + '\n')
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--variants', default='DREB_Net,DREB_Net_w0.75,DREB_Net_w0.5,DREB_Net_d2-4-8-1,'
+                               'DREB_Net_w0.5_d2-4-8-1,DREB_Net_w0.5_d2-4-8-1_g4,DREB_Net_tiny',
+                               help='comma separated arch strings.')
+    parser.parser.add_argument('--reps', type=int, default=3, help='timed forwards per variant.')
+    parser.parser.add_argument('--ap_file', default='', help='json {arch: AP} of the trained variants.')
+    parser.parser.add_argument('--min_ap', type=float, default=0., help='accuracy bar used with --ap_file.')
+    parser.parser.add_argument('--table', default='', help='also write the markdown table to this file.')
+    parser.parser.add_argument('--probe', action='store_true', help='internal: measure --arch only.')
+    main(parser.parse())
@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Decodes the sharp and blurred images of --cache_splits once into the memory-mapped store read by the dataset
+# with --image_cache (lib/utils/image_cache.py). Pixels are stored raw: ~9MB per 2000x1500 frame and stream.
+# python tools/build_image_cache.py --dataset visdrone --sharp_data_dir ../dataset/VisDrone \
+#     --blur_data_dir ../dataset/VisDrone_blur --image_cache ../dataset/VisDrone_cache --cache_splits train,val
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import cv2
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.utils.image_cache import ImageCacheWriter
+
+
+def decode(task):
+    img_id, stream, path = task
+    img = cv2.imread(path)
+    if img is None:
+        raise IOError('cannot read {}'.format(path))
+    return img_id, stream, img
+
+
+def build(opt, Dataset, split):
+    dataset = Dataset(opt, split)
+    dirs = {'sharp': dataset.sharp_img_dir, 'blur': dataset.blur_img_dir}
+    tasks = []
+    for img_id in dataset.images:
+        file_name = dataset.coco.loadImgs(ids=[img_id])[0]['file_name']
+        for stream in ['sharp', 'blur']:
+            tasks.append((img_id, stream, os.path.join(dirs[stream], file_name)))
+
+    writer = ImageCacheWriter(opt.image_cache, split, dirs)
+    start_time = time.time()
+    with Pool(max(opt.num_workers, 1)) as pool:
+        for i, (img_id, stream, img) in enumerate(pool.imap(decode, tasks, chunksize=4)):
+            writer.add(img_id, stream, img)
+            if (i + 1) % 1000 == 0:
+                print('{} {}/{} images, {:.1f} images/s'.format(split, i + 1, len(tasks), (i + 1) / (time.time() - start_time)))
+    writer.close()
+    print('{}: {} images, {:.1f}GB in {}'.format(split, len(tasks), writer.offset / 2 ** 30, writer.data_path))
+
+
+def main(opt):
+    if opt.image_cache == '':
+        raise ValueError('set --image_cache to the output directory')
+    Dataset = dataset_factory[opt.dataset]
+    for split in opt.cache_splits.split(','):
+        build(opt, Dataset, split)
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--cache_splits', default='train,val', help='comma separated splits to decode.')
+    main(parser.parse())
@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Exports a training checkpoint (epoch / state_dict / optimizer pickle) to a slim inference checkpoint
+# that load_model maps zero-copy, then compares cold start time and memory of both formats.
+# python tools/export_inference_model.py --arch DREB_Net --load_model ./exp/detect/train/train_DREB_Net_model/model_last.pth \
+#     --slim_output ./exp/DREB_Net_slim.bin [--slim_half] [--slim_keep_deblur]
+# Without --slim_keep_deblur the deblur decoder is dropped: detection works, --demo_with_deblur / restore() do not.
+import json
+import os
+import subprocess
+import sys
+import time
+
+import torch
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.models.model import create_model, load_model, save_slim_model
+from lib.utils.utils import reset_peak_memory, peak_memory
+
+
+def memory_status():
+    status = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('VmRSS', 'RssAnon', 'RssFile')):
+                key, value = line.split(':')
+                status[key] = int(value.split()[0]) / 1024
+    return status
+
+
+def probe(opt):
+    # runs in a fresh process: cold start of one replica
+    device = torch.device('cpu')
+    start_time = time.time()
+    model = create_model(opt.arch, opt.heads, opt.head_conv)
+    created_time = time.time()
+    reset_peak_memory(device)
+    model = load_model(model, opt.probe)
+    model.eval()
+    loaded_time = time.time()
+    # fault every weight page in, as the first forward pass would
+    with torch.no_grad():
+        sum(float(v.float().sum()) for v in model.state_dict().values())
+    ret = {'create': created_time - start_time, 'load': loaded_time - created_time,
+           'peak_rss': peak_memory(device)}
+    ret.update(memory_status())
+    print('PROBE ' + json.dumps(ret))
+
+
+def measure(opt, path):
+    cmd = [sys.executable, os.path.realpath(__file__), '--arch', opt.arch, '--dataset', opt.dataset, '--probe', path]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    return json.loads([line for line in out.splitlines() if line.startswith('PROBE ')][-1][len('PROBE '):])
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    if opt.probe != '':
+        probe(opt)
+        return
+
+    checkpoint = torch.load(opt.load_model, map_location=lambda storage, loc: storage)
+    model = create_model(opt.arch, opt.heads, opt.head_conv)
+    model = load_model(model, opt.load_model)
+    save_slim_model(opt.slim_output, model, epoch=checkpoint.get('epoch', 0), half=opt.slim_half,
+                    keep_deblur=opt.slim_keep_deblur)
+    del checkpoint
+
+    print('{:>10} | {:>9} | {:>8} | {:>8} | {:>13} | {:>10} | {:>10}'.format(
+        'format', 'size(MB)', 'create', 'load', 'peak rss(MB)', 'anon(MB)', 'file(MB)'))
+    for name, path in [('training', opt.load_model), ('slim', opt.slim_output)]:
+        r = measure(opt, path)
+        print('{:>10} | {:>9.1f} | {:>7.3f}s | {:>7.3f}s | {:>13.1f} | {:>10.1f} | {:>10.1f}'.format(
+            name, os.path.getsize(path) / 2 ** 20, r['create'], r['load'], r['peak_rss'],
+            r.get('RssAnon', 0), r.get('RssFile', 0)))
+    print('file backed pages are shared between replicas mapping the same slim checkpoint.')
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--slim_output', default='', help='path of the exported slim checkpoint.')
+    parser.parser.add_argument('--slim_half', action='store_true', help='store floating point weights in fp16.')
+    parser.parser.add_argument('--slim_keep_deblur', action='store_true', help='keep the deblur decoder (restore / --demo_with_deblur).')
+    parser.parser.add_argument('--probe', default='', help='internal: cold start a model from this checkpoint and report time and memory.')
+    main(parser.parse())
@@ -0,0 +1,101 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Load generator for serve.py: sweeps client concurrency and prints throughput / latency.
+# python tools/load_generator.py --url http://127.0.0.1:8000 --image ./exp/test_images/0000001.jpg --concurrency 1,2,4,8,16
+import argparse
+import http.client
+import json
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+import cv2
+import numpy as np
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=600):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def get_connection(args):
+    if args.unix_socket != '':
+        return UnixHTTPConnection(args.unix_socket)
+    url = urlparse(args.url)
+    return http.client.HTTPConnection(url.hostname, url.port, timeout=600)
+
+
+def request(conn, method, path, body=None):
+    conn.request(method, path, body=body)
+    resp = conn.getresponse()
+    data = resp.read()
+    if resp.status != 200:
+        raise RuntimeError('{} {}: {}'.format(resp.status, path, data))
+    return json.loads(data.decode('utf-8'))
+
+
+def client(args, body, num_requests, latencies, lock):
+    conn = get_connection(args)
+    for _ in range(num_requests):
+        start_time = time.time()
+        request(conn, 'POST', '/detect', body)
+        with lock:
+            latencies.append(time.time() - start_time)
+    conn.close()
+
+
+def run_level(args, body, concurrency):
+    latencies, lock = [], threading.Lock()
+    threads = [threading.Thread(target=client, args=(args, body, args.requests_per_client, latencies, lock))
+               for _ in range(concurrency)]
+    start_time = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start_time
+    latencies = np.array(latencies)
+    return len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main(args):
+    if args.image != '':
+        image = cv2.imread(args.image)
+    else:
+        image = np.random.RandomState(0).randint(0, 256, (args.frame_h, args.frame_w, 3), dtype=np.uint8)
+    body = cv2.imencode('.jpg', image)[1].tobytes()
+
+    # warm up
+    request(get_connection(args), 'POST', '/detect', body)
+
+    print('{:>11} | {:>10} | {:>8} | {:>8} | {:>9}'.format('concurrency', 'req/s', 'p50(s)', 'p99(s)', 'avg batch'))
+    for concurrency in [int(c) for c in args.concurrency.split(',')]:
+        before = request(get_connection(args), 'GET', '/metrics')
+        throughput, p50, p99 = run_level(args, body, concurrency)
+        after = request(get_connection(args), 'GET', '/metrics')
+        batches = {k: after['batch_size_hist'].get(k, 0) - before['batch_size_hist'].get(k, 0)
+                   for k in after['batch_size_hist']}
+        num_batches = sum(batches.values())
+        avg_batch = sum(int(k) * v for k, v in batches.items()) / max(num_batches, 1)
+        print('{:>11d} | {:>10.2f} | {:>8.3f} | {:>8.3f} | {:>9.2f}'.format(concurrency, throughput, p50, p99, avg_batch))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--unix_socket', default='')
+    parser.add_argument('--image', default='', help='image to send, random noise if empty.')
+    parser.add_argument('--frame_h', type=int, default=1500)
+    parser.add_argument('--frame_w', type=int, default=2000)
+    parser.add_argument('--concurrency', default='1,2,4,8')
+    parser.add_argument('--requests_per_client', type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,168 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Low-rank (SVD / Tucker-2) factorization of the heavy convolutions, with an accuracy-gated search: layer groups
+# (head 3x3 convs, first deconv, stage3 convs after RepVGG fusion) are factorized at the lowest energy threshold
+# that keeps the val mAP within --lr_tolerance of the original, layers whose factorization is not faster on
+# this CPU at --input_res are left alone. The factorized checkpoint loads with create_model + load_model.
+# python tools/low_rank.py --dataset VisDrone2019DET --arch DREB_Net --inp_sharp_or_blur SB_deblur --input_res 1024 \
+#     --gpus -1 --load_model ./exp/detect/train/train_DREB_Net_model/model_best.pth --lr_method svd \
+#     --lr_groups heads,deconv,stage3 --lr_tolerance 0.005 --lr_output ./exp/DREB_Net_low_rank.pth
+import copy
+import json
+import os
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.detectors.detector_factory import detector_factory
+from lib.models.model import create_model, load_model, save_model
+from lib.models.deploy import prepare_model
+from lib.models.low_rank import factorize, macs_ratio
+
+
+def layer_groups(opt, model):
+    groups = {'heads': ['{}.0'.format(head) for head in opt.heads if isinstance(getattr(model, head), nn.Sequential)],
+              'deconv': ['deconv_layers1.0'],
+              'stage3': ['stage3.{}.rbr_reparam'.format(i) for i in range(len(model.stage3))]}
+    return [(name, groups[name]) for name in opt.lr_groups.split(',')]
+
+
+def timeit(module, x, reps):
+    with torch.no_grad():
+        module(x)
+        start_time = time.time()
+        for _ in range(reps):
+            module(x)
+    return (time.time() - start_time) / reps
+
+
+def layer_inputs(opt, model, names):
+    inputs = {}
+    def save_input(name):
+        def hook(m, i):
+            inputs[name] = i[0]
+        return hook
+    hooks = [model.get_submodule(name).register_forward_pre_hook(save_input(name)) for name in names]
+    with torch.no_grad():
+        model(torch.randn(1, 3, opt.input_res, opt.input_res).to(opt.device))
+    for h in hooks:
+        h.remove()
+    return inputs
+
+
+def factorized_model(model, choices, repvgg):
+    '''copy of `model` with the layers in `choices` {name: (method, ranks)} factorized, and its low_rank spec'''
+    model = copy.deepcopy(model)
+    for name, (method, ranks) in choices.items():
+        parent_name, _, child = name.rpartition('.')
+        parent = model.get_submodule(parent_name)
+        parent._modules[child], _ = factorize(parent._modules[child], method, ranks=ranks)
+    model.low_rank = {'repvgg': repvgg, 'layers': {name: {'method': method, 'ranks': ranks}
+                                                   for name, (method, ranks) in choices.items()}}
+    return model
+
+
+def image_paths(opt, dataset):
+    paths = []
+    for img_id in dataset.images:
+        img_info = dataset.coco.loadImgs(ids=[img_id])[0]
+        img_dir = dataset.sharp_img_dir if opt.inp_sharp_or_blur == 'sharp' else dataset.blur_img_dir
+        paths.append((img_id, os.path.join(img_dir, img_info['file_name'])))
+    return paths
+
+
+def evaluate(opt, dataset, detector, model, paths, name):
+    detector.model = prepare_model(copy.deepcopy(model), [t for t in opt.deploy_transforms.split(',') if t != ''])
+    results = {}
+    for img_id, path in paths:
+        results[img_id] = detector.run(path)['results']
+    save_dir = os.path.join(opt.save_dir, 'low_rank', name)
+    os.makedirs(save_dir, exist_ok=True)
+    return float(dataset.run_eval(results, save_dir)[0])
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    dataset = Dataset(opt, 'val')
+    paths = image_paths(opt, dataset)
+    detector = detector_factory[opt.detector](opt)
+    detector.result_cache = None
+
+    model = create_model(opt.arch, opt.heads, opt.head_conv)
+    if opt.load_model != '':
+        model = load_model(model, opt.load_model)
+    model = model.to(opt.device).eval()
+    groups = [g[0] for g in layer_groups(opt, model)]
+    repvgg = 'stage3' in groups
+    if repvgg:
+        # the 3x3 of a RepVGG block is only a plain conv after fusing its branches
+        model = prepare_model(model, ['repvgg'])
+    groups = layer_groups(opt, model)
+    inputs = layer_inputs(opt, model, [name for _, names in groups for name in names])
+    energies = sorted(float(e) for e in opt.lr_energies.split(','))
+
+    base_map = evaluate(opt, dataset, detector, model, paths, 'original')
+    print('original mAP {:.4f}, tolerance {}'.format(base_map, opt.lr_tolerance))
+    accepted, report = {}, []
+    for group, names in groups:
+        original_time = {name: timeit(model.get_submodule(name), inputs[name], opt.reps) for name in names}
+        for energy in energies:
+            # lowest energy first: the fastest factorization that keeps the accuracy wins
+            trial = {}
+            for name in names:
+                module = model.get_submodule(name)
+                layers, ranks = factorize(module, opt.lr_method, energy)
+                if macs_ratio(module, ranks, opt.lr_method) >= 1:
+                    continue
+                if timeit(layers, inputs[name], opt.reps) < original_time[name]:
+                    trial[name] = ('svd' if isinstance(module, nn.ConvTranspose2d) else opt.lr_method, ranks)
+            if len(trial) == 0:
+                continue
+            trial_map = evaluate(opt, dataset, detector, factorized_model(model, dict(accepted, **trial), repvgg),
+                                 paths, '{}_{:g}'.format(group, energy))
+            print('{} energy {:g}: {} layers factorized, mAP {:.4f}'.format(group, energy, len(trial), trial_map))
+            if trial_map >= base_map - opt.lr_tolerance:
+                accepted.update(trial)
+                report.append({'group': group, 'energy': energy, 'mAP': trial_map,
+                               'ranks': {name: ranks for name, (_, ranks) in trial.items()}})
+                break
+
+    factorized = factorized_model(model, accepted, repvgg)
+    transforms = [t for t in opt.deploy_transforms.split(',') if t != '']
+    x = torch.randn(1, 3, opt.input_res, opt.input_res).to(opt.device)
+    original_latency = timeit(prepare_model(copy.deepcopy(model), transforms), x, opt.reps)
+    factorized_latency = timeit(prepare_model(copy.deepcopy(factorized), transforms), x, opt.reps)
+    final_map = evaluate(opt, dataset, detector, factorized, paths, 'final') if len(accepted) > 0 else base_map
+
+    for r in report:
+        print('{group}: energy {energy:g}, mAP {mAP:.4f}, ranks {ranks}'.format(**r))
+    print('latency {:.1f}ms -> {:.1f}ms ({:.2f}x), mAP {:.4f} -> {:.4f}'.format(
+        original_latency * 1000, factorized_latency * 1000, original_latency / factorized_latency, base_map, final_map))
+    if opt.lr_output != '':
+        save_model(opt.lr_output, 0, factorized)
+        print('saved {}'.format(opt.lr_output))
+    with open(os.path.join(opt.save_dir, 'low_rank.json'), 'w') as f:
+        json.dump({'report': report, 'original_mAP': base_map, 'mAP': final_map,
+                   'original_latency': original_latency, 'latency': factorized_latency}, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--lr_method', default='svd', choices=['svd', 'tucker'],
+                               help='factorization of the Conv2d layers (ConvTranspose2d always use svd).')
+    parser.parser.add_argument('--lr_groups', default='heads,deconv,stage3', help='layer groups searched, in order: heads | deconv | stage3')
+    parser.parser.add_argument('--lr_energies', default='0.8,0.9,0.95,0.98', help='singular value energy thresholds tried.')
+    parser.parser.add_argument('--lr_tolerance', type=float, default=0.005, help='largest val mAP drop accepted.')
+    parser.parser.add_argument('--lr_output', default='', help='path of the factorized checkpoint.')
+    parser.parser.add_argument('--reps', type=int, default=5, help='timed forwards per layer / model.')
+    main(parser.parse())
@@ -0,0 +1,55 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Packs the (sharp JPEG, blur JPEG, annotations) of every image of --pack_splits into --shard_size MB shard files
+# plus an index (lib/utils/shards.py), read by main.py with --shards. The JPEG bytes are copied, not re-encoded.
+# python tools/pack_shards.py --dataset visdrone --sharp_data_dir ../dataset/VisDrone \
+#     --blur_data_dir ../dataset/VisDrone_blur --shards ../dataset/VisDrone_shards --shard_size 1024
+import os
+import sys
+import time
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.utils.shards import ShardWriter
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def pack(opt, Dataset, split):
+    dataset = Dataset(opt, split)
+    dirs = {'sharp': dataset.sharp_img_dir, 'blur': dataset.blur_img_dir}
+    writer = ShardWriter(opt.shards, split, dirs, int(opt.shard_size * 2 ** 20))
+    start_time = time.time()
+    for i, img_id in enumerate(dataset.images):
+        file_name = dataset.coco.loadImgs(ids=[img_id])[0]['file_name']
+        anns = dataset.coco.loadAnns(ids=dataset.coco.getAnnIds(imgIds=[img_id]))
+        writer.add(img_id, read_bytes(os.path.join(dirs['sharp'], file_name)),
+                   read_bytes(os.path.join(dirs['blur'], file_name)), anns)
+        if (i + 1) % 1000 == 0:
+            print('{} {}/{} images, {:.1f} images/s'.format(split, i + 1, len(dataset.images), (i + 1) / (time.time() - start_time)))
+    writer.close()
+    print('{}: {} images in {} shards, {:.1f}GB'.format(split, writer.index['num_records'], len(writer.index['shards']),
+                                                      sum(s['bytes'] for s in writer.index['shards']) / 2 ** 30))
+
+
+def main(opt):
+    if opt.shards == '':
+        raise ValueError('set --shards to the output directory')
+    Dataset = dataset_factory[opt.dataset]
+    for split in opt.pack_splits.split(','):
+        pack(opt, Dataset, split)
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--pack_splits', default='train,val', help='comma separated splits to pack.')
+    parser.parser.add_argument('--shard_size', type=float, default=1024, help='MB per shard file.')
+    main(parser.parse())
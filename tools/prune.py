@@ -0,0 +1,125 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Structured channel pruning of the RepVGG stages 3 and 4. Channels are ranked by BatchNorm gamma (bn) or by
+# the mean SE gate over --calib_images images of the val split (se), the least important --prune_ratios of
+# them are removed, and each pruned model is saved with its arch string, timed and evaluated (mAP on the val
+# split). Fine-tune a pruned model with the printed main.py command.
+# python tools/prune.py --dataset VisDrone2019DET --arch DREB_Net --inp_sharp_or_blur SB_deblur --input_res 1024 \
+#     --load_model ./exp/detect/train/train_DREB_Net_model/model_best.pth --prune_criterion se --prune_ratios 0.25,0.5
+import copy
+import json
+import os
+import sys
+import time
+
+import cv2
+import torch
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.opts import opts
+from lib.datasets.dataset_factory import dataset_factory
+from lib.detectors.detector_factory import detector_factory
+from lib.models.model import create_model, load_model, save_model
+from lib.models.deploy import prepare_model
+from lib.models.prune import bn_importance, SEStatistics, prune_model, _prunable_stages
+
+
+def image_paths(opt, dataset):
+    paths = []
+    for img_id in dataset.images:
+        img_info = dataset.coco.loadImgs(ids=[img_id])[0]
+        img_dir = dataset.sharp_img_dir if opt.inp_sharp_or_blur == 'sharp' else dataset.blur_img_dir
+        paths.append((img_id, os.path.join(img_dir, img_info['file_name'])))
+    return paths
+
+
+def se_importance(model, detector, paths):
+    stats = SEStatistics(model)
+    with torch.no_grad():
+        for _, path in paths:
+            images, _ = detector.pre_process(cv2.imread(path), 1)
+            model(images.to(detector.opt.device))
+    stats.remove()
+    return {stage: stats.importance(stage) for stage in _prunable_stages}
+
+
+def latency(opt, model):
+    x = torch.randn(1, 3, opt.input_res, opt.input_res).to(opt.device)
+    with torch.no_grad():
+        model(x)
+        start_time = time.time()
+        for _ in range(opt.reps):
+            model(x)
+    if opt.device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - start_time) / opt.reps
+
+
+def evaluate(opt, dataset, detector, model, paths, save_dir):
+    detector.model = model
+    results = {}
+    for img_id, path in paths:
+        results[img_id] = detector.run(path)['results']
+    return dataset.run_eval(results, save_dir)
+
+
+def main(opt):
+    Dataset = dataset_factory[opt.dataset]
+    opt = opts().update_dataset_info_and_set_heads(opt, Dataset)
+    dataset = Dataset(opt, 'val')
+    paths = image_paths(opt, dataset)
+    detector = detector_factory[opt.detector](opt)
+    detector.result_cache = None
+    transforms = [t for t in opt.deploy_transforms.split(',') if t != '']
+
+    model = create_model(opt.arch, opt.heads, opt.head_conv)
+    if opt.load_model != '':
+        model = load_model(model, opt.load_model)
+    model = model.to(opt.device).eval()
+    if opt.prune_criterion == 'se':
+        importance = se_importance(model, detector, paths[:opt.calib_images])
+    else:
+        importance = {stage: bn_importance(model, stage) for stage in _prunable_stages}
+
+    rows = []
+    for ratio in [0.] + [float(r) for r in opt.prune_ratios.split(',')]:
+        if ratio == 0:
+            pruned, arch = model, opt.arch
+        else:
+            pruned, arch = prune_model(model.cpu(), opt.arch, opt.heads, opt.head_conv, importance, ratio)
+            model.to(opt.device)
+            path = os.path.join(opt.save_dir, 'pruned_{:g}.pth'.format(ratio))
+            save_model(path, 0, pruned)
+            print('saved {} ({}), fine-tune with:\n    python main.py --dataset {} --arch {} --load_model {} '
+                  '--exp_id {}_pruned_{:g}'.format(path, arch, opt.dataset, arch, path, opt.exp_id, ratio))
+        deployed = prepare_model(copy.deepcopy(pruned).to(opt.device), transforms)
+        row = {'ratio': ratio, 'arch': arch, 'params': sum(p.numel() for p in pruned.parameters()),
+               'latency': latency(opt, deployed)}
+        if not opt.prune_no_eval:
+            save_dir = os.path.join(opt.save_dir, 'pruned_{:g}'.format(ratio))
+            os.makedirs(save_dir, exist_ok=True)
+            row['mAP'], row['AP50'] = [float(s) for s in evaluate(opt, dataset, detector, deployed, paths, save_dir)[:2]]
+        rows.append(row)
+
+    print('{:>6} | {:<32} | {:>9} | {:>11} | {:>6} | {:>6}'.format('ratio', 'arch', 'params(M)', 'latency(ms)', 'mAP', 'AP50'))
+    for r in rows:
+        print('{:>6g} | {:<32} | {:>9.2f} | {:>11.1f} | {:>6} | {:>6}'.format(
+            r['ratio'], r['arch'], r['params'] / 1e6, r['latency'] * 1000,
+            '{:.3f}'.format(r['mAP']) if 'mAP' in r else '-', '{:.3f}'.format(r['AP50']) if 'AP50' in r else '-'))
+    with open(os.path.join(opt.save_dir, 'prune.json'), 'w') as f:
+        json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = opts()
+    parser.parser.add_argument('--prune_criterion', default='bn', choices=['bn', 'se'],
+                               help='channel importance: BatchNorm gamma, or mean SE gate over the calibration images.')
+    parser.parser.add_argument('--prune_ratios', default='0.25,0.5', help='fractions of the stage 3 / 4 channels removed.')
+    parser.parser.add_argument('--calib_images', type=int, default=200, help='val images used by the se criterion.')
+    parser.parser.add_argument('--prune_no_eval', action='store_true', help='skip the mAP evaluation.')
+    parser.parser.add_argument('--reps', type=int, default=5, help='timed forwards per pruning ratio.')
+    main(parser.parse())
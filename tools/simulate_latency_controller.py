@@ -0,0 +1,67 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Drives the LatencyController with synthetic latencies (no model needed) and checks that it
+# degrades under load, recovers afterwards and does not oscillate.
+# python tools/simulate_latency_controller.py --slo 80 --frames 3000
+import argparse
+import os
+import sys
+
+import numpy as np
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, '..'))
+
+from lib.detectors.latency_controller import LatencyController, parse_ladder
+
+
+def simulate(args):
+    ladder = parse_ladder(args.ladder)
+    # relative cost of each rung with --fix_res: one forward per scale, flip-test doubles the batch,
+    # compute scales with the input area
+    costs = np.array([len(r['test_scales']) * (2 if r['flip_test'] else 1) *
+                      (r['input_res'] / 1024.) ** 2 for r in ladder])
+    controller = LatencyController(ladder, args.slo / 1000., percentile=95, window=args.window)
+    rng = np.random.RandomState(0)
+
+    levels, latencies = [], []
+    for i in range(args.frames):
+        # background load: quiet, then a contention burst in the middle third, then quiet again
+        load = 2.5 if args.frames // 3 <= i < 2 * args.frames // 3 else 1.
+        latency = args.base_ms / 1000. * costs[controller.level] * load * rng.lognormal(0, 0.15)
+        levels.append(controller.level)
+        latencies.append(latency)
+        controller.update(latency)
+    return ladder, np.array(levels), np.array(latencies), controller
+
+
+def main(args):
+    ladder, levels, latencies, controller = simulate(args)
+    third = args.frames // 3
+    print('rungs:')
+    for i, r in enumerate(ladder):
+        print('  {} {}'.format(i, r))
+    for name, sl in (('quiet', slice(0, third)), ('burst', slice(third, 2 * third)),
+                     ('recovered', slice(2 * third, args.frames))):
+        lat = latencies[sl] * 1000
+        print('{:>10} | mean level {:.2f} | p95 {:.1f}ms | within slo {:.1f}%'.format(
+            name, levels[sl].mean(), np.percentile(lat, 95), 100 * (lat <= args.slo).mean()))
+    print('switches: {}'.format(controller.num_switches))
+
+    # the burst must push the controller to cheaper rungs and it must come back afterwards
+    assert levels[third:2 * third].mean() > levels[:third].mean()
+    assert levels[-args.window:].mean() < levels[2 * third - args.window:2 * third].mean()
+    assert controller.num_switches < args.frames / args.window
+    print('ok')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ladder', default='1024/1,0.75/flip;1024/1/flip;1024/1;768/1;512/1')
+    parser.add_argument('--slo', type=float, default=80, help='p95 target in ms')
+    parser.add_argument('--base_ms', type=float, default=35, help='latency of one 1024 forward pass in ms')
+    parser.add_argument('--frames', type=int, default=3000)
+    parser.add_argument('--window', type=int, default=30)
+    main(parser.parse_args())